@@ -0,0 +1,46 @@
+"""MIDIGenerator.generate time per backend on a large repeated score."""
+
+import argparse
+import random
+import time
+
+from midiscript.lexer import Lexer
+from midiscript.midi_generator import MIDIGenerator
+from midiscript.parser import Parser
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--body", type=int, default=2000, help="notes per verse")
+    arg_parser.add_argument("--verses", type=int, default=500)
+    arg_parser.add_argument(
+        "--backends", nargs="+", default=["smf", "numpy", "midiutil"]
+    )
+    args = arg_parser.parse_args()
+
+    rng = random.Random(0)
+    notes = ("C4", "D4", "E4", "G#3", "Bb5")
+    body = " ".join(
+        f"{rng.choice(notes)} 1/{rng.choice((4, 8, 16))}" for _ in range(args.body)
+    )
+    source = "sequence verse { %s }\nsequence main { %s }\nplay main" % (
+        body,
+        "verse " * args.verses,
+    )
+    program = Parser(Lexer(source).token_stream()).parse()
+    total = args.body * args.verses
+    print(f"{total:,} notes")
+
+    for backend in args.backends:
+        generator = MIDIGenerator(backend=backend)
+        start = time.perf_counter()
+        data = generator.generate(program)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{backend:>9}: {elapsed:8.2f} s  ({total / elapsed:,.0f} notes/s, "
+            f"{len(data):,} bytes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
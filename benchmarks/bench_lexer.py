@@ -0,0 +1,63 @@
+"""Lexer throughput in tokens per second for both lexing engines."""
+
+import argparse
+import random
+import timeit
+import tracemalloc
+
+from midiscript.lexer import Lexer
+
+
+def synthetic_score(sequences: int, events: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    notes = [
+        f"{name}{octave}"
+        for name in ("C", "D#", "Eb", "F", "G", "Bb")
+        for octave in range(2, 7)
+    ]
+    durations = ("1/4", "1/8", "1/16", "1/2", "3/8")
+    lines = ["tempo 120", "time 4/4", ""]
+    for index in range(sequences):
+        lines.append(f"sequence part{index} {{")
+        for _ in range(events):
+            if rng.random() < 0.2:
+                chord = " ".join(rng.sample(notes, 3))
+                lines.append(f"    [{chord}] {rng.choice(durations)}")
+            else:
+                lines.append(f"    {rng.choice(notes)} {rng.choice(durations)}")
+        lines.append("}")
+    lines.append("play part0")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sequences", type=int, default=200)
+    arg_parser.add_argument("--events", type=int, default=200)
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    source = synthetic_score(args.sequences, args.events)
+    count = len(Lexer(source).tokenize())
+    print(f"source: {len(source):,} bytes, {count:,} tokens")
+
+    engines = (
+        ("stream", lambda: Lexer(source).token_stream()),
+        ("regex", lambda: Lexer(source).tokenize()),
+        ("by char", lambda: list(Lexer(source).iter_tokens_by_char())),
+    )
+    for name, run in engines:
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        tracemalloc.start()
+        tokens = run()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tokens
+        print(
+            f"{name:>8}: {best * 1000:8.1f} ms  ({count / best:,.0f} tokens/s, "
+            f"{size / count:.0f} bytes/token)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Memory held by a parsed program of a million events.
+
+The token stream is built first; the figures are what parsing adds on top
+of it: bytes traced by tracemalloc while the program is alive, and the
+growth of the resident set size (Linux only).
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from corpus import events, score
+from midiscript.lexer import Lexer
+from midiscript.parser import Parser
+
+
+def resident_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return 0
+    import mmap
+
+    return pages * mmap.PAGESIZE
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--events", type=int, default=1_000_000)
+    arg_parser.add_argument("--sequences", type=int, default=100)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    per_sequence = max(1, args.events // args.sequences)
+    sequences = {f"part{i}": events(rng, per_sequence) for i in range(args.sequences)}
+    sequences["main"] = [" ".join(sequences)]
+    source = score(sequences, "main")
+    stream = Lexer(source).token_stream()
+    del source
+    count = per_sequence * args.sequences
+    print(f"{count:,} events, {len(stream):,} tokens")
+
+    gc.collect()
+    before = resident_bytes()
+    start = time.perf_counter()
+    program = Parser(stream).parse()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    resident = resident_bytes() - before
+    del program
+    gc.collect()
+
+    tracemalloc.start()
+    program = Parser(stream).parse()
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"parse:    {elapsed * 1000:10.1f} ms")
+    print(f"traced:   {traced / 2**20:10.1f} MiB  ({traced / count:.1f} bytes/event)")
+    if before:
+        print(
+            f"resident: {resident / 2**20:10.1f} MiB  "
+            f"({resident / count:.1f} bytes/event)"
+        )
+    assert len(program.sequences) == args.sequences + 1
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compare loading a precompiled .msc program with lexing and parsing text."""
+
+import argparse
+import os
+import tempfile
+import timeit
+
+from corpus import SCENARIOS
+from midiscript.lexer import Lexer
+from midiscript.midi_generator import MIDIGenerator
+from midiscript.msc import load_msc, write_msc
+from midiscript.parser import Parser
+
+
+def parse_text(path):
+    with open(path, "r") as f:
+        return Parser(Lexer(f.read()).token_stream()).parse()
+
+
+def best(run, repeat):
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument(
+        "--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS)
+    )
+    arg_parser.add_argument("--scale", type=float, default=1.0)
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    print(
+        f"{'scenario':<18}{'text KB':>9}{'msc KB':>9}{'parse ms':>10}"
+        f"{'load ms':>10}{'speed-up':>10}{'text->mid':>11}{'msc->mid':>10}"
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.scenarios:
+            source_path = os.path.join(workdir, f"{name}.ms")
+            msc_path = os.path.join(workdir, f"{name}.msc")
+            with open(source_path, "w") as f:
+                f.write(SCENARIOS[name](args.scale, 0))
+            with open(msc_path, "wb") as f:
+                write_msc(parse_text(source_path), f, source_path)
+
+            parse = best(lambda: parse_text(source_path), args.repeat)
+            load = best(lambda: load_msc(msc_path), args.repeat)
+            # Whole render, from the file on disk to MIDI bytes
+            text_total = best(
+                lambda: MIDIGenerator().generate(parse_text(source_path)), args.repeat
+            )
+            msc_total = best(
+                lambda: MIDIGenerator().generate(load_msc(msc_path)), args.repeat
+            )
+            print(
+                f"{name:<18}{os.path.getsize(source_path) / 1024:9.0f}"
+                f"{os.path.getsize(msc_path) / 1024:9.0f}"
+                f"{parse * 1000:10.1f}{load * 1000:10.2f}{parse / load:9.0f}x"
+                f"{text_total * 1000:11.1f}{msc_total * 1000:10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
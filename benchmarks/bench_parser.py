@@ -0,0 +1,51 @@
+"""Parse time with tracing disabled and enabled, and with lazy parsing."""
+
+import argparse
+import logging
+import timeit
+
+from bench_lexer import synthetic_score
+from midiscript.lexer import Lexer
+from midiscript.parser import LoggingListener, Parser
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sequences", type=int, default=200)
+    arg_parser.add_argument("--events", type=int, default=200)
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    source = synthetic_score(args.sequences, args.events)
+    stream = Lexer(source).token_stream()
+    print(f"source: {len(source):,} bytes, {len(stream):,} tokens")
+
+    # A logger with a handler but filtered above DEBUG measures the cost of
+    # building trace records without any output I/O.
+    logger = logging.getLogger("bench.parser")
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    counts = []
+
+    # Parser options per row; the synthetic score plays one sequence that
+    # references no others, so the lazy parser indexes the rest and skips them.
+    rows = (
+        ("disabled", {}),
+        ("counting", {"listener": lambda event, token, detail: counts.append(event)}),
+        ("logging", {"listener": LoggingListener(logger)}),
+        ("lazy", {"lazy": True}),
+    )
+    for name, options in rows:
+        best = min(
+            timeit.repeat(
+                lambda: Parser(stream, **options).parse(),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(f"{name:>9}: {best * 1000:8.1f} ms  ({len(stream) / best:,.0f} tokens/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Compare the native SMF encoder with the midiutil round-trip."""
+
+import argparse
+import random
+import timeit
+
+from midiscript.smf import MIDIUtilWriter, SMFWriter
+
+
+def fill(writer, notes):
+    writer.add_tempo(0, 120)
+    writer.add_time_signature(0, 4, 4)
+    for tick, duration, pitch, velocity in notes:
+        writer.add_note(0, 0, pitch, tick, duration, velocity)
+    return writer.to_bytes()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("-n", "--notes", type=int, default=50_000)
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(0)
+    notes = []
+    tick = 0
+    for _ in range(args.notes):
+        duration = rng.choice((60, 120, 240, 480))
+        notes.append((tick, duration, rng.randint(36, 96), 100))
+        tick += duration
+
+    for name, writer_class in (("smf", SMFWriter), ("midiutil", MIDIUtilWriter)):
+        best = min(
+            timeit.repeat(
+                lambda: fill(writer_class(), notes), number=1, repeat=args.repeat
+            )
+        )
+        print(
+            f"{name:>9}: {best * 1000:8.1f} ms  " f"({args.notes / best:,.0f} notes/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
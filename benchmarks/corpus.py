@@ -0,0 +1,112 @@
+"""Deterministic synthetic MidiScript corpus for benchmarks.
+
+Every scenario is a function of a scale factor and a seed, so the same
+arguments always produce the same source text.
+"""
+
+import random
+from typing import Callable, Dict, List
+
+NOTES = [
+    f"{name}{octave}"
+    for name in ("C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B")
+    for octave in range(1, 8)
+]
+DURATIONS = ("1/4", "1/8", "1/16", "1/2", "3/8", "1/3")
+
+
+def events(rng: random.Random, count: int, chord_size: int = 3) -> List[str]:
+    out = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.2:
+            chord = " ".join(rng.sample(NOTES, chord_size))
+            out.append(f"[{chord}] {rng.choice(DURATIONS)}")
+        elif roll < 0.3:
+            out.append(f"R {rng.choice(DURATIONS)}")
+        else:
+            out.append(f"{rng.choice(NOTES)} {rng.choice(DURATIONS)}")
+    return out
+
+
+def score(sequences: Dict[str, List[str]], play: str) -> str:
+    lines = ["tempo 120", "time 4/4", ""]
+    for name, body in sequences.items():
+        lines.append(f"sequence {name} {{")
+        lines.extend(f"    {line}" for line in body)
+        lines.append("}")
+    lines.append(f"play {play}")
+    return "\n".join(lines) + "\n"
+
+
+def many_sequences(scale: float, seed: int = 0) -> str:
+    # Thousands of small sequences, each referenced once from main
+    rng = random.Random(seed)
+    count = max(1, int(2000 * scale))
+    sequences = {f"part{i}": events(rng, 20) for i in range(count)}
+    sequences["main"] = [" ".join(f"part{i}" for i in range(count))]
+    return score(sequences, "main")
+
+
+def deep_nesting(scale: float, seed: int = 0) -> str:
+    # A chain of sequences, each wrapping the next between a few notes
+    rng = random.Random(seed)
+    depth = max(1, int(200 * scale))
+    sequences = {}
+    for level in range(depth):
+        body = events(rng, 5)
+        if level + 1 < depth:
+            body.append(f"level{level + 1}")
+        body.extend(events(rng, 5))
+        sequences[f"level{level}"] = body
+    return score(sequences, "level0")
+
+
+def wide_chords(scale: float, seed: int = 0) -> str:
+    # Long run of 24-note chords
+    rng = random.Random(seed)
+    count = max(1, int(5000 * scale))
+    body = [
+        f"[{' '.join(rng.sample(NOTES, 24))}] {rng.choice(DURATIONS)}"
+        for _ in range(count)
+    ]
+    return score({"main": body}, "main")
+
+
+def heavy_repetition(scale: float, seed: int = 0) -> str:
+    # A short bar expanded hundreds of thousands of times through references
+    rng = random.Random(seed)
+    phrases = max(1, int(200 * scale))
+    sequences = {
+        "bar": events(rng, 16),
+        "phrase": ["bar " * 50],
+        "main": ["phrase " * phrases],
+    }
+    return score(sequences, "main")
+
+
+def deep_repeats(scale: float, seed: int = 0) -> str:
+    # A two-event bar played a hundred thousand times through nested repeats
+    rng = random.Random(seed)
+    plays = max(1, int(100 * scale))
+    sequences = {
+        "bar": events(rng, 2),
+        "main": [f"repeat {plays} {{ repeat 10 {{ repeat 100 {{ bar }} }} }}"],
+    }
+    return score(sequences, "main")
+
+
+def long_file(scale: float, seed: int = 0) -> str:
+    # One very long sequence, one event per line
+    rng = random.Random(seed)
+    return score({"main": events(rng, max(1, int(100_000 * scale)))}, "main")
+
+
+SCENARIOS: Dict[str, Callable[[float, int], str]] = {
+    "many_sequences": many_sequences,
+    "deep_nesting": deep_nesting,
+    "wide_chords": wide_chords,
+    "heavy_repetition": heavy_repetition,
+    "deep_repeats": deep_repeats,
+    "long_file": long_file,
+}
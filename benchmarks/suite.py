@@ -0,0 +1,229 @@
+"""Benchmark suite: time each compiler stage on the synthetic corpus.
+
+Stages are timed separately (median of --repeat runs, with their spread), with
+peak traced memory measured in an extra run. Results can be saved as a
+baseline, and later runs exit with status 1 when a stage is slower or larger
+than the baseline by more than the configured tolerance. A slowdown only counts
+when it also exceeds the run-to-run spread of the timings times --noise.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from corpus import SCENARIOS
+from midiscript.cli import main as cli_main
+from midiscript.lexer import Lexer
+from midiscript.midi_generator import MIDIGenerator
+from midiscript.parser import Parser
+
+STAGES = ("tokenize", "parse", "generate", "cli")
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def measure(run: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": statistics.median(samples),
+        "spread": max(samples) - min(samples),
+        "peak_bytes": peak,
+    }
+
+
+def count_notes(program) -> int:
+    generator = MIDIGenerator()
+    targets = generator.begin(program)
+    return sum(1 for target in targets for _ in generator.iter_notes(target))
+
+
+def run_scenario(
+    name: str,
+    source: str,
+    stages: List[str],
+    repeat: int,
+    workdir: str,
+    backend: str = "smf",
+) -> Dict[str, Dict[str, float]]:
+    tokens = Lexer(source).tokenize()
+    stream = Lexer(source).token_stream()
+    program = Parser(stream).parse()
+    notes = count_notes(program)
+    path = os.path.join(workdir, f"{name}.ms")
+    with open(path, "w") as f:
+        f.write(source)
+
+    def run_cli():
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                cli_main(
+                    [path, "-o", path + ".mid", "--no-cache", "--backend", backend]
+                )
+
+    runs = {
+        "tokenize": (lambda: Lexer(source).tokenize(), len(tokens), "tokens"),
+        "parse": (lambda: Parser(stream).parse(), len(tokens), "tokens"),
+        "generate": (
+            lambda: MIDIGenerator(backend).generate(program),
+            notes,
+            "notes",
+        ),
+        "cli": (run_cli, len(source), "bytes"),
+    }
+    results = {}
+    for stage in stages:
+        run, units, unit = runs[stage]
+        result = measure(run, repeat)
+        result["throughput"] = units / result["seconds"]
+        results[stage] = result
+        print(
+            f"{name:<18}{stage:<10}{result['seconds'] * 1000:10.1f} ms "
+            f"+/-{result['spread'] * 1000:6.1f} "
+            f"{result['throughput']:>14,.0f} {unit}/s "
+            f"{result['peak_bytes'] / 2**20:9.1f} MB peak"
+        )
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Any],
+    time_tolerance: float,
+    memory_tolerance: float,
+    noise: float = 0.0,
+) -> List[str]:
+    regressions = []
+    expected = baseline.get("results", {})
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            before = expected.get(name, {}).get(stage)
+            if before is None:
+                continue
+            slower = result["seconds"] / before["seconds"] - 1
+            floor = noise * max(before.get("spread", 0.0), result["spread"])
+            noticeable = result["seconds"] - before["seconds"] > floor
+            if slower > time_tolerance and noticeable:
+                regressions.append(
+                    f"{name} {stage}: {slower:+.0%} time "
+                    f"({before['seconds'] * 1000:.1f} -> "
+                    f"{result['seconds'] * 1000:.1f} ms)"
+                )
+            larger = result["peak_bytes"] / max(1, before["peak_bytes"]) - 1
+            if larger > memory_tolerance:
+                regressions.append(
+                    f"{name} {stage}: {larger:+.0%} peak memory "
+                    f"({before['peak_bytes']:,} -> {result['peak_bytes']:,} bytes)"
+                )
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument(
+        "--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS)
+    )
+    arg_parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    arg_parser.add_argument("--scale", type=float, default=1.0)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument(
+        "--backend",
+        choices=MIDIGenerator.BACKENDS,
+        default="smf",
+        help="MIDI encoder for the generate and cli stages",
+    )
+    arg_parser.add_argument("-r", "--repeat", type=int, default=7)
+    arg_parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    arg_parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store these results as the baseline instead of comparing",
+    )
+    arg_parser.add_argument(
+        "--time-tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown per stage before failing (0.25 = 25%%)",
+    )
+    arg_parser.add_argument(
+        "--memory-tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed growth in peak memory per stage before failing",
+    )
+    arg_parser.add_argument(
+        "--noise",
+        type=float,
+        default=2.0,
+        help="Ignore slowdowns within this many times the measured spread",
+    )
+    arg_parser.add_argument("--json", help="Also write results to this file")
+    args = arg_parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.scenarios:
+            source = SCENARIOS[name](args.scale, args.seed)
+            results[name] = run_scenario(
+                name, source, args.stages, args.repeat, workdir, args.backend
+            )
+
+    report = {
+        "scale": args.scale,
+        "seed": args.seed,
+        "backend": args.backend,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    recorded = (
+        baseline.get("scale"),
+        baseline.get("seed"),
+        baseline.get("backend", "smf"),
+    )
+    if recorded != (args.scale, args.seed, args.backend):
+        print("baseline was recorded with a different --scale, --seed or --backend")
+        sys.exit(2)
+    regressions = compare(
+        results,
+        baseline,
+        args.time_tolerance,
+        args.memory_tolerance,
+        args.noise,
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
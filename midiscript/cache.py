@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from . import __version__
+from .lexer import Buffer
+from .parser import Program
+
+# Bump when the layout, the pickled Program format or the generated MIDI
+# bytes change.
+CACHE_FORMAT = 5
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+MIDI_SUFFIX = ".mid"
+PROGRAM_SUFFIX = ".program"
+
+
+def default_cache_dir() -> Path:
+    configured = os.environ.get("MIDISCRIPT_CACHE_DIR")
+    if configured:
+        return Path(configured)
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache")
+    return Path(base).expanduser() / "midiscript"
+
+
+def cache_key(
+    source: Union[str, Buffer], options: Optional[Dict[str, Any]] = None
+) -> str:
+    digest = hashlib.sha256()
+    header = {"format": CACHE_FORMAT, "version": __version__, "options": options}
+    digest.update(json.dumps(header, sort_keys=True).encode())
+    digest.update(b"\0")
+    # Text is keyed by its UTF-8 bytes, so a mapped file and its decoded
+    # contents share entries.
+    digest.update(source.encode("utf-8") if isinstance(source, str) else source)
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """Content-addressed store of compiled MIDI bytes and parsed Programs.
+
+    Entries are keyed by a hash of the source text, the midiscript version and
+    the options that affect the output. Reading an entry refreshes its mtime,
+    and the least recently used entries are evicted once the directory grows
+    beyond ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path, None] = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        store_programs: bool = False,
+    ):
+        self.directory = Path(directory) if directory else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.store_programs = store_programs
+        # Lookups of compiled MIDI made through this instance
+        self.hits = 0
+        self.misses = 0
+        # Running estimate of the directory size, so eviction only rescans
+        # the directory once the bound is crossed.
+        self.size: Optional[int] = None
+
+    def path(self, key: str, suffix: str) -> Path:
+        return self.directory / key[:2] / (key + suffix)
+
+    def read(self, key: str, suffix: str) -> Optional[bytes]:
+        path = self.path(key, suffix)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def write(self, key: str, suffix: str, data: bytes) -> None:
+        path = self.path(key, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and rename it into place so concurrent
+        # compiles never observe a partial entry.
+        fd, temp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def get_midi(self, key: str) -> Optional[bytes]:
+        data = self.read(key, MIDI_SUFFIX)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put_midi(self, key: str, data: bytes) -> None:
+        self.write(key, MIDI_SUFFIX, data)
+
+    def get_program(self, key: str) -> Optional[Program]:
+        if not self.store_programs:
+            return None
+        data = self.read(key, PROGRAM_SUFFIX)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
+
+    def put_program(self, key: str, program: Program) -> None:
+        if not self.store_programs:
+            return
+        self.write(key, PROGRAM_SUFFIX, pickle.dumps(program, pickle.HIGHEST_PROTOCOL))
+
+    def entries(self) -> List[Tuple[float, int, Path]]:
+        # (mtime, size, path) for every entry on disk
+        entries: List[Tuple[float, int, Path]] = []
+        if not self.directory.is_dir():
+            return entries
+        for path in self.directory.glob("*/*"):
+            if path.suffix not in (MIDI_SUFFIX, PROGRAM_SUFFIX):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        self.size = total
+
+    def clear(self) -> None:
+        for _, _, path in self.entries():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self.entries()
+        return {
+            "directory": str(self.directory),
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,69 @@
+"""Validation without MIDI generation (``midiscript --check``).
+
+A check lexes and parses with error recovery, then resolves sequence
+references and looks for circular ones. Nothing is compiled, so neither the
+generator nor any MIDI backend is imported.
+"""
+
+from typing import Dict, Iterator, List, Set, Union
+
+from .lexer import Buffer, Lexer, map_source
+from .parser import Parser, Program, sequence_refs
+
+
+def reference_errors(program: Program) -> List[str]:
+    errors = []
+    references: Dict[str, List[str]] = {}
+    for name, sequence in program.sequences.items():
+        references[name] = list(dict.fromkeys(sequence_refs(sequence.events)))
+        for callee in references[name]:
+            if callee not in program.sequences:
+                errors.append(
+                    f"Referenced sequence '{callee}' not found "
+                    f"(referenced from sequence '{name}')"
+                )
+    for target in program.tracks:
+        if target.sequence not in program.sequences:
+            errors.append(f"Sequence '{target.sequence}' not found")
+
+    # Depth-first search with an explicit stack, so deep chains of
+    # references cannot overflow the interpreter stack. Each cycle is
+    # reported once, from the first of its sequences that the search enters.
+    done: Set[str] = set()
+    for root in references:
+        if root in done:
+            continue
+        path = [root]
+        on_path = {root}
+        stack: List[Iterator[str]] = [iter(references[root])]
+        while stack:
+            for callee in stack[-1]:
+                if callee in on_path:
+                    cycle = path[path.index(callee) :] + [callee]
+                    errors.append(
+                        f"Circular reference detected in sequence '{callee}' "
+                        f"({' -> '.join(cycle)})"
+                    )
+                elif callee not in done and callee in references:
+                    path.append(callee)
+                    on_path.add(callee)
+                    stack.append(iter(references[callee]))
+                    break
+            else:
+                stack.pop()
+                done.add(path[-1])
+                on_path.discard(path.pop())
+    return errors
+
+
+def check_source(source: Union[str, Buffer]) -> List[str]:
+    """Every lexical, syntax and reference error in the source, in one pass."""
+    lexer = Lexer(source, recover=True)
+    tokens = lexer.token_stream()
+    parser = Parser(tokens, recover=True)
+    program = parser.parse()
+    return lexer.errors + parser.errors + reference_errors(program)
+
+
+def check_file(path: str) -> List[str]:
+    return check_source(map_source(path))
@@ -1,65 +1,666 @@
 import argparse
+import contextlib
+import functools
+import glob
+import os
 import sys
 from pathlib import Path
-from .lexer import Lexer
-from .parser import Parser
-from .midi_generator import MIDIGenerator
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
+# The compiler modules are imported where a stage first needs them, so that
+# --help and argument errors stay fast.
+if TYPE_CHECKING:
+    from .cache import CompileCache
+    from .parser import ParseListener
+    from .playback import JitterStats
+    from .profiling import Profiler
+
+# Copies of MIDIGenerator.BACKENDS, profiling.PROFILE_FORMATS,
+# cache.DEFAULT_MAX_BYTES and msc.MSC_SUFFIX, kept here so building the
+# argument parser does not import those modules.
+BACKENDS = ("smf", "midiutil", "numpy")
+PROFILE_FORMATS = ("text", "json", "cprofile")
+DEFAULT_CACHE_MB = 256
+MSC_SUFFIX = ".msc"
+
+# Output formats for --emit and their file suffixes
+EMIT_SUFFIXES = {"midi": ".mid", "msc": MSC_SUFFIX}
+
+# (input path, output path, backend, cache directory or None, cache size,
+# cache parsed programs, stream output, output format, lazy parsing) for one
+# file of a batch
+Job = Tuple[str, str, str, Optional[str], int, bool, bool, str, bool]
+
+# Output path meaning standard output
+STDOUT = "-"
+
+
+def write_output(output_file: str, data: bytes) -> None:
+    if output_file == STDOUT:
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    else:
+        with open(output_file, "wb") as f:
+            f.write(data)
+
+
+def stage(profiler: Optional["Profiler"], name: str) -> ContextManager[Dict[str, int]]:
+    if profiler is None:
+        return contextlib.nullcontext({})
+    return profiler.stage(name)
+
+
+def compile_file(
+    input_file: str,
+    output_file: str,
+    backend: str = "smf",
+    listener: Optional["ParseListener"] = None,
+    cache: Optional["CompileCache"] = None,
+    stream: bool = False,
+    workers: int = 1,
+    profiler: Optional["Profiler"] = None,
+    emit: str = "midi",
+    lazy: bool = False,
+) -> bool:
+    # Returns True when the output came from the cache
+    from .cache import cache_key
+    from .lexer import Lexer, map_source
+    from .midi_generator import AnyProgram, MIDIGenerator
+    from .parser import Parser, Program
+
+    to_stdout = output_file == STDOUT
+    program: Optional[AnyProgram] = None
+
+    if input_file.endswith(MSC_SUFFIX):
+        from .msc import load_program
+
+        if emit == "msc":
+            raise ValueError(f"'{input_file}' is already compiled")
+        cache = None  # cache keys are derived from source text
+        with stage(profiler, "load") as counts:
+            program = load_program(input_file)
+            counts["sequences"] = len(program.sequences)
+    else:
+        # Lexed as bytes straight from the mapped file, never decoded whole
+        source = map_source(input_file)
+
+        # A lazy parse skips unreachable sequences, so it may succeed where
+        # a full parse fails; its results are cached separately.
+        options = {"lazy": True} if lazy else {}
+        if cache is not None and emit == "midi":
+            midi_key = cache_key(source, {"backend": backend, **options})
+            midi_data = cache.get_midi(midi_key)
+            if midi_data is not None:
+                write_output(output_file, midi_data)
+                return True
+
+        parsed: Optional[Program] = None
+        if cache is not None:
+            program_key = cache_key(source, options or None)
+            parsed = cache.get_program(program_key)
+
+        if parsed is None:
+            # Keep parser diagnostics out of the MIDI data on standard output
+            with contextlib.redirect_stdout(sys.stderr if to_stdout else sys.stdout):
+                with stage(profiler, "tokenize") as counts:
+                    lexer = Lexer(source)
+                    tokens = lexer.token_stream()
+                    counts["bytes"] = len(source)
+                    counts["tokens"] = len(tokens)
+
+                with stage(profiler, "parse") as counts:
+                    parser = Parser(tokens, listener=listener, lazy=lazy)
+                    parsed = parser.parse()
+                    counts["sequences"] = len(parsed.sequences)
+                    if lazy:
+                        counts["sequences skipped"] = len(parser.unreachable)
+                    counts["events"] = sum(
+                        len(sequence.events) for sequence in parsed.sequences.values()
+                    )
+                if parser.unreachable:
+                    print(
+                        f"Skipped {len(parser.unreachable)} unreachable "
+                        f"sequence(s): {', '.join(parser.unreachable)}"
+                    )
+            if parser.errors:
+                raise SyntaxError("; ".join(parser.errors))
+            if cache is not None:
+                cache.put_program(program_key, parsed)
+
+        if emit == "msc":
+            from .msc import write_msc
+
+            source_path = os.path.abspath(input_file)
+            with stage(profiler, "write") as counts:
+                if to_stdout:
+                    write_msc(parsed, sys.stdout.buffer, source_path)
+                    sys.stdout.buffer.flush()
+                else:
+                    with open(output_file, "wb") as f:
+                        write_msc(parsed, f, source_path)
+                        counts["bytes"] = f.tell()
+            return False
+        program = parsed
+
+    # Generate MIDI
+    generator = MIDIGenerator(backend=backend, workers=workers)
+    if stream or to_stdout:
+        # Encoded incrementally with bounded memory; not cached, since the
+        # whole file never exists in memory.
+        with stage(profiler, "stream") as counts:
+            if to_stdout:
+                generator.write_stream(program, sys.stdout.buffer)
+                sys.stdout.buffer.flush()
+            else:
+                with open(output_file, "wb") as f:
+                    generator.write_stream(program, f)
+                    counts["bytes"] = f.tell()
+        return False
+
+    with stage(profiler, "generate") as counts:
+        generator.render(program)
+        counts["tracks"] = len(generator.play_targets(program))
+        counts["sequences compiled"] = generator.cache_misses
+        counts["notes"] = generator.note_count
+
+    # Write output file straight from the encoder's buffer
+    with stage(profiler, "write") as counts:
+        if cache is None:
+            with open(output_file, "wb") as f:
+                generator.midi.write(f)
+                counts["bytes"] = f.tell()
+        else:
+            midi_data = generator.midi.to_bytes()
+            with open(output_file, "wb") as f:
+                f.write(midi_data)
+            cache.put_midi(midi_key, midi_data)
+            counts["bytes"] = len(midi_data)
+    return False
+
+
+def play_file(input_file: str, sink: str, speed: float = 1.0) -> "JitterStats":
+    from .lexer import Lexer, map_source
+    from .midi_generator import AnyProgram
+    from .parser import Parser
+    from .playback import open_sink, play
+
+    program: AnyProgram
+    if input_file.endswith(MSC_SUFFIX):
+        from .msc import load_program
+
+        program = load_program(input_file)
+    else:
+        parser = Parser(Lexer(map_source(input_file)).token_stream())
+        program = parser.parse()
+        if parser.errors:
+            raise SyntaxError("; ".join(parser.errors))
+    return play(program, open_sink(sink), speed)
+
+
+def compile_job(job: Job) -> Tuple[str, str, Optional[str], bool]:
+    (
+        input_file,
+        output_file,
+        backend,
+        cache_dir,
+        cache_size,
+        programs,
+        stream,
+        emit,
+        lazy,
+    ) = job
+    cache = None
+    if cache_dir is not None:
+        from .cache import CompileCache
+
+        cache = CompileCache(cache_dir, cache_size, store_programs=programs)
+    try:
+        cached = compile_file(
+            input_file,
+            output_file,
+            backend,
+            cache=cache,
+            stream=stream,
+            emit=emit,
+            lazy=lazy,
+        )
+    except FileNotFoundError:
+        return input_file, output_file, f"Could not find file '{input_file}'", False
+    except Exception as e:
+        return input_file, output_file, str(e), False
+    return input_file, output_file, None, cached
+
+
+def expand_inputs(patterns: List[str]) -> Iterator[Tuple[Path, Path]]:
+    # Yields (input file, base directory) pairs; outputs written to --out-dir
+    # keep their path relative to the base.
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            for source in sorted(path.rglob("*.ms")):
+                yield source, path
+        elif glob.has_magic(pattern):
+            for match in sorted(glob.glob(pattern, recursive=True)):
+                yield Path(match), Path(match).parent
+        else:
+            yield path, path.parent
+
+
+def output_for(
+    input_file: Path, base: Path, out_dir: Optional[str], suffix: str = ".mid"
+) -> Path:
+    if out_dir is None:
+        return input_file.with_suffix(suffix)
+    return Path(out_dir) / input_file.relative_to(base).with_suffix(suffix)
+
+
+def print_cache_stats(stats: Dict[str, Any]) -> None:
+    print(
+        f"cache: {stats['hits']} hits, {stats['misses']} misses, "
+        f"{stats['entries']} entries, {stats['bytes']:,} of "
+        f"{stats['max_bytes']:,} bytes in {stats['directory']}"
+    )
+
+
+def print_profile(profiler: "Profiler", format: str, output: Optional[str]) -> None:
+    report = profiler.to_json() if format == "json" else profiler.report()
+    if output is not None and format != "cprofile":
+        with open(output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report, file=sys.stderr)
+
+
+def check_job(input_file: str) -> Tuple[str, List[str]]:
+    from .check import check_file
+
+    try:
+        return input_file, check_file(input_file)
+    except FileNotFoundError:
+        return input_file, [f"Could not find file '{input_file}'"]
+    except Exception as e:
+        return input_file, [str(e)]
+
+
+def run_check(inputs: List[str], workers: int) -> int:
+    # Diagnostics go to stdout as "<file>: <message>", one per line
+    if workers > 1 and len(inputs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunksize = max(1, len(inputs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(check_job, inputs, chunksize=chunksize))
+    else:
+        results = [check_job(input_file) for input_file in inputs]
+
+    failures = 0
+    errors = 0
+    for input_file, diagnostics in results:
+        for diagnostic in diagnostics:
+            print(f"{input_file}: {diagnostic}")
+        if diagnostics:
+            failures += 1
+            errors += len(diagnostics)
+    print(
+        f"Checked {len(results)} file(s): {errors} error(s) " f"in {failures} file(s)"
+    )
+    return 1 if failures else 0
+
+
+def run_batch(jobs: List[Job], workers: int, cache: Optional["CompileCache"]) -> int:
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Each worker process handles many files, so interpreter start-up
+        # and imports are paid once per worker rather than once per file.
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(compile_job, jobs, chunksize=chunksize))
+    else:
+        results = [compile_job(job) for job in jobs]
+
+    failures = 0
+    for input_file, output_file, error, cached in results:
+        if error is None:
+            status = "cached" if cached else "ok"
+            print(f"{status:<8}{input_file} -> {output_file}")
+            if cache is not None:
+                if cached:
+                    cache.hits += 1
+                else:
+                    cache.misses += 1
+        else:
+            failures += 1
+            print(f"FAILED  {input_file}: {error}")
+    print(f"{len(results) - failures} succeeded, {failures} failed")
+    return 1 if failures else 0
+
+
+def main(argv: Optional[List[str]] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["serve"]:
+        from .server import main as serve
+
+        return serve(argv[1:])
+    if argv[:1] == ["compile"]:
+        # "midiscript compile ..." is the default command spelled out
+        argv = argv[1:]
 
-def main():
     arg_parser = argparse.ArgumentParser(
-        description="MidiScript - A musical programming language"
+        prog="midiscript",
+        description="MidiScript - A musical programming language "
+        "(run 'midiscript serve --help' for the compile server)",
+    )
+    arg_parser.add_argument(
+        "inputs",
+        nargs="+",
+        metavar="input",
+        help="Input MidiScript files, glob patterns or directories",
     )
-    arg_parser.add_argument("input", help="Input MidiScript file")
     arg_parser.add_argument(
         "-o",
         "--output",
         type=str,
-        help="Output MIDI file (default: <input_file>.mid)",
+        help="Output MIDI file, or - for standard output "
+        "(default: <input_file>.mid)",
+        default=None,
+    )
+    arg_parser.add_argument(
+        "--out-dir",
+        type=str,
+        default=None,
+        help="Directory for output files (default: next to each input)",
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes for batch compiles, or for generating "
+        "the tracks of a single file (0: one per CPU)",
+    )
+    arg_parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="smf",
+        help="MIDI encoder: native (smf), midiutil or vectorized numpy",
+    )
+    arg_parser.add_argument(
+        "--emit",
+        choices=sorted(EMIT_SUFFIXES),
+        default="midi",
+        help="Output format: a MIDI file, or a precompiled .msc program that "
+        "later compiles skip lexing and parsing for (default: midi)",
+    )
+    arg_parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only lex, parse and resolve sequence references, reporting "
+        "every error without generating output",
+    )
+    arg_parser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="Parse only the sequences reachable from the play statements; "
+        "the others are reported and skipped",
+    )
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Encode and write output incrementally with bounded memory "
+        "(implied by -o -)",
+    )
+    arg_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always recompile instead of reusing cached output",
+    )
+    arg_parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Compile cache directory (default: $MIDISCRIPT_CACHE_DIR or "
+        "~/.cache/midiscript)",
+    )
+    arg_parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_MB,
+        help="Maximum cache size in MB before least recently used entries "
+        "are evicted",
+    )
+    arg_parser.add_argument(
+        "--cache-programs",
+        action="store_true",
+        help="Also cache parsed programs, reused when only render options change",
+    )
+    arg_parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print compile cache statistics",
+    )
+    arg_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Recompile incrementally whenever the input file changes",
+    )
+    arg_parser.add_argument(
+        "--play",
+        nargs="?",
+        const="mido",
+        default=None,
+        metavar="SINK",
+        help="Play in real time instead of writing a file, to a MIDI port "
+        "(mido[:port], the default), a log file (file:<path>) or memory, "
+        "and report scheduling jitter",
+    )
+    arg_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Playback speed multiplier for --play",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="text",
+        choices=PROFILE_FORMATS,
+        help="Report wall time, CPU time, allocation peak and counts for each "
+        "stage, as text (the default) or json; cprofile also dumps a pstats "
+        "file of the hot functions",
+    )
+    arg_parser.add_argument(
+        "--profile-output",
         default=None,
+        metavar="FILE",
+        help="Write the --profile report (or pstats dump) here instead of "
+        "standard error",
+    )
+    arg_parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Log parser events to stderr",
     )
 
-    args = arg_parser.parse_args()
+    args = arg_parser.parse_args(argv)
 
-    # Read input file
-    try:
-        with open(args.input, "r") as f:
-            source = f.read()
-    except FileNotFoundError:
-        print(f"Error: Could not find file '{args.input}'")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading file: {e}")
-        sys.exit(1)
+    first = args.inputs[0]
+    batch = len(args.inputs) > 1 or Path(first).is_dir() or glob.has_magic(first)
+    if batch and args.output:
+        arg_parser.error("-o/--output requires a single input file")
+    if batch and args.watch:
+        arg_parser.error("--watch requires a single input file")
+    if batch and args.play:
+        arg_parser.error("--play requires a single input file")
+    if batch and args.profile:
+        arg_parser.error("--profile requires a single input file")
+    if batch and args.profile_output:
+        arg_parser.error("--profile-output requires a single input file")
+    if batch and args.trace:
+        arg_parser.error("--trace requires a single input file")
+    if args.watch and args.output == STDOUT:
+        arg_parser.error("--watch cannot write to standard output")
+    if args.emit == "msc" and (args.watch or args.play or args.stream):
+        arg_parser.error(
+            "--emit msc cannot be combined with --watch, --play or --stream"
+        )
+    if args.check and (
+        args.output or args.watch or args.play or args.profile or args.emit != "midi"
+    ):
+        arg_parser.error(
+            "--check cannot be combined with -o, --emit, --watch, --play or --profile"
+        )
+
+    if args.check:
+        inputs = [str(path) for path, _ in expand_inputs(args.inputs)]
+        sys.exit(run_check(inputs, args.jobs or os.cpu_count() or 1))
+
+    cache = None
+    if not args.no_cache:
+        from .cache import CompileCache
+
+        cache = CompileCache(
+            args.cache_dir,
+            args.cache_size * 1024 * 1024,
+            store_programs=args.cache_programs,
+        )
+
+    if batch:
+        jobs: List[Job] = []
+        for input_file, base in expand_inputs(args.inputs):
+            output_path = output_for(
+                input_file, base, args.out_dir, EMIT_SUFFIXES[args.emit]
+            )
+            if args.out_dir:
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+            jobs.append(
+                (
+                    str(input_file),
+                    str(output_path),
+                    args.backend,
+                    None if cache is None else str(cache.directory),
+                    args.cache_size * 1024 * 1024,
+                    args.cache_programs,
+                    args.stream,
+                    args.emit,
+                    args.lazy,
+                )
+            )
+        status = run_batch(jobs, args.jobs or os.cpu_count() or 1, cache)
+        if cache is not None and args.cache_stats:
+            print_cache_stats(cache.stats())
+        sys.exit(status)
+
+    input_file = first
 
     # Set output filename
     if args.output:
         output_file = args.output
     else:
-        input_path = Path(args.input)
-        output_file = str(input_path.with_suffix(".mid"))
+        input_path = Path(input_file)
+        output_path = output_for(
+            input_path, input_path.parent, args.out_dir, EMIT_SUFFIXES[args.emit]
+        )
+        if args.out_dir:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_file = str(output_path)
 
-    try:
-        # Tokenize
-        lexer = Lexer(source)
-        tokens = lexer.tokenize()
+    # Status messages must not mix with MIDI data on standard output
+    log = sys.stderr if output_file == STDOUT else sys.stdout
 
-        # Parse
-        parser = Parser(tokens)
-        program = parser.parse()
+    if args.play:
+        try:
+            stats = play_file(input_file, args.play, args.speed)
+        except FileNotFoundError:
+            print(f"Error: Could not find file '{input_file}'")
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            sys.exit(1)
+        print(stats.report())
+        return
 
-        # Generate MIDI
-        generator = MIDIGenerator()
-        midi_data = generator.generate(program)
+    if args.watch:
+        from .incremental import watch
 
-        # Write output file
-        with open(output_file, "wb") as f:
-            f.write(midi_data)
+        print(f"Watching {input_file} (Ctrl-C to stop)")
+        try:
+            watch(input_file, output_file, args.backend)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    listener = None
+    if args.trace:
+        import logging
 
-        print(f"Successfully created MIDI file: {output_file}")
+        from .parser import LoggingListener
 
+        logging.basicConfig(level=logging.DEBUG, format="%(name)s: %(message)s")
+        listener = LoggingListener()
+
+    if listener is not None:
+        cache = None  # tracing needs the parser to actually run
+
+    profiler = None
+    if args.profile:
+        from .profiling import Profiler
+
+        cache = None  # profile the real pipeline, not a cache hit
+        # Allocation tracing would distort the cProfile timings
+        profiler = Profiler(trace_memory=args.profile != "cprofile")
+
+    try:
+        run = functools.partial(
+            compile_file,
+            input_file,
+            output_file,
+            args.backend,
+            listener,
+            cache,
+            args.stream,
+            args.jobs or os.cpu_count() or 1,
+            profiler,
+            args.emit,
+            args.lazy,
+        )
+        if args.profile == "cprofile":
+            import cProfile
+
+            stats_file = args.profile_output or (
+                "midiscript.pstats"
+                if output_file == STDOUT
+                else str(Path(output_file).with_suffix(".pstats"))
+            )
+            cprofiler = cProfile.Profile()
+            cprofiler.runcall(run)
+            cprofiler.dump_stats(stats_file)
+        else:
+            run()
+        if profiler is not None:
+            print_profile(profiler, args.profile, args.profile_output)
+            if args.profile == "cprofile":
+                print(f"cProfile stats written to {stats_file}", file=sys.stderr)
+        if output_file != STDOUT:
+            kind = "compiled program" if args.emit == "msc" else "MIDI file"
+            print(f"Successfully created {kind}: {output_file}")
+        if cache is not None and args.cache_stats:
+            with contextlib.redirect_stdout(log):
+                print_cache_stats(cache.stats())
+    except FileNotFoundError:
+        print(f"Error: Could not find file '{input_file}'", file=log)
+        sys.exit(1)
     except Exception as e:
-        print(f"Error: {str(e)}")
+        print(f"Error: {str(e)}", file=log)
         sys.exit(1)
 
 
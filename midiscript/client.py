@@ -0,0 +1,153 @@
+"""Thin client for a running ``midiscript serve`` daemon.
+
+Only standard library modules are imported, so a call costs little more than
+interpreter start-up and one request.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Same default as midiscript.server, repeated to keep this module light
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+
+class ServerError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def connect(address: str, timeout: float) -> http.client.HTTPConnection:
+    if address.startswith("unix:"):
+        return UnixHTTPConnection(address[len("unix:") :], timeout)
+    host, _, port = address.rpartition(":")
+    return http.client.HTTPConnection(
+        host.strip("[]") or "127.0.0.1", int(port), timeout=timeout
+    )
+
+
+def request(
+    address: str,
+    method: str,
+    path: str,
+    body: Optional[Dict[str, Any]] = None,
+    timeout: float = 60,
+) -> Tuple[int, bytes]:
+    connection = connect(address, timeout)
+    try:
+        payload = None if body is None else json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"} if payload else {}
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def compile(
+    address: str = DEFAULT_ADDRESS,
+    source: Optional[str] = None,
+    path: Optional[str] = None,
+    backend: Optional[str] = None,
+) -> bytes:
+    """Compile source text, or a file the server can read, to MIDI bytes."""
+    body: Dict[str, Any] = {"source": source} if source is not None else {}
+    if path is not None:
+        body["path"] = os.path.abspath(path)
+    if backend is not None:
+        body["backend"] = backend
+    status, data = request(address, "POST", "/compile", body)
+    if status != 200:
+        try:
+            message = json.loads(data)["error"]
+        except (ValueError, KeyError):
+            message = data.decode(errors="replace")
+        raise ServerError(status, message)
+    return data
+
+
+def stats(address: str = DEFAULT_ADDRESS) -> Dict[str, Any]:
+    status, data = request(address, "GET", "/stats")
+    if status != 200:
+        raise ServerError(status, data.decode(errors="replace"))
+    return json.loads(data)
+
+
+def main(argv: Optional[List[str]] = None):
+    arg_parser = argparse.ArgumentParser(
+        description="Compile MidiScript files through a running midiscript server"
+    )
+    arg_parser.add_argument("inputs", nargs="*", metavar="input")
+    arg_parser.add_argument(
+        "-o", "--output", help="Output MIDI file, or - for standard output"
+    )
+    arg_parser.add_argument(
+        "--server",
+        default=os.environ.get("MIDISCRIPT_SERVER", DEFAULT_ADDRESS),
+        help="Server address: [host:]port or unix:<path> "
+        "(default: $MIDISCRIPT_SERVER or %(default)s)",
+    )
+    arg_parser.add_argument("--backend", default=None)
+    arg_parser.add_argument(
+        "--send-source",
+        action="store_true",
+        help="Send file contents instead of paths, for servers that cannot "
+        "read the client's files",
+    )
+    arg_parser.add_argument(
+        "--stats", action="store_true", help="Print server statistics"
+    )
+    args = arg_parser.parse_args(argv)
+    if args.output and len(args.inputs) > 1:
+        arg_parser.error("-o/--output requires a single input file")
+
+    status = 0
+    try:
+        for input_file in args.inputs:
+            output_file = args.output or str(Path(input_file).with_suffix(".mid"))
+            try:
+                if args.send_source:
+                    with open(input_file, "r") as f:
+                        data = compile(
+                            args.server, source=f.read(), backend=args.backend
+                        )
+                else:
+                    data = compile(args.server, path=input_file, backend=args.backend)
+            except (ServerError, OSError) as e:
+                print(f"Error: {input_file}: {e}", file=sys.stderr)
+                status = 1
+                continue
+            if output_file == "-":
+                sys.stdout.buffer.write(data)
+                sys.stdout.buffer.flush()
+            else:
+                with open(output_file, "wb") as f:
+                    f.write(data)
+                print(f"Successfully created MIDI file: {output_file}")
+        if args.stats:
+            print(json.dumps(stats(args.server), indent=2))
+    except OSError as e:
+        print(f"Error: cannot reach server at {args.server}: {e}", file=sys.stderr)
+        status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import os
+import re
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Match, Optional, Set, Tuple, cast
+
+from .lexer import Lexer, TokenStream, TokenType
+from .midi_generator import MIDIGenerator
+from .parser import Parser, Program, sequence_refs
+
+# The characters of a keyword, or of a word that merely starts with one
+WORD = re.compile(r"[A-Za-z0-9#_]*")
+
+# Token types that start a top-level statement when outside any braces
+STATEMENT_TYPES = {
+    TokenType.TEMPO.value,
+    TokenType.TIME.value,
+    TokenType.SEQUENCE.value,
+    TokenType.PLAY.value,
+}
+
+
+@dataclass
+class Chunk:
+    """One top-level statement: its span in the source and what it parsed to.
+
+    A chunk runs from its first token up to the first token of the next
+    statement, so whitespace between statements belongs to the preceding one.
+    """
+
+    start: int
+    end: int
+    program: Program
+    errors: List[str] = field(default_factory=list)
+    # sequence name -> names of the sequences it references
+    references: Dict[str, Set[str]] = field(default_factory=dict)
+
+
+def common_prefix(a: str, b: str) -> int:
+    # Binary search on slice equality, so the comparison runs at memcmp speed.
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix(a: str, b: str, limit: int) -> int:
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle : len(a) - low] == b[len(b) - middle : len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def split_statements(stream: TokenStream) -> Optional[List[Tuple[int, int]]]:
+    """Token index ranges of the top-level statements in ``stream``.
+
+    Returns None if the braces are unbalanced, in which case statement
+    boundaries cannot be trusted and the caller should rebuild from scratch.
+    """
+    bounds = [0]
+    depth = 0
+    types = stream.types
+    lbrace = TokenType.LBRACE.value
+    rbrace = TokenType.RBRACE.value
+    for index in range(len(types)):
+        type = types[index]
+        if type == lbrace:
+            depth += 1
+        elif type == rbrace:
+            depth -= 1
+            if depth < 0:
+                return None
+        elif depth == 0 and type in STATEMENT_TYPES and index > 0:
+            bounds.append(index)
+    if depth != 0:
+        return None
+    bounds.append(len(types))
+    return list(zip(bounds, bounds[1:]))
+
+
+def token_boundary(source: str, position: int) -> bool:
+    # Whether no token can span position, whatever text comes before it
+    if position <= 0 or position >= len(source):
+        return True
+    before = source[position - 1]
+    return before.isspace() or before in "{}[]/"
+
+
+class IncrementalCompiler:
+    """Keeps the per-statement ASTs of a source and updates them on edits.
+
+    ``update`` re-lexes only the statements overlapping the edited byte range,
+    re-parses them, and invalidates the generator's compiled blocks for the
+    sequences they define and every sequence that depends on those.
+    """
+
+    def __init__(self, backend: str = "smf", cache_size: int = 4096):
+        self.source = ""
+        self.chunks: List[Chunk] = []
+        self.generator = MIDIGenerator(backend=backend, cache_size=cache_size)
+        self.program = Program()
+        # What the last update did, for reporting
+        self.relexed_bytes = 0
+        self.reparsed: List[str] = []
+        self.invalidated: Set[str] = set()
+
+    @property
+    def errors(self) -> List[str]:
+        return [error for chunk in self.chunks for error in chunk.errors]
+
+    def parse_region(self, source: str, start: int, end: int) -> Optional[List[Chunk]]:
+        text = source[start:end]
+        stream = Lexer(text).token_stream()
+        # Drop the EOF token; chunks get their own when parsed.
+        stream = stream.slice(0, len(stream) - 1)
+        ranges = split_statements(stream)
+        if ranges is None:
+            return None
+
+        # Positions are relative to the region; make them relative to source.
+        stream.line_offset = source.count("\n", 0, start)
+        stream.column_offset = start - (source.rfind("\n", 0, start) + 1)
+
+        chunks: List[Chunk] = []
+        for first, last in ranges:
+            chunk_start = start if not chunks else start + stream.starts[first]
+            parser = Parser(stream.slice(first, last))
+            program = parser.parse()
+            references = {
+                name: set(sequence_refs(sequence.events))
+                for name, sequence in program.sequences.items()
+            }
+            chunks.append(
+                Chunk(chunk_start, end, program, list(parser.errors), references)
+            )
+            if len(chunks) > 1:
+                chunks[-2].end = chunk_start
+        if not chunks:
+            chunks.append(Chunk(start, end, Program()))
+        return chunks
+
+    def rebuild(self, source: str) -> None:
+        chunks = self.parse_region(source, 0, len(source))
+        if chunks is None:
+            # Unbalanced braces: parse as a single statement to get the error.
+            parser = Parser(Lexer(source).token_stream())
+            chunks = [Chunk(0, len(source), parser.parse(), list(parser.errors))]
+        self.source = source
+        self.chunks = chunks
+        self.relexed_bytes = len(source)
+        self.reparsed = [name for chunk in chunks for name in chunk.references]
+        self.invalidated = set(self.generator.compiled)
+        self.generator.invalidate(self.invalidated)
+
+    def update(self, source: str) -> Program:
+        old = self.source
+        if not self.chunks:
+            self.rebuild(source)
+            return self.merge()
+
+        prefix = common_prefix(old, source)
+        if prefix == len(old) == len(source):
+            self.relexed_bytes = 0
+            self.reparsed = []
+            self.invalidated = set()
+            return self.program
+        suffix = common_suffix(old, source, min(len(old), len(source)) - prefix)
+        old_end = len(old) - suffix
+        delta = len(source) - len(old)
+
+        # Statements touching the damaged range, including the neighbours
+        # at its edges, since an edit at a boundary may extend either one.
+        starts = [chunk.start for chunk in self.chunks]
+        first = max(0, bisect_right(starts, prefix) - 1)
+        keyword = cast(Match[str], WORD.match(old, starts[first]))
+        if first > 0 and prefix <= keyword.end():
+            # The edit reaches the statement's keyword or the character
+            # ending it, so the statement may now continue the one before.
+            first -= 1
+        last = min(len(starts) - 1, max(first, bisect_right(starts, old_end) - 1))
+        # The text after the region is unchanged, but a token of the edited
+        # text may still run on into the next statement ("5" becoming "x5"
+        # before "sequence"); the region grows until it ends where no token
+        # can continue past it.
+        while last < len(starts) - 1 and not token_boundary(
+            source, self.chunks[last].end + delta
+        ):
+            last += 1
+
+        region_start = self.chunks[first].start
+        region_end = self.chunks[last].end + delta
+        chunks = self.parse_region(source, region_start, region_end)
+        if chunks is None:
+            self.rebuild(source)
+            return self.merge()
+
+        changed: Set[str] = set()
+        for chunk in self.chunks[first : last + 1] + chunks:
+            changed.update(chunk.program.sequences)
+        following = self.chunks[last + 1 :]
+        for index, chunk in enumerate(following):
+            chunk.start += delta
+            chunk.end += delta
+            if chunk.errors:
+                # Error messages give positions, which the edit may have moved
+                following[index] = cast(
+                    List[Chunk], self.parse_region(source, chunk.start, chunk.end)
+                )[0]
+        self.chunks[first:] = chunks + following
+        self.source = source
+
+        self.relexed_bytes = region_end - region_start
+        self.reparsed = [name for chunk in chunks for name in chunk.references]
+        self.invalidated = self.dependents(changed)
+        self.generator.invalidate(self.invalidated)
+        return self.merge()
+
+    def dependents(self, names: Set[str]) -> Set[str]:
+        referenced_by: Dict[str, Set[str]] = {}
+        for chunk in self.chunks:
+            for name, references in chunk.references.items():
+                for reference in references:
+                    referenced_by.setdefault(reference, set()).add(name)
+        result = set(names)
+        pending = list(names)
+        while pending:
+            for parent in referenced_by.get(pending.pop(), ()):
+                if parent not in result:
+                    result.add(parent)
+                    pending.append(parent)
+        return result
+
+    def merge(self) -> Program:
+        # Same precedence as a single parse: later statements win.
+        program = Program()
+        for chunk in self.chunks:
+            part = chunk.program
+            if part.tempo is not None:
+                program.tempo = part.tempo
+            if part.time_signature is not None:
+                program.time_signature = part.time_signature
+            if part.main_sequence is not None:
+                program.main_sequence = part.main_sequence
+            program.tracks.extend(part.tracks)
+            program.sequences.update(part.sequences)
+        self.program = program
+        return program
+
+    def generate(self) -> bytes:
+        self.generator.render(self.program, reuse_compiled=True)
+        return self.generator.midi.to_bytes()
+
+
+def watch(
+    input_file: str,
+    output_file: str,
+    backend: str = "smf",
+    interval: float = 0.05,
+    report: Callable[[str], None] = print,
+) -> None:
+    """Recompile ``input_file`` whenever it changes, until interrupted."""
+    compiler = IncrementalCompiler(backend=backend)
+    signature = None
+    while True:
+        try:
+            stat = os.stat(input_file)
+            current = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            current = None
+        if current is not None and current != signature:
+            signature = current
+            started = time.perf_counter()
+            with open(input_file, "r") as f:
+                source = f.read()
+            try:
+                compiler.update(source)
+                if compiler.errors:
+                    for error in compiler.errors:
+                        report(f"Error: {error}")
+                else:
+                    data = compiler.generate()
+                    with open(output_file, "wb") as f:
+                        f.write(data)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    report(
+                        f"Rebuilt {output_file} in {elapsed:.1f} ms "
+                        f"(re-lexed {compiler.relexed_bytes:,} bytes, "
+                        f"re-parsed {len(compiler.reparsed)} sequence(s))"
+                    )
+            except Exception as e:
+                report(f"Error: {e}")
+        time.sleep(interval)
@@ -1,11 +1,18 @@
+import mmap
+import os
+import re
 from enum import Enum, auto
 from dataclasses import dataclass
-from typing import List, Optional
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union, cast
+
+# Source bytes, usually a read-only mapping of the source file
+Buffer = Union[bytes, mmap.mmap]
 
 
 class TokenType(Enum):
     NOTE = auto()  # C4, D#3, etc.
-    DURATION = auto()  # 1/4, 1/8, etc.
     TEMPO = auto()  # tempo keyword
     TIME = auto()  # time keyword
     NUMBER = auto()  # Any number
@@ -19,6 +26,7 @@ class TokenType(Enum):
     CHANNEL = auto()  # channel keyword
     VELOCITY = auto()  # velocity keyword
     PLAY = auto()  # play keyword
+    REPEAT = auto()  # repeat keyword
     REST = auto()  # R (rest)
     NEWLINE = auto()  # \n
     EOF = auto()  # End of file
@@ -30,10 +38,293 @@ class Token:
     lexeme: str
     line: int
     column: int
+    # MIDI number of a NOTE (-1 if outside 0-127), value of a NUMBER
+    value: Optional[int] = None
+
+
+# Token types that carry a decoded value
+VALUE_TYPES = (TokenType.NOTE, TokenType.NUMBER)
+
+# TokenType.value -> TokenType, for decoding TokenStream type codes
+TOKEN_TYPES = {type.value: type for type in TokenType}
+
+
+class TokenStream:
+    """Column-oriented token list: parallel arrays of type codes, decoded
+    values (0 for tokens without one) and lexeme offsets into ``source``,
+    13 bytes a token. Lexemes are sliced, and lines and columns worked out
+    from the offsets, only on demand.
+
+    ``source`` is either text or an ASCII buffer, in which case offsets are
+    byte offsets and lexemes are decoded as they are sliced.
+    """
+
+    def __init__(self, source: Union[str, Buffer]):
+        self.source = source
+        self.types = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.values = array("i")
+        # Added to the positions of tokens, when source is a region of a
+        # larger text: lines before it, and columns before it on its first line
+        self.line_offset = 0
+        self.column_offset = 0
+        # Offset of every line of source, built on first use
+        self.line_starts: Optional[array] = None
+
+    @classmethod
+    def from_tokens(cls, tokens: Iterable[Token]) -> "TokenStream":
+        # Lexemes are laid out at their lines and columns, padded with
+        # newlines and spaces, to form the backing source.
+        parts: List[str] = []
+        stream = cls("")
+        offset = 0
+        line = column = 1
+        for token in tokens:
+            if token.line > line:
+                parts.append("\n" * (token.line - line))
+                offset += token.line - line
+                line, column = token.line, 1
+            if token.line == line and token.column > column:
+                parts.append(" " * (token.column - column))
+                offset += token.column - column
+                column = token.column
+            parts.append(token.lexeme)
+            stream.types.append(token.type.value)
+            stream.starts.append(offset)
+            offset += len(token.lexeme)
+            stream.ends.append(offset)
+            if token.lexeme == "\n":
+                line, column = line + 1, 1
+            else:
+                column += len(token.lexeme)
+            value = token.value
+            if value is None:
+                value = token_value(token.type, token.lexeme)
+            stream.values.append(value)
+        stream.source = "".join(parts)
+        return stream
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> Token:
+        type = TOKEN_TYPES[self.types[index]]
+        line, column = self.position(index)
+        return Token(
+            type,
+            self.lexeme(index),
+            line,
+            column,
+            self.values[index] if type in VALUE_TYPES else None,
+        )
+
+    def __iter__(self) -> Iterator[Token]:
+        for index in range(len(self.types)):
+            yield self[index]
+
+    def position(self, index: int) -> Tuple[int, int]:
+        # (line, column) of a token, both from 1
+        if self.line_starts is None:
+            source = self.source
+            if isinstance(source, str):
+                ends = [match.end() for match in LINE_END.finditer(source)]
+            else:
+                ends = [match.end() for match in BYTES_LINE_END.finditer(source)]
+            self.line_starts = array("I", [0, *ends])
+        start = self.starts[index]
+        line = bisect_right(self.line_starts, start)
+        column = start - self.line_starts[line - 1] + 1
+        if line == 1:
+            column += self.column_offset
+        return line + self.line_offset, column
+
+    def slice(self, start: int, end: int) -> "TokenStream":
+        # Tokens [start, end) as a standalone stream terminated by EOF
+        stream = TokenStream(self.source)
+        stream.types = self.types[start:end]
+        stream.starts = self.starts[start:end]
+        stream.ends = self.ends[start:end]
+        stream.values = self.values[start:end]
+        stream.line_offset = self.line_offset
+        stream.column_offset = self.column_offset
+        stream.line_starts = self.line_starts
+        if not stream.types or stream.types[-1] != TokenType.EOF.value:
+            last = min(end, len(self.types)) - 1
+            offset = self.ends[last] if last >= 0 else 0
+            stream.types.append(TokenType.EOF.value)
+            stream.starts.append(offset)
+            stream.ends.append(offset)
+            stream.values.append(0)
+        return stream
+
+    def type(self, index: int) -> TokenType:
+        return TOKEN_TYPES[self.types[index]]
+
+    def lexeme(self, index: int) -> str:
+        lexeme = self.source[self.starts[index] : self.ends[index]]
+        if isinstance(lexeme, str):
+            return lexeme
+        return lexeme.decode("ascii")
+
+
+KEYWORDS = {
+    "tempo": TokenType.TEMPO,
+    "time": TokenType.TIME,
+    "sequence": TokenType.SEQUENCE,
+    "channel": TokenType.CHANNEL,
+    "velocity": TokenType.VELOCITY,
+    "play": TokenType.PLAY,
+    "repeat": TokenType.REPEAT,
+    "R": TokenType.REST,
+}
+
+PUNCTUATION = {
+    "/": TokenType.SLASH,
+    "{": TokenType.LBRACE,
+    "}": TokenType.RBRACE,
+    "[": TokenType.LBRACKET,
+    "]": TokenType.RBRACKET,
+}
+
+# Master pattern for ASCII sources: leading blanks, then one lexeme.
+TOKEN_PATTERN = re.compile(
+    r"[^\S\n]*(?:"
+    r"(?P<newline>\n)"
+    r"|(?P<number>[0-9]+)"
+    r"|(?P<word>[A-G][#b]?-[0-9]+|[A-Za-z#_][A-Za-z0-9#_]*)"
+    r"|(?P<punct>[/{}\[\]])"
+    r"|(?P<invalid>\S))"
+)
+
+
+# The same pattern for bytes buffers, where "\r\n" and a lone "\r" also end a
+# line, as they do for text read in universal newlines mode.
+BYTES_TOKEN_PATTERN = re.compile(
+    rb"[^\S\r\n]*(?:"
+    rb"(?P<newline>\r\n?|\n)"
+    rb"|(?P<number>[0-9]+)"
+    rb"|(?P<word>[A-G][#b]?-[0-9]+|[A-Za-z#_][A-Za-z0-9#_]*)"
+    rb"|(?P<punct>[/{}\[\]])"
+    rb"|(?P<invalid>\S))"
+)
+
+# Line ends, for working out token positions
+LINE_END = re.compile(r"\n")
+BYTES_LINE_END = re.compile(rb"\r\n?|\n")
+
+BYTES_PUNCTUATION = {ord(char): type for char, type in PUNCTUATION.items()}
+
+DIGITS = "0123456789"
+
+# Mapped pages behind the scan position are released in steps of this size
+RELEASE_INTERVAL = 16 * 1024 * 1024
+
+
+class NonASCIISource(Exception):
+    """Raised while scanning a buffer that turns out not to be ASCII."""
+
+
+def decode_source(buffer: Buffer) -> str:
+    """UTF-8 text of a buffer, with line endings translated as they are for
+    a file read in text mode."""
+    with memoryview(buffer) as view:
+        text = str(view, "utf-8")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def map_source(path: str) -> Buffer:
+    """Map ``path`` read-only for bytes-level lexing; empty files cannot be
+    mapped and are returned as ``b""``."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Semitones above C in the same octave, for every spelling of a note name
+NOTE_OFFSETS = {
+    "Cb": -1,
+    "C": 0,
+    "C#": 1,
+    "Db": 1,
+    "D": 2,
+    "D#": 3,
+    "Eb": 3,
+    "E": 4,
+    "Fb": 4,
+    "E#": 5,
+    "F": 5,
+    "F#": 6,
+    "Gb": 6,
+    "G": 7,
+    "G#": 8,
+    "Ab": 8,
+    "A": 9,
+    "A#": 10,
+    "Bb": 10,
+    "B": 11,
+    "B#": 12,
+}
+
+NOTE_NAMES = tuple(NOTE_OFFSETS)
+
+NOTE_SHAPE = re.compile(r"([A-G][#b]?)(-?[0-9]+)")
+
+# Every note name in the MIDI range 0-127 (C-1 to G9) and its number; middle
+# C is C4, 60.
+NOTE_VALUES = {
+    f"{name}{octave}": offset + (octave + 1) * 12
+    for name, offset in NOTE_OFFSETS.items()
+    for octave in range(-1, 10)
+    if 0 <= offset + (octave + 1) * 12 <= 127
+}
+
+# Largest NUMBER value, the limit of TokenStream.values
+MAX_NUMBER = 2**31 - 1
+
+
+def note_value(word: str) -> Optional[int]:
+    """MIDI number of a note name, -1 for a note outside 0-127 (such as
+    ``C10``), or None if the word is not a note name."""
+    value = NOTE_VALUES.get(word)
+    if value is not None:
+        return value
+    match = NOTE_SHAPE.fullmatch(word)
+    if match is None:
+        return None
+    value = NOTE_OFFSETS[match.group(1)] + (int(match.group(2)) + 1) * 12
+    return value if 0 <= value <= 127 else -1
+
+
+def word_token(word: str) -> Tuple[TokenType, Optional[int]]:
+    value = note_value(word)
+    if value is not None:
+        return TokenType.NOTE, value
+    return KEYWORDS.get(word, TokenType.IDENTIFIER), None
+
+
+def token_value(type: TokenType, lexeme: str) -> int:
+    # The TokenStream.values entry of a token built without one
+    if type == TokenType.NOTE:
+        value = note_value(lexeme)
+        return -1 if value is None else value
+    if type == TokenType.NUMBER:
+        return int(lexeme)
+    return 0
+
+
+# Keywords and note names, classified and decoded once at import
+WORD_TOKENS = {word: word_token(word) for word in [*KEYWORDS, *NOTE_VALUES]}
 
 
 class Lexer:
-    def __init__(self, source: str):
+    def __init__(self, source: Union[str, Buffer], recover: bool = False):
+        # Buffers are scanned as bytes; text goes through self.source
+        self.buffer: Optional[Buffer] = None
+        if not isinstance(source, str):
+            self.buffer = source
+            source = ""
         self.source = source
         self.tokens: List[Token] = []
         self.start = 0
@@ -44,12 +335,35 @@ class Lexer:
             self.source[self.current] if self.current < len(self.source) else None
         )
         self.last_token_type: Optional[TokenType] = None
+        # With recover, invalid characters are recorded here and skipped
+        self.recover = recover
+        self.errors: List[str] = []
 
     def error(self) -> None:
-        raise Exception(
-            f"Invalid character {self.current_char} at line {self.line}, "
-            f"column {self.column}"
-        )
+        self.invalid(self.current_char or "", self.line, self.column)
+        # A run of invalid characters is reported once
+        while self.current_char and not (
+            self.current_char.isspace()
+            or self.current_char.isalnum()
+            or self.current_char in "#_/{}[]"
+        ):
+            self.advance()
+
+    def invalid(self, char: str, line: int, column: int) -> None:
+        self.fail(f"Invalid character {char} at line {line}, column {column}")
+
+    def fail(self, message: str) -> None:
+        if not self.recover:
+            raise Exception(message)
+        self.errors.append(message)
+
+    def number_value(self, text: str, line: int, column: int) -> int:
+        # -1, after reporting it, for a number too large for TokenStream.values
+        value = int(text)
+        if value > MAX_NUMBER:
+            self.fail(f"Number {text} is too large at line {line}, column {column}")
+            return -1
+        return value
 
     def advance(self) -> Optional[str]:
         self.current += 1
@@ -84,14 +398,8 @@ class Lexer:
             result += self.current_char
             self.advance()
 
-        # Check for duration or time signature
-        if self.current_char == "/":
-            # Always return the number first
-            token = Token(TokenType.NUMBER, result, self.line, start_column)
-            self.last_token_type = token.type
-            return token
-
-        token = Token(TokenType.NUMBER, result, self.line, start_column)
+        value = max(self.number_value(result, self.line, start_column), 0)
+        token = Token(TokenType.NUMBER, result, self.line, start_column, value)
         self.last_token_type = token.type
         return token
 
@@ -105,28 +413,22 @@ class Lexer:
             result += self.current_char
             self.advance()
 
-        # Check for keywords
-        keywords = {
-            "tempo": TokenType.TEMPO,
-            "time": TokenType.TIME,
-            "sequence": TokenType.SEQUENCE,
-            "channel": TokenType.CHANNEL,
-            "velocity": TokenType.VELOCITY,
-            "play": TokenType.PLAY,
-            "R": TokenType.REST,
-        }
-
-        # Check if it's a note (e.g., C4, D#3, Bb4)
-        if len(result) >= 2 and result[0].upper() in "ABCDEFG" and result[-1].isdigit():
-            token = Token(TokenType.NOTE, result, self.line, start_column)
-        else:
-            token = Token(
-                keywords.get(result, TokenType.IDENTIFIER),
-                result,
-                self.line,
-                start_column,
-            )
+        # A negative octave, as in C-1
+        next_char = self.peek_next()
+        if (
+            self.current_char == "-"
+            and next_char is not None
+            and next_char in DIGITS
+            and NOTE_SHAPE.fullmatch(result + "-0")
+        ):
+            result += "-"
+            self.advance()
+            while self.current_char and self.current_char in DIGITS:
+                result += self.current_char
+                self.advance()
 
+        type, value = word_token(result)
+        token = Token(type, result, self.line, start_column, value)
         self.last_token_type = token.type
         return token
 
@@ -143,8 +445,6 @@ class Lexer:
 
         # Handle newlines
         if self.current_char == "\n":
-            self.line += 1
-            self.column = 1
             self.advance()
             token = Token(TokenType.NEWLINE, "\n", self.line - 1, start_column)
             self.last_token_type = token.type
@@ -190,18 +490,172 @@ class Lexer:
 
         # If we get here, we have an invalid character
         self.error()
-        return Token(TokenType.EOF, "", self.line, self.column)  # For type checker
+        return self.get_next_token()
 
     def tokenize(self) -> List[Token]:
-        tokens: List[Token] = []
+        return list(self.iter_tokens())
+
+    def iter_tokens(self) -> Iterator[Token]:
+        if self.buffer is not None:
+            yield from self.token_stream()
+            return
+        source = self.source
+        if not source.isascii():
+            # Unicode letters and digits need the str.isalpha()/isdigit()
+            # rules of the character-by-character engine.
+            yield from self.iter_tokens_by_char()
+            return
+
+        for type, start, end, line, column, value in self.scan():
+            yield Token(type, source[start:end], line, column, value)
+
+    def token_stream(self) -> "TokenStream":
+        if self.buffer is not None:
+            try:
+                return self.buffer_stream(self.buffer)
+            except NonASCIISource:
+                lexer = Lexer(decode_source(self.buffer), self.recover)
+                stream = lexer.token_stream()
+                self.errors = lexer.errors
+                return stream
+        if not self.source.isascii():
+            return TokenStream.from_tokens(self.iter_tokens_by_char())
+
+        stream = TokenStream(self.source)
+        types = stream.types.append
+        starts = stream.starts.append
+        ends = stream.ends.append
+        values = stream.values.append
+        for type, start, end, _, _, value in self.scan():
+            types(type.value)
+            starts(start)
+            ends(end)
+            values(value or 0)
+        return stream
+
+    def scan(self) -> Iterator[Tuple[TokenType, int, int, int, int, Optional[int]]]:
+        # Yields (type, start, end, line, column, value) for an ASCII source.
+        source = self.source
+        line = 1
+        line_start = 0
+        words = WORD_TOKENS.copy()
+        numbers: Dict[str, int] = {}
+        invalid_end = -1
+        for match in TOKEN_PATTERN.finditer(source):
+            kind = cast(str, match.lastgroup)
+            start, end = match.span(kind)
+            column = start - line_start + 1
+            if kind == "word":
+                text = source[start:end]
+                word = words.get(text)
+                if word is None:
+                    word = words[text] = word_token(text)
+                yield word[0], start, end, line, column, word[1]
+            elif kind == "number":
+                text = source[start:end]
+                value = numbers.get(text)
+                if value is None:
+                    value = self.number_value(text, line, column)
+                    if value < 0:
+                        value = 0
+                    else:
+                        numbers[text] = value
+                yield TokenType.NUMBER, start, end, line, column, value
+            elif kind == "newline":
+                yield TokenType.NEWLINE, start, end, line, column, None
+                line += 1
+                line_start = end
+            elif kind == "punct":
+                yield PUNCTUATION[source[start]], start, end, line, column, None
+            else:
+                if start != invalid_end:
+                    self.invalid(source[start], line, column)
+                invalid_end = end
+        end = len(source)
+        yield TokenType.EOF, end, end, line, end - line_start + 1, None
+
+    def buffer_stream(self, buffer: Buffer) -> "TokenStream":
+        # Scans bytes straight from the buffer, recording only offsets, so
+        # the source is never decoded or copied into a str.
+        stream = TokenStream(buffer)
+        types = stream.types.append
+        starts = stream.starts.append
+        ends = stream.ends.append
+        values = stream.values.append
+        words: Dict[bytes, Tuple[TokenType, int]] = {}
+        numbers: Dict[bytes, int] = {}
+        line = 1
+        line_start = 0
+        invalid_end = -1
+        # Already-scanned pages of a mapping are dropped from memory; they
+        # are read back from the file if a lexeme is sliced later.
+        release = getattr(buffer, "madvise", None)
+        released = 0
+        for match in BYTES_TOKEN_PATTERN.finditer(buffer):
+            kind = cast(str, match.lastgroup)
+            start, end = match.span(kind)
+            value = 0
+            if kind == "word":
+                text = buffer[start:end]
+                word = words.get(text)
+                if word is None:
+                    type, decoded = word_token(text.decode("ascii"))
+                    word = words[text] = (type, decoded or 0)
+                type, value = word
+            elif kind == "number":
+                type = TokenType.NUMBER
+                text = buffer[start:end]
+                number = numbers.get(text)
+                if number is None:
+                    number = self.number_value(
+                        text.decode("ascii"), line, start - line_start + 1
+                    )
+                    if number < 0:
+                        number = 0
+                    else:
+                        numbers[text] = number
+                value = number
+            elif kind == "newline":
+                type = TokenType.NEWLINE
+            elif kind == "punct":
+                type = BYTES_PUNCTUATION[buffer[start]]
+            elif buffer[start] >= 0x80:
+                raise NonASCIISource()
+            else:
+                if start != invalid_end:
+                    self.invalid(chr(buffer[start]), line, start - line_start + 1)
+                invalid_end = end
+                continue
+            types(type.value)
+            starts(start)
+            ends(end)
+            values(value)
+            if kind == "newline":
+                line += 1
+                line_start = end
+                if release is not None and end - released > 2 * RELEASE_INTERVAL:
+                    release(mmap.MADV_DONTNEED, released, RELEASE_INTERVAL)
+                    released += RELEASE_INTERVAL
+        end = len(buffer)
+        types(TokenType.EOF.value)
+        starts(end)
+        ends(end)
+        values(0)
+        return stream
+
+    def iter_tokens_by_char(self) -> Iterator[Token]:
         while True:
             token = self.get_next_token()
-            tokens.append(token)
+            yield token
             if token.type == TokenType.EOF:
                 break
-        return tokens
 
     def peek(self) -> Optional[str]:
         if self.current >= len(self.source):
             return None
         return self.source[self.current]
+
+    def peek_next(self) -> Optional[str]:
+        if self.current + 1 >= len(self.source):
+            return None
+        return self.source[self.current + 1]
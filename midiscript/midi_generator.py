@@ -1,123 +1,511 @@
-from typing import Dict, Set
-from midiutil import MIDIFile  # type: ignore
+from collections import OrderedDict
+from dataclasses import dataclass
+import warnings
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence as Rows,
+    Tuple,
+    Union,
+    cast,
+)
 from fractions import Fraction
-from .parser import Note, Chord, Rest, SequenceRef, Program, Sequence
+from functools import partial
+from math import gcd
+from .parser import (
+    Chord,
+    Event,
+    Note,
+    PlayTarget,
+    Program,
+    Repeat,
+    Rest,
+    Sequence,
+    SequenceRef,
+    pitch_of,
+    sequence_refs,
+)
+from .smf import (
+    STREAM_CHUNK_SIZE,
+    MIDIUtilWriter,
+    NoteEvent,
+    SMFWriter,
+    stream_smf,
+    write_smf_stream,
+)
+
+if TYPE_CHECKING:
+    from .msc import CompiledProgram
+    from .numpy_backend import NumpyWriter
+
+Writer = Union[SMFWriter, MIDIUtilWriter, "NumpyWriter"]
+
+# A parsed program, or one loaded precompiled from a .msc file
+AnyProgram = Union[Program, "CompiledProgram"]
+
+
+@dataclass
+class CompiledSequence:
+    """A sequence resolved to time-relative events, in integer ticks.
+
+    ``notes`` holds (offset, duration, pitch, velocity) for the sequence's own
+    notes and chord members; ``calls`` holds (offset, target, count) for each
+    referenced sequence, which is spliced in from its own compiled block, and
+    each repeat block, whose body is compiled once into an unnamed block.
+    The target is played ``count`` times back to back. Calls of targets that
+    play no notes are left out, so silence costs nothing however often it
+    repeats; ``note_total`` counts the notes of one play, calls included.
+    """
+
+    name: str
+    # A list, or rows read in place from a .msc file
+    notes: Rows[Tuple[int, int, int, int]]
+    calls: List["Call"]
+    length: int
+    note_total: int
+
+
+# (offset, sequence name or compiled block, repeat count)
+Call = Tuple[int, Union[str, CompiledSequence], int]
 
 
 class MIDIGenerator:
-    NOTE_MAP = {
-        "C": 60,
-        "C#": 61,
-        "Db": 61,
-        "D": 62,
-        "D#": 63,
-        "Eb": 63,
-        "E": 64,
-        "F": 65,
-        "F#": 66,
-        "Gb": 66,
-        "G": 67,
-        "G#": 68,
-        "Ab": 68,
-        "A": 69,
-        "A#": 70,
-        "Bb": 70,
-        "B": 71,
-    }
-
-    def __init__(self):
-        self.midi = MIDIFile(1)  # One track
-        self.time = 0.0  # Current time in beats
+    BACKENDS = ("smf", "midiutil", "numpy")
+
+    DEFAULT_VELOCITY = 100
+
+    # Default resolution. A program with durations that are not whole ticks
+    # at it is generated at a multiple of it, up to the largest resolution a
+    # MIDI file can declare.
+    PPQ = 480
+    MAX_PPQ = 0x7FFF
+
+    def __init__(self, backend: str = "smf", cache_size: int = 256, workers: int = 1):
+        if backend not in self.BACKENDS:
+            raise ValueError(
+                f"Unknown MIDI backend '{backend}', expected one of {self.BACKENDS}"
+            )
+        if backend == "numpy":
+            from . import numpy_backend
+
+            if not numpy_backend.available():
+                warnings.warn("NumPy is not installed, using the smf backend")
+                backend = "smf"
+        self.backend = backend
+        self.time = 0  # Current time in ticks
         self.current_tempo = 120
-        self.ppq = 480  # Pulses per quarter note
-        self.current_velocity = 100
+        self.ppq = self.PPQ  # Pulses per quarter note
+        # Durations resolved to ticks at self.ppq
+        self.duration_ticks: Dict[Tuple[int, int], int] = {}
+        # Least multiple of PPQ at which every duration resolved so far is a
+        # whole number of ticks, as a factor of PPQ
+        self.scale = 1
+        self.midi: Writer = self.new_writer()
+        self.current_velocity = self.DEFAULT_VELOCITY
+        # Track and 0-based channel that notes are emitted to
+        self.track = 0
+        self.channel = 0
+        # Processes used to generate the tracks of multi-track programs
+        self.workers = workers
+        # Notes emitted from compiled blocks by the last render
+        self.note_count = 0
         self.sequences: Dict[str, Sequence] = {}
-        self.sequence_stack: Set[str] = set()
+        # Length in ticks of every sequence resolved so far. Lengths outlive
+        # evicted blocks, so compiling a block never needs another block.
+        self.lengths: Dict[str, int] = {}
+        # Notes played by every sequence resolved so far, kept likewise
+        self.note_totals: Dict[str, int] = {}
+        # LRU cache of compiled sequences, keyed by sequence name
+        self.compiled: "OrderedDict[str, CompiledSequence]" = OrderedDict()
+        # Blocks of a program loaded from a .msc file, never evicted
+        self.precompiled: Dict[str, CompiledSequence] = {}
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def new_writer(self, num_tracks: int = 1) -> Writer:
+        if self.backend == "midiutil":
+            return MIDIUtilWriter(num_tracks, ppq=self.ppq)
+        if self.backend == "numpy":
+            from .numpy_backend import NumpyWriter
+
+            return NumpyWriter(num_tracks, ppq=self.ppq)
+        return SMFWriter(num_tracks, ppq=self.ppq)
 
     def set_tempo(self, tempo: int):
         self.current_tempo = tempo
-        self.midi.addTempo(0, self.time, tempo)
+        self.midi.add_tempo(self.time, tempo)
 
     def set_time_signature(self, numerator: int, denominator: int):
-        self.midi.addTimeSignature(0, self.time, numerator, denominator, 24, 8)
+        self.midi.add_time_signature(self.time, numerator, denominator)
 
     def note_to_midi_number(self, note_name: str) -> int:
-        # Split note into name and octave (e.g., 'C4' -> 'C', 4)
-        if len(note_name) == 2:
-            name, octave = note_name[0], int(note_name[1])
-        else:
-            name, octave = note_name[:2], int(note_name[2])
+        # Kept for callers with note names; events carry their pitch already
+        return pitch_of(note_name)
+
+    def duration_to_ticks(self, fraction: Tuple[int, int]) -> int:
+        # Each distinct (numerator, denominator) is resolved once, with exact
+        # rational rounding, so timing afterwards is pure integer arithmetic.
+        ticks = self.duration_ticks.get(fraction)
+        if ticks is None:
+            beats = Fraction(*fraction)
+            denominator = (beats * self.PPQ).denominator
+            self.scale = self.scale * denominator // gcd(self.scale, denominator)
+            ticks = self.duration_ticks[fraction] = round(beats * self.ppq)
+        return ticks
 
-        # Get base MIDI number for note name
-        base = self.NOTE_MAP[name]
+    def exact_ppq(self) -> int:
+        # The resolution for the durations resolved so far; past MAX_PPQ,
+        # the finest one a MIDI file allows.
+        ppq = self.PPQ * self.scale
+        if ppq > self.MAX_PPQ:
+            ppq = self.PPQ * (self.MAX_PPQ // self.PPQ)
+        return ppq
 
-        # Adjust for octave (middle C is C4)
-        return base + (octave - 4) * 12
+    def clear_compiled(self, ppq: int) -> None:
+        self.ppq = ppq
+        self.scale = 1
+        self.duration_ticks.clear()
+        self.compiled.clear()
+        self.lengths.clear()
+        self.note_totals.clear()
 
-    def duration_to_beats(self, duration: str) -> float:
-        # Convert duration string (e.g., '1/4') to float
-        if "/" in duration:
-            num, denom = map(int, duration.split("/"))
-            return float(Fraction(num, denom))
-        return float(duration)
+    def emit_note(self, midi_number: int, duration: int, velocity: int):
+        self.emit_note_at(self.time, midi_number, duration, velocity)
+
+    def emit_note_at(self, time: int, midi_number: int, duration: int, velocity: int):
+        self.midi.add_note(
+            self.track, self.channel, midi_number, time, duration, velocity
+        )
 
     def add_note(self, note: Note):
-        midi_number = self.note_to_midi_number(note.name)
-        duration = self.duration_to_beats(note.duration)
+        duration = self.duration_to_ticks(note.fraction)
         velocity = note.velocity or self.current_velocity
 
-        self.midi.addNote(
-            0, 0, midi_number, self.time, duration, velocity  # track  # channel
-        )
+        self.emit_note(note.pitch, duration, velocity)
         self.time += duration
 
     def add_chord(self, chord: Chord):
-        duration = self.duration_to_beats(chord.duration)
+        duration = self.duration_to_ticks(chord.fraction)
         velocity = chord.velocity or self.current_velocity
 
-        for note_name in chord.notes:
-            midi_number = self.note_to_midi_number(note_name)
-            self.midi.addNote(0, 0, midi_number, self.time, duration, velocity)
+        for midi_number in chord.pitches:
+            self.emit_note(midi_number, duration, velocity)
 
         self.time += duration
 
     def add_rest(self, rest: Rest):
-        duration = self.duration_to_beats(rest.duration)
+        duration = self.duration_to_ticks(rest.fraction)
         self.time += duration
 
-    def generate_sequence(self, sequence: Sequence):
-        if sequence.name in self.sequence_stack:
-            raise ValueError(
-                f"Circular reference detected in sequence '{sequence.name}'"
-            )
+    def lookup_sequence(self, name: str) -> Sequence:
+        sequence = self.sequences.get(name)
+        if sequence is None:
+            raise ValueError(f"Referenced sequence '{name}' not found")
+        return sequence
 
-        self.sequence_stack.add(sequence.name)
-
-        try:
-            for event in sequence.events:
-                if isinstance(event, Note):
-                    self.add_note(event)
-                elif isinstance(event, Chord):
-                    self.add_chord(event)
-                elif isinstance(event, Rest):
-                    self.add_rest(event)
-                elif isinstance(event, SequenceRef):
-                    referenced_seq = self.sequences.get(event.name)
-                    if referenced_seq:
-                        self.generate_sequence(referenced_seq)
-                    else:
+    def block(self, name: str) -> CompiledSequence:
+        compiled = self.precompiled.get(name)
+        if compiled is not None:
+            return compiled
+        if name not in self.lengths:
+            self.resolve([name])
+        return self.compile_sequence(self.lookup_sequence(name))
+
+    def resolve(self, names: Iterable[str]) -> None:
+        # Compiles the named sequences and every sequence they reference,
+        # each after its dependencies, recording their lengths. The reference
+        # graph is walked depth first with an explicit stack, so nesting
+        # depth is not bounded by recursion, and cycles are found here rather
+        # than while notes are generated.
+        lengths = self.lengths
+        for root in names:
+            if root in lengths:
+                continue
+            on_path = {root}
+            stack = [(root, self.references(root))]
+            while stack:
+                name, children = stack[-1]
+                for child in children:
+                    if child in on_path:
                         raise ValueError(
-                            f"Referenced sequence '{event.name}' not found"
+                            f"Circular reference detected in sequence '{child}'"
                         )
-        finally:
-            self.sequence_stack.remove(sequence.name)
+                    if child not in lengths:
+                        on_path.add(child)
+                        stack.append((child, self.references(child)))
+                        break
+                else:
+                    stack.pop()
+                    on_path.remove(name)
+                    self.compile_sequence(self.lookup_sequence(name))
+
+    def references(self, name: str) -> Iterator[str]:
+        return iter(dict.fromkeys(sequence_refs(self.lookup_sequence(name).events)))
+
+    def compile_sequence(self, sequence: Sequence) -> CompiledSequence:
+        # Every sequence referenced must already be resolved (see resolve)
+        compiled = self.compiled.get(sequence.name)
+        if compiled is not None:
+            self.cache_hits += 1
+            self.compiled.move_to_end(sequence.name)
+            return compiled
+        self.cache_misses += 1
+
+        compiled = self.compile_events(sequence.name, sequence.events)
+        self.lengths[sequence.name] = compiled.length
+        self.note_totals[sequence.name] = compiled.note_total
+        self.compiled[sequence.name] = compiled
+        while len(self.compiled) > self.cache_size:
+            self.compiled.popitem(last=False)
+        return compiled
 
-    def generate(self, program: Program) -> bytes:
-        # Reset state
-        self.time = 0.0
-        self.midi = MIDIFile(1)
-        self.sequences = program.sequences
-        self.sequence_stack = set()
+    def compile_events(self, name: str, events: List[Event]) -> CompiledSequence:
+        notes: List[Tuple[int, int, int, int]] = []
+        calls: List[Call] = []
+        offset = 0
+        total = 0
+        for event in events:
+            if isinstance(event, Note):
+                duration = self.duration_to_ticks(event.fraction)
+                # 0 stands for the velocity of the track playing the block
+                velocity = event.velocity or 0
+                notes.append((offset, duration, event.pitch, velocity))
+                offset += duration
+            elif isinstance(event, Chord):
+                duration = self.duration_to_ticks(event.fraction)
+                velocity = event.velocity or 0
+                for pitch in event.pitches:
+                    notes.append((offset, duration, pitch, velocity))
+                offset += duration
+            elif isinstance(event, Rest):
+                offset += self.duration_to_ticks(event.fraction)
+            elif isinstance(event, SequenceRef):
+                if self.note_totals[event.name]:
+                    calls.append((offset, event.name, 1))
+                    total += self.note_totals[event.name]
+                offset += self.lengths[event.name]
+            elif isinstance(event, Repeat):
+                # One copy of the body, however many times it repeats
+                body = self.compile_events(name, event.events)
+                if body.note_total and event.count:
+                    calls.append((offset, body, event.count))
+                    total += body.note_total * event.count
+                offset += body.length * event.count
+        return CompiledSequence(name, notes, calls, offset, total + len(notes))
+
+    def call_target(self, target: Union[str, CompiledSequence]) -> CompiledSequence:
+        if isinstance(target, CompiledSequence):
+            return target
+        return self.block(target)
+
+    def emit_compiled(self, compiled: CompiledSequence, start: int):
+        # Frames of (block, start tick, plays left) on an explicit stack.
+        # Calls are pushed in reverse, so blocks are emitted in the same
+        # order as a recursive walk would, each call's plays back to back.
+        default = self.current_velocity
+        if self.backend == "numpy":
+            # Every play of a block is placed in one go, as arrays
+            cast("NumpyWriter", self.midi).add_compiled(
+                self.track, self.channel, compiled, start, default, self.call_target
+            )
+            self.note_count += compiled.note_total
+            return
+        stack = [(compiled, start, 1)]
+        while stack:
+            block, start, repeats = stack.pop()
+            if repeats > 1:
+                stack.append((block, start + block.length, repeats - 1))
+            self.note_count += len(block.notes)
+            for offset, duration, pitch, velocity in block.notes:
+                self.emit_note_at(start + offset, pitch, duration, velocity or default)
+            for offset, target, count in reversed(block.calls):
+                if count:
+                    stack.append((self.call_target(target), start + offset, count))
+
+    def generate_sequence(self, sequence: Sequence):
+        self.generate_block(self.block(sequence.name))
+
+    def generate_block(self, compiled: CompiledSequence):
+        self.emit_compiled(compiled, self.time)
+        self.time += compiled.length
+
+    def generate_target(self, target: PlayTarget, track: int) -> None:
+        self.time = 0
+        self.track = track
+        self.channel = target.channel - 1
+        self.current_velocity = target.velocity or self.DEFAULT_VELOCITY
+        self.generate_block(self.block(target.sequence))
+
+    def generate(self, program: AnyProgram) -> bytes:
+        self.render(program)
+        return self.midi.to_bytes()
+
+    def write(self, program: AnyProgram, fileobj: BinaryIO) -> None:
+        self.render(program)
+        self.midi.write(fileobj)
+
+    def invalidate(self, names: Iterable[str]) -> None:
+        # Drop compiled blocks for sequences that changed; callers must
+        # include every sequence that references them as well.
+        for name in names:
+            self.compiled.pop(name, None)
+            self.lengths.pop(name, None)
+            self.note_totals.pop(name, None)
+
+    def iter_notes(self, target: PlayTarget) -> Iterator[NoteEvent]:
+        # Walk the compiled blocks lazily, yielding notes in start order
+        compiled = self.block(target.sequence)
+        channel = target.channel - 1
+        default = target.velocity or self.DEFAULT_VELOCITY
+        # Frames of (block, start tick, [next note, next call], plays left)
+        stack = [(compiled, 0, [0, 0], 1)]
+        while stack:
+            block, start, position, repeats = stack[-1]
+            note_index, call_index = position
+            notes = block.notes
+            calls = block.calls
+            if note_index < len(notes) and (
+                call_index >= len(calls) or notes[note_index][0] <= calls[call_index][0]
+            ):
+                offset, duration, pitch, velocity = notes[note_index]
+                position[0] += 1
+                yield (start + offset, duration, pitch, velocity or default, channel)
+            elif call_index < len(calls):
+                offset, callee, count = calls[call_index]
+                position[1] += 1
+                if count:
+                    child = self.call_target(callee)
+                    stack.append((child, start + offset, [0, 0], count))
+            elif repeats > 1:
+                # Play the same block again right after itself
+                stack[-1] = (block, start + block.length, [0, 0], repeats - 1)
+            else:
+                stack.pop()
+
+    def track_sources(
+        self, targets: List[PlayTarget]
+    ) -> List[Callable[[], Iterable[NoteEvent]]]:
+        # A restartable note source per track; a program with nothing to
+        # play still gets one empty track.
+        if not targets:
+            return [lambda: ()]
+        return [partial(self.iter_notes, target) for target in targets]
+
+    def stream(
+        self, program: AnyProgram, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """Yield the encoded MIDI file for ``program`` in chunks.
+
+        Memory is bounded by the compiled sequences and the notes sounding at
+        any one time, not by the expanded length of the song. Streaming always
+        uses the native encoder, whatever the configured backend.
+        """
+        targets = self.begin(program, writer=self.conductor_writer)
+        conductor = cast(SMFWriter, self.midi).conductor
+        return stream_smf(conductor, self.track_sources(targets), self.ppq, chunk_size)
+
+    def write_stream(
+        self,
+        program: AnyProgram,
+        fileobj: BinaryIO,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> None:
+        # Seekable outputs are written in one pass and the track length is
+        # patched afterwards; pipes get a measuring pre-pass instead.
+        targets = self.begin(program, writer=self.conductor_writer)
+        conductor = cast(SMFWriter, self.midi).conductor
+        write_smf_stream(
+            fileobj, conductor, self.track_sources(targets), self.ppq, chunk_size
+        )
+
+    def render(self, program: AnyProgram, reuse_compiled: bool = False) -> None:
+        targets = self.begin(program, reuse_compiled)
+        if self.workers > 1 and len(targets) > 1 and self.backend != "midiutil":
+            self.render_parallel(program, targets)
+            return
+        end = 0
+        for track, target in enumerate(targets):
+            self.generate_target(target, track)
+            end = max(end, self.time)
+        self.time = end
+
+    def render_parallel(self, program: AnyProgram, targets: List[PlayTarget]) -> None:
+        # Tracks are independent, so each is generated and encoded in a worker
+        # process and only the encoded chunks are merged here.
+        from concurrent.futures import ProcessPoolExecutor
+
+        midi = cast(Union[SMFWriter, "NumpyWriter"], self.midi)
+        workers = min(self.workers, len(targets))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=start_track_worker,
+            initargs=(program, self.backend, self.cache_size),
+        ) as executor:
+            results = executor.map(render_track, range(len(targets)))
+            end = 0
+            for track, (chunk, length, notes) in enumerate(results):
+                midi.add_encoded_track(track, chunk)
+                end = max(end, length)
+                self.note_count += notes
+        self.time = end
+
+    def play_targets(self, program: AnyProgram) -> List[PlayTarget]:
+        if program.tracks:
+            targets = program.tracks
+        elif program.main_sequence:
+            targets = [PlayTarget(program.main_sequence)]
+        elif program.sequences:
+            # If no main sequence specified, use the first sequence
+            targets = [PlayTarget(next(iter(program.sequences)))]
+        else:
+            targets = []
+        for target in targets:
+            if target.sequence not in program.sequences:
+                raise ValueError(f"Sequence '{target.sequence}' not found")
+        return targets
+
+    def conductor_writer(self) -> Writer:
+        # A single-track native writer, for the streaming encoders
+        return SMFWriter(1, ppq=self.ppq)
+
+    def begin(
+        self,
+        program: AnyProgram,
+        reuse_compiled: bool = False,
+        writer: Optional[Callable[[], Writer]] = None,
+    ) -> List[PlayTarget]:
+        # Reset state and write the conductor events; returns the tracks to
+        # play. The writer is made once the program's resolution is known.
+        targets = self.play_targets(program)
+        self.time = 0
+        self.note_count = 0
+        if isinstance(program, Program):
+            self.sequences = program.sequences
+            self.precompiled = {}
+            if not reuse_compiled or self.ppq != self.PPQ:
+                self.clear_compiled(self.PPQ)
+            # Dependency order and lengths for everything the tracks play
+            names = [target.sequence for target in targets]
+            self.resolve(names)
+            ppq = self.exact_ppq()
+            if ppq != self.ppq:
+                # Rounded durations would add up to drift; compile again at a
+                # resolution where every duration is a whole number of ticks.
+                self.clear_compiled(ppq)
+                self.resolve(names)
+        else:
+            self.sequences = {}
+            self.precompiled = program.sequences
+            if not reuse_compiled or self.ppq != program.ppq:
+                self.clear_compiled(program.ppq)
+        self.midi = writer() if writer else self.new_writer(max(1, len(targets)))
 
         # Set initial tempo and time signature
         if program.tempo:
@@ -132,20 +520,29 @@ class MIDIGenerator:
         else:
             self.set_time_signature(4, 4)  # Default 4/4 time
 
-        # Find main sequence
-        if program.main_sequence:
-            main_seq = self.sequences.get(program.main_sequence)
-            if main_seq:
-                self.generate_sequence(main_seq)
-            else:
-                raise ValueError(f"Sequence '{program.main_sequence}' not found")
-        elif program.sequences:
-            # If no main sequence specified, use the first sequence
-            first_sequence_name = next(iter(program.sequences))
-            self.generate_sequence(program.sequences[first_sequence_name])
-
-        # Convert to bytes
-        with open("temp.mid", "wb") as f:
-            self.midi.writeFile(f)
-        with open("temp.mid", "rb") as f:
-            return f.read()
+        return targets
+
+
+# Per-process state of the track workers used by render_parallel
+_track_worker: Optional[Tuple[MIDIGenerator, AnyProgram, List[PlayTarget]]] = None
+
+
+def start_track_worker(program: AnyProgram, backend: str, cache_size: int) -> None:
+    global _track_worker
+    generator = MIDIGenerator(backend=backend, cache_size=cache_size)
+    _track_worker = (generator, program, generator.play_targets(program))
+
+
+def render_track(track: int) -> Tuple[bytes, int, int]:
+    # Encode one track of the worker's program as an MTrk chunk; returns the
+    # chunk, the track's length in ticks and its number of notes.
+    generator, program, targets = cast(
+        Tuple[MIDIGenerator, AnyProgram, List[PlayTarget]], _track_worker
+    )
+    # Compiled blocks are kept between the tracks handled by this worker.
+    generator.begin(
+        program, reuse_compiled=True, writer=partial(generator.new_writer, 1)
+    )
+    generator.generate_target(targets[track], 0)
+    writer = cast(Union[SMFWriter, "NumpyWriter"], generator.midi)
+    return writer.track_chunk(0), generator.time, generator.note_count
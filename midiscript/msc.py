@@ -0,0 +1,318 @@
+"""Precompiled MidiScript programs (``.msc`` files).
+
+A ``.msc`` file holds a parsed program with every sequence already resolved
+to its compiled block of integer-tick notes, so rendering it skips lexing,
+parsing and sequence compilation. Loading maps the file into memory and the
+note rows are read in place.
+
+Layout, little-endian:
+
+- Prefix, the same in every format version: ``MSC_MAGIC``, the format
+  version (u16) and the path of the source file (u16 length, UTF-8).
+- Header: ppq (u32), tempo (u32, 0 if unset), time signature numerator and
+  denominator (u16 each, 0 if unset), sequence count (u32), track count (u32)
+  and the index of the main sequence (i32, -1 if unset).
+- Block names, each a u16 length and UTF-8 bytes. Named sequences come
+  first; the unnamed bodies of repeat blocks follow with empty names, and
+  the sequence count covers both.
+- Tracks: sequence index (u32), channel (u8) and velocity (u8, 0 if unset).
+- Block directory: length in ticks (i64), then the file offset (u64) and
+  row count (u32) of its notes and of its calls.
+- Note rows (offset i64, duration u32, pitch i16, velocity u8) and call
+  rows (offset i64, block index u32, repeat count u32).
+"""
+
+import mmap
+import os
+import struct
+from typing import (
+    BinaryIO,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+    overload,
+)
+
+from .midi_generator import CompiledSequence, MIDIGenerator
+from .parser import PlayTarget, Program, TempoChange, TimeSignature
+
+MSC_MAGIC = b"MSC\x00"
+MSC_VERSION = 2
+MSC_SUFFIX = ".msc"
+
+PREFIX = struct.Struct("<4sHH")
+HEADER = struct.Struct("<IIHHIIi")
+NAME_LENGTH = struct.Struct("<H")
+TRACK = struct.Struct("<IBB")
+DIRECTORY_ENTRY = struct.Struct("<qQIQI")
+NOTE_ROW = struct.Struct("<qIhB")
+CALL_ROW = struct.Struct("<qII")
+
+
+class PackedNotes(Sequence[Tuple[int, int, int, int]]):
+    """Note rows of a compiled block, unpacked on access from the mapped
+    file rather than held as tuples."""
+
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+
+    def __len__(self) -> int:
+        return len(self.buffer) // NOTE_ROW.size
+
+    @overload
+    def __getitem__(self, index: int) -> Tuple[int, int, int, int]: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Tuple[int, int, int, int]]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("note index out of range")
+        return NOTE_ROW.unpack_from(self.buffer, index * NOTE_ROW.size)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int, int]]:
+        return NOTE_ROW.iter_unpack(self.buffer)  # type: ignore[return-value]
+
+
+class CompiledProgram:
+    """A program loaded from a ``.msc`` file, accepted by ``MIDIGenerator``
+    wherever a parsed ``Program`` is."""
+
+    def __init__(
+        self,
+        path: str,
+        source_path: str,
+        ppq: int,
+        sequences: Dict[str, CompiledSequence],
+        tempo: Optional[TempoChange],
+        time_signature: Optional[TimeSignature],
+        main_sequence: Optional[str],
+        tracks: List[PlayTarget],
+    ):
+        self.path = path
+        self.source_path = source_path
+        self.ppq = ppq
+        self.sequences = sequences
+        self.tempo = tempo
+        self.time_signature = time_signature
+        self.main_sequence = main_sequence
+        self.tracks = tracks
+
+    def __reduce__(self):
+        # Worker processes map the file again rather than copying the rows
+        return load_msc, (self.path,)
+
+
+class VersionMismatch(ValueError):
+    """The file was written for another format version or ppq; its recorded
+    source path is kept so the caller can parse the source instead."""
+
+    def __init__(self, message: str, source_path: str):
+        super().__init__(message)
+        self.source_path = source_path
+
+
+def compile_program(
+    program: Program, generator: MIDIGenerator
+) -> Tuple[Dict[str, CompiledSequence], List[str]]:
+    # Compiles every sequence; returns the blocks and the names in file
+    # order. Errors in sequences that are played are raised, while sequences
+    # that do not compile and are never played are left out.
+    targets = generator.begin(program)
+    blocks: Dict[str, CompiledSequence] = {}
+    for target in targets:
+        blocks[target.sequence] = generator.block(target.sequence)
+    for name in program.sequences:
+        if name not in blocks:
+            try:
+                blocks[name] = generator.block(name)
+            except ValueError:
+                pass
+    return blocks, [name for name in program.sequences if name in blocks]
+
+
+def write_msc(program: Program, fileobj: BinaryIO, source_path: str = "") -> None:
+    generator = MIDIGenerator(cache_size=max(1, len(program.sequences)))
+    blocks, names = compile_program(program, generator)
+    ppq = generator.ppq
+    index = {name: i for i, name in enumerate(names)}
+    # Named blocks, then the repeat bodies reachable from them
+    order = [blocks[name] for name in names]
+    positions = {id(block): i for i, block in enumerate(order)}
+    for block in order:
+        for _, callee, _ in block.calls:
+            if isinstance(callee, CompiledSequence) and id(callee) not in positions:
+                positions[id(callee)] = len(order)
+                order.append(callee)
+
+    out = bytearray()
+    path = source_path.encode()
+    out += PREFIX.pack(MSC_MAGIC, MSC_VERSION, len(path))
+    out += path
+    tempo = program.tempo.value if program.tempo else 0
+    numerator, denominator = (
+        (program.time_signature.numerator, program.time_signature.denominator)
+        if program.time_signature
+        else (0, 0)
+    )
+    main = index.get(program.main_sequence, -1) if program.main_sequence else -1
+    out += HEADER.pack(
+        ppq, tempo, numerator, denominator, len(order), len(program.tracks), main
+    )
+    for name in names + [""] * (len(order) - len(names)):
+        encoded = name.encode()
+        out += NAME_LENGTH.pack(len(encoded))
+        out += encoded
+    for target in program.tracks:
+        out += TRACK.pack(index[target.sequence], target.channel, target.velocity or 0)
+
+    # Rows follow the directory, so their offsets are known up front
+    offset = len(out) + DIRECTORY_ENTRY.size * len(order)
+    for block in order:
+        notes_size = NOTE_ROW.size * len(block.notes)
+        out += DIRECTORY_ENTRY.pack(
+            block.length,
+            offset,
+            len(block.notes),
+            offset + notes_size,
+            len(block.calls),
+        )
+        offset += notes_size + CALL_ROW.size * len(block.calls)
+    for block in order:
+        for note in block.notes:
+            out += NOTE_ROW.pack(*note)
+        for call_offset, callee, count in block.calls:
+            if not isinstance(callee, CompiledSequence):
+                callee = blocks[callee]
+            out += CALL_ROW.pack(call_offset, positions[id(callee)], count)
+    fileobj.write(out)
+
+
+def load_msc(path: str, ppq: int = 480) -> CompiledProgram:
+    """Map a ``.msc`` file; raises ``VersionMismatch`` if it was written in
+    another format version or at a resolution that is not a multiple of
+    ``ppq``, and ``ValueError`` if it is not a ``.msc`` file."""
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            raise ValueError(f"'{path}' is not a compiled MidiScript program") from None
+    view = memoryview(data)
+    if len(view) < PREFIX.size or view[:4] != MSC_MAGIC:
+        raise ValueError(f"'{path}' is not a compiled MidiScript program")
+    _, version, path_length = PREFIX.unpack_from(view)
+    position = PREFIX.size
+    source_path = bytes(view[position : position + path_length]).decode()
+    position += path_length
+    if version != MSC_VERSION:
+        raise VersionMismatch(
+            f"'{path}' has format version {version}, expected {MSC_VERSION}",
+            source_path,
+        )
+
+    header = HEADER.unpack_from(view, position)
+    file_ppq, tempo, numerator, denominator, count, num_tracks, main = header
+    if file_ppq % ppq:
+        raise VersionMismatch(
+            f"'{path}' was compiled at {file_ppq} ppq, expected a multiple of {ppq}",
+            source_path,
+        )
+    position += HEADER.size
+
+    names = []
+    for _ in range(count):
+        (length,) = NAME_LENGTH.unpack_from(view, position)
+        position += NAME_LENGTH.size
+        names.append(bytes(view[position : position + length]).decode())
+        position += length
+    tracks = []
+    for _ in range(num_tracks):
+        sequence, channel, velocity = TRACK.unpack_from(view, position)
+        position += TRACK.size
+        tracks.append(PlayTarget(names[sequence], channel, velocity or None))
+
+    # Calls refer to blocks by position, so every block is created before
+    # any calls are filled in; they then point at the blocks directly.
+    blocks = []
+    call_rows = []
+    for name in names:
+        length, notes_at, notes, calls_at, calls = DIRECTORY_ENTRY.unpack_from(
+            view, position
+        )
+        position += DIRECTORY_ENTRY.size
+        note_rows = PackedNotes(view[notes_at : notes_at + NOTE_ROW.size * notes])
+        blocks.append(CompiledSequence(name, note_rows, [], length, 0))
+        call_rows.append(view[calls_at : calls_at + CALL_ROW.size * calls])
+    for block, rows in zip(blocks, call_rows):
+        block.calls.extend(
+            (offset, blocks[i], count)
+            for offset, i, count in CALL_ROW.iter_unpack(rows)
+        )
+    count_notes(blocks)
+    sequences = {block.name: block for block in blocks if block.name}
+
+    return CompiledProgram(
+        path,
+        source_path,
+        file_ppq,
+        sequences,
+        TempoChange(tempo) if tempo else None,
+        TimeSignature(numerator, denominator) if denominator else None,
+        names[main] if main >= 0 else None,
+        tracks,
+    )
+
+
+def count_notes(blocks: List[CompiledSequence]) -> None:
+    # Fills in note_total, each block after the blocks it calls
+    done = set()
+    for root in blocks:
+        stack = [root]
+        while stack:
+            block = stack[-1]
+            if id(block) in done:
+                stack.pop()
+                continue
+            callees = [cast(CompiledSequence, callee) for _, callee, _ in block.calls]
+            pending = [callee for callee in callees if id(callee) not in done]
+            if pending:
+                stack.extend(pending)
+                continue
+            block.note_total = len(block.notes) + sum(
+                count * callee.note_total
+                for callee, (_, _, count) in zip(callees, block.calls)
+            )
+            done.add(id(block))
+
+
+def source_for(path: str, source_path: str) -> Optional[str]:
+    # The recorded source, or a .ms file next to the .msc one
+    for candidate in (source_path, os.path.splitext(path)[0] + ".ms"):
+        if candidate and os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def load_program(path: str, ppq: int = 480) -> Union[CompiledProgram, Program]:
+    """Load a ``.msc`` file, parsing its source instead when the file was
+    written by an incompatible version."""
+    try:
+        return load_msc(path, ppq)
+    except VersionMismatch as e:
+        source = source_for(path, e.source_path)
+        if source is None:
+            raise ValueError(f"{e}, and its source file was not found") from None
+    from .lexer import Lexer
+    from .parser import Parser
+
+    with open(source, "r") as f:
+        return Parser(Lexer(f.read()).token_stream()).parse()
@@ -0,0 +1,266 @@
+import struct
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, List, Sequence, Tuple, Union
+
+from .smf import (
+    END_OF_TRACK,
+    MAX_VLQ,
+    NOTE_OFF,
+    NOTE_ON,
+    PRIORITY_EMPTY_NOTE_OFF,
+    PRIORITY_NOTE_OFF,
+    PRIORITY_NOTE_ON,
+    Track,
+    encode_track_into,
+    header_chunk,
+    tempo_event,
+    time_signature_event,
+)
+
+if TYPE_CHECKING:
+    from .midi_generator import CompiledSequence
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without NumPy
+    np = None  # type: ignore[assignment]
+
+NOTE_DTYPE = [
+    ("start", "i8"),
+    ("duration", "i8"),
+    ("pitch", "u1"),
+    ("velocity", "u1"),
+    ("channel", "u1"),
+]
+
+
+def available() -> bool:
+    return np is not None
+
+
+def note_array(notes: List[Tuple[int, int, int, int, int]]) -> "np.ndarray":
+    return np.array(notes, dtype=NOTE_DTYPE).reshape(-1)
+
+
+def encode_note_track(notes: "np.ndarray") -> bytes:
+    """Encode a structured array of notes as one MTrk chunk.
+
+    Note-on/note-off pairs are built, stably sorted by (tick, priority) and
+    turned into variable-length delta times without a Python-level loop.
+    """
+    count = len(notes)
+    start = notes["start"]
+    duration = notes["duration"]
+    ticks = np.concatenate((start, start + duration))
+    priority = np.concatenate(
+        (
+            np.full(count, PRIORITY_NOTE_ON, dtype="i8"),
+            np.where(duration > 0, PRIORITY_NOTE_OFF, PRIORITY_EMPTY_NOTE_OFF),
+        )
+    )
+    channel = notes["channel"]
+    status = np.concatenate((NOTE_ON | channel, NOTE_OFF | channel)).astype("u1")
+    pitch = np.concatenate((notes["pitch"], notes["pitch"]))
+    velocity = np.concatenate((notes["velocity"], notes["velocity"]))
+
+    order = np.argsort(ticks * 4 + priority, kind="stable")
+    ticks = ticks[order]
+    deltas = np.diff(ticks, prepend=0)
+    if len(deltas) and (deltas.min() < 0 or deltas.max() > MAX_VLQ):
+        raise ValueError("Note times cannot be encoded as MIDI delta times")
+
+    # Bytes needed for each delta's variable-length quantity
+    lengths = (
+        1
+        + (deltas >= 1 << 7).astype("i8")
+        + (deltas >= 1 << 14).astype("i8")
+        + (deltas >= 1 << 21).astype("i8")
+    )
+    sizes = lengths + 3
+    offsets = np.cumsum(sizes) - sizes
+    data = np.empty(int(sizes.sum()), dtype="u1")
+
+    for position in range(4):
+        mask = lengths > position
+        if not mask.any():
+            break
+        remaining = lengths[mask] - 1 - position
+        septet = (deltas[mask] >> (7 * remaining)) & 0x7F
+        continuation = np.where(remaining > 0, 0x80, 0)
+        data[offsets[mask] + position] = septet | continuation
+
+    event_start = offsets + lengths
+    data[event_start] = status[order]
+    data[event_start + 1] = pitch[order]
+    data[event_start + 2] = velocity[order]
+
+    body = data.tobytes() + END_OF_TRACK
+    return b"MTrk" + struct.pack(">I", len(body)) + body
+
+
+class NumpyWriter:
+    """``SMFWriter``-compatible encoder that keeps notes in NumPy arrays."""
+
+    def __init__(self, num_tracks: int = 1, ppq: int = 480):
+        if np is None:
+            raise ImportError("The numpy backend requires NumPy")
+        self.ppq = ppq
+        self.conductor = Track()
+        # Notes are laid out in emission order when a track is encoded, so
+        # the output matches SMFWriter byte for byte. Per track: the number
+        # of notes so far, pending Python tuples and the position of the
+        # first, finished (position, array) chunks, and the placements of
+        # each block as (start, position, velocity, channel) rows.
+        self.counts = [0] * num_tracks
+        self.pending: List[List[Tuple[int, int, int, int, int]]] = [
+            [] for _ in range(num_tracks)
+        ]
+        self.pending_at = [0] * num_tracks
+        self.chunks: List[List[Tuple[int, "np.ndarray"]]] = [
+            [] for _ in range(num_tracks)
+        ]
+        self.placements: List[Dict[int, List["np.ndarray"]]] = [
+            {} for _ in range(num_tracks)
+        ]
+        self.blocks: Dict[int, Tuple[object, "np.ndarray"]] = {}
+        self.encoded: Dict[int, bytes] = {}
+
+    def add_tempo(self, tick: int, bpm: float) -> None:
+        self.conductor.meta.append(tempo_event(tick, bpm))
+
+    def add_time_signature(self, tick: int, numerator: int, denominator: int) -> None:
+        self.conductor.meta.append(time_signature_event(tick, numerator, denominator))
+
+    def add_note(
+        self,
+        track: int,
+        channel: int,
+        pitch: int,
+        tick: int,
+        duration: int,
+        velocity: int,
+    ) -> None:
+        if not 0 <= pitch <= 127:
+            raise ValueError(f"MIDI note number {pitch} out of range")
+        if not self.pending[track]:
+            self.pending_at[track] = self.counts[track]
+        self.pending[track].append((tick, duration, pitch, velocity, channel))
+        self.counts[track] += 1
+
+    def reserve(self, track: int, count: int) -> int:
+        # Positions in emission order for count notes; returns the first
+        self.flush(track)
+        position = self.counts[track]
+        self.counts[track] += count
+        return position
+
+    def place_block(
+        self,
+        track: int,
+        channel: int,
+        notes: Sequence[Tuple[int, int, int, int]],
+        starts: "np.ndarray",
+        positions: "np.ndarray",
+        velocity: int = 100,
+    ) -> None:
+        # Place (offset, duration, pitch, velocity) notes, in ticks, once at
+        # each of starts, the play at starts[i] taking the reserved positions
+        # from positions[i]; notes with velocity 0 take ``velocity``. Only
+        # the placements are recorded, and each block is expanded once.
+        if not notes:
+            return
+        if id(notes) not in self.blocks:
+            block = np.array(notes, dtype="i8").reshape(-1, 4)
+            pitches = block[:, 2]
+            if pitches.min() < 0 or pitches.max() > 127:
+                raise ValueError("MIDI note number out of range")
+            # Keep a reference to notes so its id() is not reused
+            self.blocks[id(notes)] = (notes, block)
+        rows = np.empty((len(starts), 4), dtype="i8")
+        rows[:, 0] = starts
+        rows[:, 1] = positions
+        rows[:, 2] = velocity
+        rows[:, 3] = channel
+        self.placements[track].setdefault(id(notes), []).append(rows)
+
+    def add_compiled(
+        self,
+        track: int,
+        channel: int,
+        compiled: "CompiledSequence",
+        start: int,
+        velocity: int,
+        call_target: Callable[[Union[str, "CompiledSequence"]], "CompiledSequence"],
+    ) -> None:
+        # Place one play of a compiled block at start. All the plays of a
+        # block reached through the same calls are placed together, so the
+        # work grows with the number of calls, not with repeat counts. A
+        # play emits its own notes, then each call's plays in turn.
+        first = self.reserve(track, compiled.note_total)
+        stack = [(compiled, np.array([start]), np.array([first]))]
+        while stack:
+            block, starts, positions = stack.pop()
+            self.place_block(track, channel, block.notes, starts, positions, velocity)
+            position = len(block.notes)
+            for offset, target, count in block.calls:
+                callee = call_target(target)
+                plays = np.arange(count, dtype="i8")
+                stack.append(
+                    (
+                        callee,
+                        np.add.outer(starts + offset, plays * callee.length).ravel(),
+                        np.add.outer(
+                            positions + position, plays * callee.note_total
+                        ).ravel(),
+                    )
+                )
+                position += callee.note_total * count
+
+    def flush(self, track: int) -> None:
+        if self.pending[track]:
+            chunk = note_array(self.pending[track])
+            self.chunks[track].append((self.pending_at[track], chunk))
+            self.pending[track] = []
+
+    def track_notes(self, track: int) -> "np.ndarray":
+        self.flush(track)
+        notes = np.empty(self.counts[track], dtype=NOTE_DTYPE)
+        for position, chunk in self.chunks[track]:
+            notes[position : position + len(chunk)] = chunk
+        for key, parts in self.placements[track].items():
+            block = self.blocks[key][1]
+            placed = np.concatenate(parts)
+            count = len(placed)
+            # One row per placement, one column per note of the block
+            positions = np.add.outer(placed[:, 1], np.arange(len(block))).ravel()
+            notes["start"][positions] = np.add.outer(placed[:, 0], block[:, 0]).ravel()
+            notes["duration"][positions] = np.tile(block[:, 1], count)
+            notes["pitch"][positions] = np.tile(block[:, 2], count)
+            notes["velocity"][positions] = np.where(
+                block[:, 3] == 0, placed[:, 2:3], block[:, 3]
+            ).ravel()
+            notes["channel"][positions] = np.repeat(placed[:, 3], len(block))
+        return notes
+
+    def add_encoded_track(self, track: int, chunk: bytes) -> None:
+        self.encoded[track] = chunk
+
+    def track_chunk(self, track: int) -> bytes:
+        if track in self.encoded:
+            return self.encoded[track]
+        return encode_note_track(self.track_notes(track))
+
+    def encode_into(self, buf: bytearray) -> None:
+        buf += header_chunk(len(self.chunks) + 1, self.ppq)
+        encode_track_into(buf, self.conductor.notes, self.conductor.meta)
+        for track in range(len(self.chunks)):
+            buf += self.track_chunk(track)
+
+    def to_bytes(self) -> bytes:
+        buf = bytearray()
+        self.encode_into(buf)
+        return bytes(buf)
+
+    def write(self, fileobj: BinaryIO) -> None:
+        buf = bytearray()
+        self.encode_into(buf)
+        fileobj.write(memoryview(buf))
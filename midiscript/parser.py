@@ -1,36 +1,133 @@
+import re
 from dataclasses import dataclass, field
-from typing import List, Optional, Union, Dict
-from .lexer import Token, TokenType
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    Dict,
+)
+from .lexer import Token, TokenStream, TokenType, note_value
+
+if TYPE_CHECKING:
+    import logging
+
+
+class Node:
+    """Base of the event nodes. Nodes use ``__slots__`` and compare and print
+    by field like dataclasses (``dataclass(slots=True)`` needs Python 3.10);
+    the parser hands out one shared instance for identical events, so they
+    are not changed once built.
+
+    Notes, chords and rests also carry their pitches as MIDI numbers and
+    their duration as a (numerator, denominator) pair. The parser passes in
+    the values the lexer decoded; a node built by hand derives them."""
+
+    __slots__: Tuple[str, ...] = ()
+
+    def fields(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.fields() == other.fields()  # type: ignore[attr-defined]
+
+    def __repr__(self) -> str:
+        values = ", ".join(
+            f"{name}={value!r}" for name, value in zip(self.__slots__, self.fields())
+        )
+        return f"{type(self).__name__}({values})"
 
 
-@dataclass
-class Note:
-    name: str  # e.g., 'C4', 'D#3'
-    duration: str  # e.g., '1/4', '1/8'
-    velocity: Optional[int] = None
+def pitch_of(name: str) -> int:
+    pitch = note_value(name)
+    if pitch is None or pitch < 0:
+        raise ValueError(f"Invalid note '{name}'")
+    return pitch
 
 
-@dataclass
-class Chord:
-    notes: List[str]  # List of note names
-    duration: str
-    velocity: Optional[int] = None
+def fraction_of(duration: str) -> Tuple[int, int]:
+    numerator, _, denominator = duration.partition("/")
+    return int(numerator), int(denominator or 1)
 
 
-@dataclass
-class Rest:
-    duration: str
+class Note(Node):
+    __slots__ = ("name", "duration", "velocity", "pitch", "fraction")
 
+    def __init__(
+        self,
+        name: str,
+        duration: str,
+        velocity: Optional[int] = None,
+        pitch: Optional[int] = None,
+        fraction: Optional[Tuple[int, int]] = None,
+    ):
+        self.name = name  # e.g., 'C4', 'D#3'
+        self.duration = duration  # e.g., '1/4', '1/8'
+        self.velocity = velocity
+        self.pitch = pitch_of(name) if pitch is None else pitch  # e.g., 60
+        self.fraction = fraction or fraction_of(duration)  # e.g., (1, 4)
 
-@dataclass
-class SequenceRef:
-    name: str
+
+class Chord(Node):
+    __slots__ = ("notes", "duration", "velocity", "pitches", "fraction")
+
+    def __init__(
+        self,
+        notes: List[str],
+        duration: str,
+        velocity: Optional[int] = None,
+        pitches: Optional[Tuple[int, ...]] = None,
+        fraction: Optional[Tuple[int, int]] = None,
+    ):
+        self.notes = notes  # List of note names
+        self.duration = duration
+        self.velocity = velocity
+        if pitches is None:
+            pitches = tuple(pitch_of(name) for name in notes)
+        self.pitches = pitches
+        self.fraction = fraction or fraction_of(duration)
+
+
+class Rest(Node):
+    __slots__ = ("duration", "fraction")
+
+    def __init__(self, duration: str, fraction: Optional[Tuple[int, int]] = None):
+        self.duration = duration
+        self.fraction = fraction or fraction_of(duration)
+
+
+class SequenceRef(Node):
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class Repeat(Node):
+    """``repeat N { ... }``: the events played ``count`` times in a row."""
+
+    __slots__ = ("count", "events")
+
+    def __init__(
+        self, count: int, events: List[Union[Note, Chord, Rest, SequenceRef, "Repeat"]]
+    ):
+        self.count = count
+        self.events = events
+
+
+Event = Union[Note, Chord, Rest, SequenceRef, Repeat]
 
 
 @dataclass
 class Sequence:
     name: str
-    events: List[Union[Note, Chord, Rest, SequenceRef]]
+    events: List[Event]
 
 
 @dataclass
@@ -44,23 +141,155 @@ class TimeSignature:
     denominator: int
 
 
+@dataclass
+class PlayTarget:
+    sequence: str
+    channel: int = 1  # 1-16, as written
+    velocity: Optional[int] = None
+
+
 @dataclass
 class Program:
     sequences: Dict[str, Sequence] = field(default_factory=dict)
     tempo: Optional[TempoChange] = None
     time_signature: Optional[TimeSignature] = None
     main_sequence: Optional[str] = None
+    # One track per play statement, all starting together
+    tracks: List[PlayTarget] = field(default_factory=list)
 
     def __post_init__(self):
         if self.sequences is None:
             self.sequences = {}
 
 
+def sequence_refs(events: List[Event]) -> Iterator[str]:
+    # Names of the sequences referenced by events, including inside repeats
+    pending = [events]
+    while pending:
+        for event in pending.pop():
+            if isinstance(event, SequenceRef):
+                yield event.name
+            elif isinstance(event, Repeat):
+                pending.append(event.events)
+
+
+# Copies of smf.MIN_TEMPO, smf.MAX_TEMPO and smf.MAX_NUMERATOR, the values a
+# MIDI file can hold, kept here so parsing does not import the encoder.
+MIN_TEMPO = 4
+MAX_TEMPO = 60_000_000
+MAX_NUMERATOR = 255
+
+# Parser trace events. A listener is called as listener(event, token, detail)
+# where token is the first token of the construct and detail is the AST node
+# (or the exception, for TRACE_ERROR).
+TRACE_STATEMENT = "statement"
+TRACE_TEMPO = "tempo"
+TRACE_TIME_SIGNATURE = "time_signature"
+TRACE_PLAY = "play"
+TRACE_SEQUENCE = "sequence"
+TRACE_EVENT = "event"
+TRACE_SKIP = "skip"
+TRACE_ERROR = "error"
+
+ParseListener = Callable[[str, Token, object], None]
+
+# Token types where a recovering parser resumes after an error: the start
+# of a statement, and for an error inside events also the start of another
+# event or the end of a line or block.
+STATEMENT_STARTS = frozenset(
+    type.value
+    for type in (
+        TokenType.TEMPO,
+        TokenType.TIME,
+        TokenType.SEQUENCE,
+        TokenType.PLAY,
+        TokenType.EOF,
+    )
+)
+BLOCK_ENDS = STATEMENT_STARTS | {TokenType.RBRACE.value}
+# Token types a lazy parser visits while skipping a sequence body
+BLOCK_TOKENS = re.compile(
+    b"[%s]"
+    % re.escape(
+        bytes(
+            sorted(STATEMENT_STARTS | {TokenType.LBRACE.value, TokenType.RBRACE.value})
+        )
+    )
+)
+EVENT_STOPS = BLOCK_ENDS | {
+    type.value
+    for type in (
+        TokenType.NEWLINE,
+        TokenType.NOTE,
+        TokenType.LBRACKET,
+        TokenType.REST,
+        TokenType.IDENTIFIER,
+        TokenType.REPEAT,
+    )
+}
+
+
+class LoggingListener:
+    """Parse listener that forwards every trace event to a ``logging`` logger."""
+
+    # logging is imported only when a listener is made; level 10 is DEBUG
+    def __init__(self, logger: Optional["logging.Logger"] = None, level: int = 10):
+        import logging
+
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def __call__(self, event: str, token: Token, detail: object) -> None:
+        self.logger.log(
+            self.level,
+            "%s: %s '%s' at line %d, column %d%s",
+            event,
+            token.type.name,
+            token.lexeme,
+            token.line,
+            token.column,
+            "" if detail is None else f" -> {detail!r}",
+        )
+
+
 class Parser:
-    def __init__(self, tokens: List[Token]):
+    def __init__(
+        self,
+        tokens: Union[List[Token], TokenStream],
+        listener: Optional[ParseListener] = None,
+        recover: bool = False,
+        lazy: bool = False,
+    ):
         self.tokens = tokens
+        self.listener = listener
+        # With recover, a syntax error is recorded and parsing resumes at
+        # the next event or statement, so one pass finds every error; the
+        # program holds whatever parsed cleanly.
+        self.recover = recover
+        # With lazy, a first pass only indexes each sequence's name and the
+        # token span of its body. Bodies are parsed afterwards, and only for
+        # sequences reachable from the play targets; the names of the others
+        # are left in self.unreachable.
+        self.lazy = lazy
+        self.spans: Dict[str, Tuple[int, int, int]] = {}
+        self.unreachable: List[str] = []
+        # The parser always works on the compact form; type checks read the
+        # code column directly and Token objects are only built on request.
+        if isinstance(tokens, TokenStream):
+            self.stream = tokens
+        else:
+            self.stream = TokenStream.from_tokens(tokens)
+        self.types = self.stream.types
+        self.count = len(self.stream)
         self.current = 0
         self.sequences: Dict[str, Sequence] = {}
+        self.errors: List[str] = []
+        # Flyweights: identical events share one node, and equal lexemes one
+        # string, so a long score holds a node per distinct event.
+        self.nodes: Dict[tuple, Event] = {}
+        self.strings: Dict[str, str] = {}
+        # Duration strings by (numerator, denominator)
+        self.durations: Dict[Tuple[int, int], str] = {}
 
     def error(self, message: str = "Invalid syntax") -> None:
         token = self.peek()
@@ -74,203 +303,375 @@ class Parser:
         return self.previous()
 
     def peek(self) -> Optional[Token]:
-        if self.current >= len(self.tokens):
+        if self.current >= self.count:
             return None
-        return self.tokens[self.current]
+        return self.stream[self.current]
 
     def previous(self) -> Token:
-        return self.tokens[self.current - 1]
+        return self.stream[self.current - 1]
+
+    def lexeme(self, index: int) -> str:
+        return self.stream.lexeme(index)
+
+    def location(self, index: int) -> str:
+        line, column = self.stream.position(index)
+        return f"line {line}, column {column}"
 
     def is_at_end(self) -> bool:
-        token = self.peek()
-        if token is None:
-            return True
-        return token.type == TokenType.EOF
+        return (
+            self.current >= self.count
+            or self.types[self.current] == TokenType.EOF.value
+        )
 
     def match(self, *types: TokenType) -> bool:
         for type in types:
             if self.check(type):
-                self.advance()
+                self.current += 1
                 return True
         return False
 
     def check(self, type: TokenType) -> bool:
-        token = self.peek()
-        if token is None:
-            return False
-        return token.type == type
+        return self.current < self.count and self.types[self.current] == type.value
 
     def skip_newlines(self) -> None:
-        token = self.peek()
-        while token is not None and token.type == TokenType.NEWLINE:
-            self.advance()
-            token = self.peek()
+        newline = TokenType.NEWLINE.value
+        while self.current < self.count and self.types[self.current] == newline:
+            self.current += 1
+
+    def trace(self, event: str, index: int, detail: object = None) -> None:
+        # Only called when a listener is installed; callers guard on it so a
+        # parse without tracing never builds Token objects for it.
+        if self.listener is not None:
+            self.listener(event, self.stream[min(index, self.count - 1)], detail)
 
     def parse(self) -> Program:
         program = Program()
+        listener = self.listener
         try:
             while not self.is_at_end():
-                self.skip_newlines()  # Skip any leading newlines
-                token = self.peek()
-                if token:
-                    print(
-                        f"Processing token: {token.type} '{token.lexeme}' at line {token.line}, column {token.column}"
-                    )
-                if self.match(TokenType.TEMPO):
-                    print("Found tempo")
-                    self.parse_tempo(program)
-                    print(
-                        f"Set tempo to {program.tempo.value if program.tempo else None}"
-                    )
-                elif self.match(TokenType.TIME):
-                    print("Found time signature")
-                    self.parse_time_signature(program)
-                elif self.match(TokenType.SEQUENCE):
-                    print("Found sequence")
-                    self.sequence_declaration()
-                elif self.match(TokenType.PLAY):
-                    print("Found play")
-                    self.parse_play(program)
-                elif self.match(TokenType.NEWLINE):
-                    print("Skipping newline")
-                    continue  # Skip newlines between statements
-                else:
-                    print("Unexpected token, advancing")
-                    self.advance()
+                start = self.current
+                try:
+                    self.statement(program)
+                except Exception as e:
+                    if not self.recover:
+                        raise
+                    self.synchronize(e, start, STATEMENT_STARTS)
+            if self.lazy:
+                self.parse_reachable(program)
             program.sequences.update(self.sequences)
             return program
         except Exception as e:
-            # Log the error and return empty program
-            print(f"Error parsing: {str(e)}")
+            if listener is not None:
+                self.trace(TRACE_ERROR, self.current, e)
+            # Record the error and return an empty program; callers report
+            # self.errors
+            self.errors.append(str(e))
             return Program()
 
+    def statement(self, program: Program) -> None:
+        listener = self.listener
+        self.skip_newlines()  # Skip any leading newlines
+        start = self.current
+        if listener is not None and start < self.count:
+            self.trace(TRACE_STATEMENT, start)
+        if self.match(TokenType.TEMPO):
+            self.parse_tempo(program)
+            if listener is not None:
+                self.trace(TRACE_TEMPO, start, program.tempo)
+        elif self.match(TokenType.TIME):
+            self.parse_time_signature(program)
+            if listener is not None:
+                self.trace(TRACE_TIME_SIGNATURE, start, program.time_signature)
+        elif self.match(TokenType.SEQUENCE):
+            self.sequence_declaration()
+        elif self.match(TokenType.PLAY):
+            self.parse_play(program)
+            if listener is not None:
+                self.trace(TRACE_PLAY, start, program.main_sequence)
+        elif self.match(TokenType.NEWLINE):
+            return  # Skip newlines between statements
+        elif not self.is_at_end():
+            if listener is not None:
+                self.trace(TRACE_SKIP, start)
+            self.advance()
+
+    def synchronize(self, error: Exception, start: int, stops: FrozenSet[int]) -> None:
+        # Panic mode: record the error, then skip to the next token whose
+        # type is in stops, moving past the token that started the construct.
+        if self.listener is not None:
+            self.trace(TRACE_ERROR, self.current, error)
+        self.errors.append(str(error))
+        if self.current == start:
+            self.current += 1
+        while self.current < self.count and self.types[self.current] not in stops:
+            self.current += 1
+
     def parse_tempo(self, program: Program) -> None:
-        print("Parsing tempo")
-        value = self.consume(TokenType.NUMBER, "Expected tempo value.")
-        print(f"Found tempo value: {value.lexeme}")
-        program.tempo = TempoChange(int(value.lexeme))
+        value = self.expect(TokenType.NUMBER, "Expected tempo value.")
+        program.tempo = TempoChange(
+            self.number_between(value, MIN_TEMPO, MAX_TEMPO, "Tempo")
+        )
         self.skip_newlines()  # Skip newlines after tempo
 
     def parse_time_signature(self, program: Program) -> None:
-        numerator = self.consume(TokenType.NUMBER, "Expected time signature numerator.")
-        self.consume(TokenType.SLASH, "Expected '/' in time signature.")
-        denominator = self.consume(
+        numerator = self.expect(TokenType.NUMBER, "Expected time signature numerator.")
+        self.expect(TokenType.SLASH, "Expected '/' in time signature.")
+        denominator = self.expect(
             TokenType.NUMBER, "Expected time signature denominator."
         )
-        program.time_signature = TimeSignature(
-            int(numerator.lexeme), int(denominator.lexeme)
+        beats = self.number_between(
+            numerator, 1, MAX_NUMERATOR, "Time signature numerator"
         )
+        unit = self.stream.values[denominator]
+        if unit <= 0 or unit & (unit - 1):
+            raise SyntaxError(
+                "Time signature denominator must be a power of two at "
+                + self.location(denominator)
+            )
+        program.time_signature = TimeSignature(beats, unit)
         self.skip_newlines()  # Skip newlines after time signature
 
     def parse_play(self, program: Program) -> None:
         sequence_name = self.consume(
             TokenType.IDENTIFIER, "Expected sequence name after 'play'."
         )
-        program.main_sequence = sequence_name.lexeme
+        target = PlayTarget(sequence_name.lexeme)
+        while True:
+            if self.match(TokenType.CHANNEL):
+                target.channel = self.play_option(1, 16, "Channel")
+            elif self.match(TokenType.VELOCITY):
+                target.velocity = self.play_option(1, 127, "Velocity")
+            else:
+                break
+        program.main_sequence = target.sequence
+        program.tracks.append(target)
         self.skip_newlines()  # Skip newlines after play
 
+    def play_option(self, low: int, high: int, name: str) -> int:
+        index = self.expect(TokenType.NUMBER, f"Expected {name.lower()} number.")
+        return self.number_between(index, low, high, name)
+
+    def number_between(self, index: int, low: int, high: int, name: str) -> int:
+        value = self.stream.values[index]
+        if not low <= value <= high:
+            raise SyntaxError(
+                f"{name} must be between {low} and {high} at " + self.location(index)
+            )
+        return value
+
     def sequence_declaration(self) -> None:
-        print("Starting sequence declaration")
-        name = self.consume(TokenType.IDENTIFIER, "Expected sequence name.")
-        print(f"Found sequence name: {name.lexeme}")
+        name_index = self.expect(TokenType.IDENTIFIER, "Expected sequence name.")
+        name = self.lexeme(name_index)
         self.skip_newlines()  # Skip newlines before '{'
-        self.consume(TokenType.LBRACE, "Expected '{' after sequence name.")
-        print("Found opening brace")
+        self.expect(TokenType.LBRACE, "Expected '{' after sequence name.")
         self.skip_newlines()  # Skip newlines after '{'
+        if self.lazy:
+            # Only the span is recorded; the body is parsed if it is reached
+            end = self.block_end()
+            self.spans[name] = (name_index, self.current, end)
+            self.current = end + 1
+            return
 
-        events: List[Union[Note, Chord, Rest, SequenceRef]] = []
+        self.sequence_body(name_index, name)
 
-        while not self.check(TokenType.RBRACE) and not self.is_at_end():
-            self.skip_newlines()  # Skip newlines between events
-            token = self.peek()
-            if token:
-                print(
-                    f"Processing event token: {token.type} '{token.lexeme}' at line {token.line}, column {token.column}"
-                )
-            if self.match(TokenType.NOTE):
-                print("Found note")
-                events.append(self.note())
-            elif self.match(TokenType.LBRACKET):
-                print("Found chord start")
-                events.append(self.chord())
-            elif self.match(TokenType.REST):
-                print("Found rest")
-                events.append(self.rest())
-            elif self.match(TokenType.IDENTIFIER):
-                print("Found sequence reference")
-                events.append(self.sequence_ref())
-            elif self.match(TokenType.NEWLINE):
-                print("Skipping newline")
-                continue  # Skip newlines
-            else:
-                break  # Exit the loop when we find something unexpected
+    def sequence_body(self, name_index: int, name: str) -> Sequence:
+        events = self.events()
+        sequence = Sequence(name, events)
+        self.sequences[name] = sequence
 
         self.skip_newlines()  # Skip newlines before '}'
-        self.consume(TokenType.RBRACE, "Expected '}' after sequence events.")
-        print("Found closing brace")
-        sequence = Sequence(name.lexeme, events)
-        self.sequences[name.lexeme] = sequence
-        print(f"Added sequence {name.lexeme} with {len(events)} events")
+        self.expect(TokenType.RBRACE, "Expected '}' after sequence events.")
+        if self.listener is not None:
+            self.trace(TRACE_SEQUENCE, name_index, sequence)
+        return sequence
+
+    def block_end(self) -> int:
+        # Index of the '}' closing the block whose body starts at the current
+        # token. Only braces and statement keywords are visited; a statement
+        # keyword before the block closes is the same error a full parse
+        # reports there.
+        depth = 1
+        types = self.types
+        for match in BLOCK_TOKENS.finditer(types, self.current):  # type: ignore
+            index = match.start()
+            if types[index] == TokenType.LBRACE.value:
+                depth += 1
+            elif types[index] == TokenType.RBRACE.value:
+                depth -= 1
+                if depth == 0:
+                    return index
+            else:
+                break
+        else:
+            index = self.count
+        self.current = index
+        self.error("Expected '}' after sequence events.")
+        return index
+
+    def parse_reachable(self, program: Program) -> None:
+        # Parses the indexed sequences reachable from the play targets,
+        # following references; the others are listed in self.unreachable.
+        spans = self.spans
+        if program.tracks:
+            pending = [target.sequence for target in program.tracks]
+        elif program.main_sequence:
+            pending = [program.main_sequence]
+        else:
+            pending = list(spans)[:1]
+        pending.reverse()
+        while pending:
+            name = pending.pop()
+            if name in self.sequences or name not in spans:
+                continue
+            name_index, self.current, _ = spans[name]
+            sequence = self.sequence_body(name_index, name)
+            pending.extend(reversed(list(sequence_refs(sequence.events))))
+        self.unreachable = [name for name in spans if name not in self.sequences]
+        # Declaration order, as a full parse gives
+        self.sequences = {
+            name: self.sequences[name] for name in spans if name in self.sequences
+        }
+
+    def events(self) -> List[Event]:
+        # Events up to the closing '}' of a sequence or repeat block
+        listener = self.listener
+        events: List[Event] = []
+        while not self.check(TokenType.RBRACE) and not self.is_at_end():
+            self.skip_newlines()  # Skip newlines between events
+            start = self.current
+            try:
+                if self.match(TokenType.NOTE):
+                    events.append(self.note())
+                elif self.match(TokenType.LBRACKET):
+                    events.append(self.chord())
+                elif self.match(TokenType.REST):
+                    events.append(self.rest())
+                elif self.match(TokenType.IDENTIFIER):
+                    events.append(self.sequence_ref())
+                elif self.match(TokenType.REPEAT):
+                    events.append(self.repeat())
+                elif self.match(TokenType.NEWLINE):
+                    continue  # Skip newlines
+                elif (
+                    self.recover
+                    and self.current < self.count
+                    and self.types[self.current] not in BLOCK_ENDS
+                ):
+                    self.error(f"Unexpected '{self.lexeme(self.current)}' in events")
+                else:
+                    break  # Exit the loop when we find something unexpected
+            except Exception as e:
+                if not self.recover:
+                    raise
+                self.synchronize(e, start, EVENT_STOPS)
+                continue
+            if listener is not None:
+                self.trace(TRACE_EVENT, start, events[-1])
+        return events
 
     def note(self) -> Note:
-        note_name = self.previous().lexeme  # Get the note name from the previous token
-        print(f"Found note name: {note_name}")
-
-        # Parse duration as number/slash/number
-        numerator = self.consume(TokenType.NUMBER, "Expected duration numerator.")
-        self.consume(TokenType.SLASH, "Expected '/' in duration.")
-        denominator = self.consume(TokenType.NUMBER, "Expected duration denominator.")
-        duration = f"{numerator.lexeme}/{denominator.lexeme}"
-        print(f"Found duration: {duration}")
-
-        return Note(
-            name=note_name,
-            duration=duration,
-        )
+        index = self.current - 1
+        note_name = self.lexeme(index)  # Get the note name
+        note_name = self.strings.setdefault(note_name, note_name)
+        pitch = self.pitch(index, note_name)
+        key = (TokenType.NOTE, note_name, self.duration())
+        node = self.nodes.get(key)
+        if node is None:
+            fraction = key[2]
+            node = self.nodes[key] = Note(
+                note_name, self.durations[fraction], None, pitch, fraction
+            )
+        return node  # type: ignore[return-value]
+
+    def pitch(self, index: int, name: str) -> int:
+        pitch = self.stream.values[index]
+        if pitch < 0:
+            raise SyntaxError(
+                f"Note '{name}' is outside the MIDI range 0-127 at "
+                + self.location(index)
+            )
+        return pitch
 
     def chord(self) -> Chord:
+        strings = self.strings
         notes: List[str] = []
+        pitches: List[int] = []
         while not self.check(TokenType.RBRACKET) and not self.is_at_end():
             if self.match(TokenType.NOTE):
-                notes.append(self.previous().lexeme)
+                lexeme = self.lexeme(self.current - 1)
+                notes.append(strings.setdefault(lexeme, lexeme))
+                pitches.append(self.pitch(self.current - 1, lexeme))
             else:
-                token = self.peek()
-                if token is not None:
+                if self.current < self.count:
                     raise SyntaxError(
-                        f"Expected note in chord at line {token.line}, "
-                        f"column {token.column}"
+                        f"Expected note in chord at {self.location(self.current)}"
                     )
                 else:
                     raise SyntaxError("Unexpected end of input in chord")
 
-        self.consume(TokenType.RBRACKET, "Expected ']' after chord notes.")
+        self.expect(TokenType.RBRACKET, "Expected ']' after chord notes.")
 
-        # Parse duration as number/slash/number
-        numerator = self.consume(TokenType.NUMBER, "Expected duration numerator.")
-        self.consume(TokenType.SLASH, "Expected '/' in duration.")
-        denominator = self.consume(TokenType.NUMBER, "Expected duration denominator.")
-        duration = f"{numerator.lexeme}/{denominator.lexeme}"
-
-        return Chord(notes, duration)
+        key = (TokenType.LBRACKET, tuple(notes), self.duration())
+        node = self.nodes.get(key)
+        if node is None:
+            fraction = key[2]
+            node = self.nodes[key] = Chord(
+                notes, self.durations[fraction], None, tuple(pitches), fraction
+            )
+        return node  # type: ignore[return-value]
 
     def rest(self) -> Rest:
-        # Parse duration as number/slash/number
-        numerator = self.consume(TokenType.NUMBER, "Expected duration numerator.")
-        self.consume(TokenType.SLASH, "Expected '/' in duration.")
-        denominator = self.consume(TokenType.NUMBER, "Expected duration denominator.")
-        duration = f"{numerator.lexeme}/{denominator.lexeme}"
-
-        return Rest(duration)
+        key = (TokenType.REST, self.duration())
+        node = self.nodes.get(key)
+        if node is None:
+            fraction = key[1]
+            node = self.nodes[key] = Rest(self.durations[fraction], fraction)
+        return node  # type: ignore[return-value]
 
     def sequence_ref(self) -> SequenceRef:
-        return SequenceRef(self.previous().lexeme)
+        key = (TokenType.IDENTIFIER, self.lexeme(self.current - 1))
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = SequenceRef(key[1])
+        return node  # type: ignore[return-value]
+
+    def repeat(self) -> Repeat:
+        count = self.expect(TokenType.NUMBER, "Expected repeat count.")
+        self.skip_newlines()
+        self.expect(TokenType.LBRACE, "Expected '{' after repeat count.")
+        self.skip_newlines()
+        events = self.events()
+        self.skip_newlines()
+        self.expect(TokenType.RBRACE, "Expected '}' after repeat events.")
+        return Repeat(self.stream.values[count], events)
+
+    def duration(self) -> Tuple[int, int]:
+        # Parse duration as number/slash/number; returns (numerator,
+        # denominator), and self.durations holds its string
+        numerator = self.expect(TokenType.NUMBER, "Expected duration numerator.")
+        self.expect(TokenType.SLASH, "Expected '/' in duration.")
+        denominator = self.expect(TokenType.NUMBER, "Expected duration denominator.")
+        values = self.stream.values
+        fraction = (values[numerator], values[denominator])
+        if fraction not in self.durations:
+            if not fraction[1]:
+                raise SyntaxError(
+                    "Duration denominator must not be zero at "
+                    + self.location(denominator)
+                )
+            self.durations[fraction] = f"{fraction[0]}/{fraction[1]}"
+        return fraction
 
     def consume(self, type: TokenType, message: str) -> Token:
+        return self.stream[self.expect(type, message)]
+
+    def expect(self, type: TokenType, message: str) -> int:
+        # Like consume(), but returns the token's index in the stream.
         if self.check(type):
-            return self.advance()
+            self.current += 1
+            return self.current - 1
 
-        token = self.peek()
-        if token is not None:
-            raise SyntaxError(f"{message} at line {token.line}, column {token.column}")
+        if self.current < self.count:
+            raise SyntaxError(f"{message} at {self.location(self.current)}")
         else:
             raise SyntaxError(f"{message} at end of input")
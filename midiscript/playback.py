@@ -0,0 +1,193 @@
+import asyncio
+import heapq
+import math
+import time
+from operator import itemgetter
+from typing import IO, Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from .midi_generator import AnyProgram, MIDIGenerator
+from .smf import iter_note_messages
+
+# asyncio.sleep can wake up late by a timer tick, so the scheduler sleeps
+# until this many seconds before a deadline and yields to the loop for the rest.
+DEFAULT_SPIN = 0.002
+
+
+class MemorySink:
+    """In-process stand-in port that records (time, message) pairs."""
+
+    def __init__(self):
+        self.messages: List[Tuple[float, bytes]] = []
+        self.started = time.perf_counter()
+
+    def send(self, message: bytes) -> None:
+        self.messages.append((time.perf_counter() - self.started, message))
+
+    def close(self) -> None:
+        pass
+
+
+class FileSink:
+    """Stand-in port that logs each message as ``<seconds> <hex bytes>``."""
+
+    def __init__(self, file: Union[str, IO[str]]):
+        if isinstance(file, str):
+            self.file: IO[str] = open(file, "w")
+            self.owned = True
+        else:
+            self.file = file
+            self.owned = False
+        self.started = time.perf_counter()
+
+    def send(self, message: bytes) -> None:
+        elapsed = time.perf_counter() - self.started
+        self.file.write(f"{elapsed:.6f} {message.hex(' ')}\n")
+
+    def close(self) -> None:
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class MidoSink:
+    """A real MIDI output port, through the optional ``mido`` package."""
+
+    def __init__(self, port: Optional[str] = None):
+        try:
+            import mido  # type: ignore
+        except ImportError:
+            raise ImportError("Playback to MIDI ports requires mido") from None
+        self.mido = mido
+        self.port = mido.open_output(port)
+
+    def send(self, message: bytes) -> None:
+        self.port.send(self.mido.Message.from_bytes(message))
+
+    def close(self) -> None:
+        self.port.close()
+
+
+Sink = Union[MemorySink, FileSink, MidoSink]
+
+
+def open_sink(spec: str) -> Sink:
+    # "memory", "file:<path>", "mido" or "mido:<port name>"
+    kind, _, argument = spec.partition(":")
+    if kind == "memory":
+        return MemorySink()
+    if kind == "file" and argument:
+        return FileSink(argument)
+    if kind == "mido":
+        return MidoSink(argument or None)
+    raise ValueError(
+        f"Unknown playback sink '{spec}', expected memory, file:<path> or mido"
+    )
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(values)))
+    return values[rank - 1]
+
+
+class JitterStats:
+    """Per-event scheduling latency: how late each message was sent."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.duration = 0.0
+
+    def record(self, latency: float) -> None:
+        self.latencies.append(latency)
+
+    def summary(self) -> Dict[str, Any]:
+        # Latencies in milliseconds
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        return {
+            "events": count,
+            "seconds": self.duration,
+            "mean": 1000 * sum(ordered) / count if count else 0.0,
+            "p50": 1000 * percentile(ordered, 0.50),
+            "p90": 1000 * percentile(ordered, 0.90),
+            "p99": 1000 * percentile(ordered, 0.99),
+            "max": 1000 * ordered[-1] if count else 0.0,
+        }
+
+    def report(self) -> str:
+        s = self.summary()
+        return (
+            f"played {s['events']} events in {s['seconds']:.2f} s; "
+            f"latency ms: mean {s['mean']:.3f}, p50 {s['p50']:.3f}, "
+            f"p90 {s['p90']:.3f}, p99 {s['p99']:.3f}, max {s['max']:.3f}"
+        )
+
+
+class Scheduler:
+    """Plays timed MIDI messages to a sink on an asyncio event loop.
+
+    Every message has an absolute deadline measured from the start of
+    playback, so a late wake-up delays one message instead of drifting all
+    the ones after it.
+    """
+
+    def __init__(
+        self,
+        tempo: float = 120,
+        ppq: int = 480,
+        speed: float = 1.0,
+        spin: float = DEFAULT_SPIN,
+    ):
+        self.seconds_per_tick = 60.0 / (tempo * ppq * speed)
+        self.spin = spin
+        self.stats = JitterStats()
+
+    async def play(
+        self, events: Iterable[Tuple[int, bytes]], sink: Sink
+    ) -> JitterStats:
+        loop = asyncio.get_running_loop()
+        clock = loop.time
+        start = clock()
+        for tick, message in events:
+            deadline = start + tick * self.seconds_per_tick
+            delay = deadline - clock() - self.spin
+            if delay > 0:
+                await asyncio.sleep(delay)
+            while clock() < deadline:
+                await asyncio.sleep(0)
+            sink.send(message)
+            self.stats.record(clock() - deadline)
+        self.stats.duration = clock() - start
+        return self.stats
+
+
+def program_events(
+    program: AnyProgram, generator: Optional[MIDIGenerator] = None
+) -> Tuple[float, int, Iterable[Tuple[int, bytes]]]:
+    # (tempo, ppq, timed messages) for all of the program's tracks
+    generator = generator or MIDIGenerator()
+    targets = generator.begin(program, writer=generator.conductor_writer)
+    # Tracks are merged by tick; ties keep track order.
+    events = heapq.merge(
+        *(iter_note_messages(generator.iter_notes(target)) for target in targets),
+        key=itemgetter(0),
+    )
+    return generator.current_tempo, generator.ppq, events
+
+
+def play(
+    program: AnyProgram,
+    sink: Sink,
+    speed: float = 1.0,
+    spin: float = DEFAULT_SPIN,
+) -> JitterStats:
+    """Play ``program`` in real time at its tempo; blocks until done."""
+    tempo, ppq, events = program_events(program)
+    scheduler = Scheduler(tempo, ppq, speed, spin)
+    try:
+        return asyncio.run(scheduler.play(events, sink))
+    finally:
+        sink.close()
@@ -0,0 +1,70 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List
+
+PROFILE_FORMATS = ("text", "json", "cprofile")
+
+
+@dataclass
+class StageProfile:
+    name: str
+    wall: float = 0.0  # seconds
+    cpu: float = 0.0  # seconds of process time
+    peak_bytes: int = 0  # traced allocation peak during the stage
+    counts: Dict[str, int] = field(default_factory=dict)
+
+
+class Profiler:
+    """Collects wall time, CPU time, allocation peak and counts per stage.
+
+    Use ``stage`` as a context manager around each step; it yields a dict the
+    step fills with counts such as tokens or notes.
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages: List[StageProfile] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, int]]:
+        profile = StageProfile(name)
+        started = not tracemalloc.is_tracing() and self.trace_memory
+        if started:
+            tracemalloc.start()
+        elif self.trace_memory and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()  # Python 3.9+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield profile.counts
+        finally:
+            profile.wall = time.perf_counter() - wall
+            profile.cpu = time.process_time() - cpu
+            if self.trace_memory:
+                profile.peak_bytes = tracemalloc.get_traced_memory()[1]
+            if started:
+                tracemalloc.stop()
+            self.stages.append(profile)
+
+    def report(self) -> str:
+        lines = [f"{'stage':<10}{'wall ms':>10}{'cpu ms':>10}{'peak KB':>10}  counts"]
+        for stage in self.stages:
+            counts = ", ".join(
+                f"{key} {value:,}" for key, value in stage.counts.items()
+            )
+            lines.append(
+                f"{stage.name:<10}{stage.wall * 1000:10.1f}{stage.cpu * 1000:10.1f}"
+                f"{stage.peak_bytes / 1024:10.1f}  {counts}"
+            )
+        wall = sum(stage.wall for stage in self.stages)
+        cpu = sum(stage.cpu for stage in self.stages)
+        lines.append(f"{'total':<10}{wall * 1000:10.1f}{cpu * 1000:10.1f}")
+        return "\n".join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"stages": [asdict(stage) for stage in self.stages]}, indent=2
+        )
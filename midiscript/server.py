@@ -0,0 +1,326 @@
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union, cast
+
+from .lexer import Buffer, Lexer, map_source
+from .midi_generator import MIDIGenerator
+from .parser import Parser
+from .playback import percentile
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+# Latencies kept for the percentile statistics
+LATENCY_WINDOW = 10_000
+
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+WARMUP_SOURCE = "sequence main { C4 1/4 [E4 G4] 1/8 }\nplay main"
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    # "unix:<path>" for a Unix socket, otherwise "[host:]port" on loopback
+    if address.startswith("unix:"):
+        return address[len("unix:") :]
+    host, _, port = address.rpartition(":")
+    host = host.strip("[]") or "127.0.0.1"
+    if host not in LOOPBACK_HOSTS:
+        raise ValueError(f"Refusing to listen on non-local address '{host}'")
+    return host, int(port)
+
+
+def compile_source(
+    source: Union[str, Buffer], backend: str
+) -> Tuple[Optional[bytes], List[str]]:
+    # Runs in a worker process; returns (MIDI data, parser errors)
+    parser = Parser(Lexer(source).token_stream())
+    program = parser.parse()
+    if parser.errors:
+        return None, parser.errors
+    return MIDIGenerator(backend=backend).generate(program), []
+
+
+def compile_path(path: str, backend: str) -> Tuple[Optional[bytes], List[str]]:
+    return compile_source(map_source(path), backend)
+
+
+def start_worker() -> None:
+    # Ctrl-C reaches the whole process group; only the server handles it and
+    # then shuts the pool down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def warm_worker(backend: str) -> int:
+    # Imports the backends and fills per-process caches before real requests
+    compile_source(WARMUP_SOURCE, backend)
+    return os.getpid()
+
+
+class ServerStats:
+    """Request counts and latency percentiles, safe to update from threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies: List[float] = []
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+            self.latencies.append(latency)
+            if len(self.latencies) > LATENCY_WINDOW:
+                del self.latencies[: len(self.latencies) - LATENCY_WINDOW]
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            ordered = sorted(self.latencies)
+            uptime = time.monotonic() - self.started
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+                "uptime": uptime,
+                "throughput": self.requests / uptime if uptime else 0.0,
+                "latency_ms": {
+                    "p50": 1000 * percentile(ordered, 0.50),
+                    "p90": 1000 * percentile(ordered, 0.90),
+                    "p99": 1000 * percentile(ordered, 0.99),
+                    "max": 1000 * ordered[-1] if ordered else 0.0,
+                },
+            }
+
+
+class CompileHandler(BaseHTTPRequestHandler):
+    server: "CompileServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self) -> str:
+        # Unix socket peers have no (host, port) address
+        if isinstance(self.client_address, tuple):
+            return str(self.client_address[0])
+        return "unix"
+
+    def send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            self.send_json(200, self.server.stats.summary())
+        else:
+            self.send_json(404, {"error": f"Unknown path '{self.path}'"})
+
+    def do_POST(self) -> None:
+        if self.path != "/compile":
+            self.send_json(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        server = self.server
+        if not server.slots.acquire(timeout=server.queue_timeout):
+            with server.stats.lock:
+                server.stats.rejected += 1
+            self.send_json(503, {"error": "Server busy, try again later"})
+            return
+        started = time.perf_counter()
+        with server.stats.lock:
+            server.stats.in_flight += 1
+        data: Optional[bytes] = None
+        try:
+            status, body = self.compile()
+            if status == 200:
+                data = cast(bytes, body)
+        finally:
+            # Statistics are updated before the reply, so a client that has
+            # its response also sees the request counted.
+            with server.stats.lock:
+                server.stats.in_flight -= 1
+            server.slots.release()
+            server.stats.record(time.perf_counter() - started, data is not None)
+        if data is None:
+            self.send_json(status, cast(Dict[str, Any], body))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/midi")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def compile(self) -> Tuple[int, Union[bytes, Dict[str, Any]]]:
+        # Returns the status and either MIDI data or a JSON error body
+        server = self.server
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                return 400, {"error": "Malformed request: expected a JSON object"}
+            backend = request.get("backend", server.backend)
+            if "source" in request:
+                future = server.pool.submit(compile_source, request["source"], backend)
+            elif "path" in request:
+                future = server.pool.submit(compile_path, request["path"], backend)
+            else:
+                return 400, {"error": "Expected 'source' or 'path'"}
+        except ValueError as e:
+            return 400, {"error": f"Malformed request: {e}"}
+        try:
+            data, errors = future.result()
+        except FileNotFoundError:
+            return 404, {"error": f"Could not find file '{request['path']}'"}
+        except Exception as e:
+            return 422, {"error": str(e)}
+        if data is None:
+            return 422, {"error": "; ".join(errors), "errors": errors}
+        return 200, data
+
+
+class CompileServer(ThreadingHTTPServer):
+    """HTTP compile service on a loopback port or a Unix socket.
+
+    Requests are handled on threads and compiled by a pool of worker
+    processes that were warmed up at start. At most ``max_concurrent``
+    compiles run at once; further requests wait up to ``queue_timeout``
+    seconds for a slot and are then refused with 503.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: str = DEFAULT_ADDRESS,
+        workers: int = 0,
+        max_concurrent: int = 0,
+        queue_timeout: float = 5.0,
+        backend: str = "smf",
+        verbose: bool = False,
+    ):
+        bind = parse_address(address)
+        if isinstance(bind, str):
+            self.address_family = socket.AF_UNIX
+            if os.path.exists(bind):
+                os.unlink(bind)
+        elif ":" in bind[0]:
+            self.address_family = socket.AF_INET6
+        self.workers = workers or os.cpu_count() or 1
+        self.backend = backend
+        self.verbose = verbose
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrent or 2 * self.workers)
+        self.stats = ServerStats()
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=start_worker
+        )
+        super().__init__(bind, CompileHandler)  # type: ignore[arg-type]
+        self.warm()
+
+    def server_bind(self) -> None:
+        if self.address_family == socket.AF_UNIX:
+            # HTTPServer.server_bind expects a (host, port) address
+            self.socket.bind(self.server_address)
+            self.server_name = "localhost"
+            self.server_port = 0
+        else:
+            super().server_bind()
+
+    def warm(self) -> None:
+        # One warm-up task per worker, so every process is started, has its
+        # imports done and has compiled once before real requests arrive.
+        futures = [
+            self.pool.submit(warm_worker, self.backend) for _ in range(self.workers)
+        ]
+        for future in futures:
+            future.result()
+
+    @property
+    def url(self) -> str:
+        if self.address_family == socket.AF_UNIX:
+            return f"unix:{cast(str, self.server_address)}"
+        host, port = cast(Tuple[str, int], self.server_address[:2])
+        return f"{host}:{port}"
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown()
+        if self.address_family == socket.AF_UNIX:
+            try:
+                os.unlink(str(self.server_address))
+            except OSError:
+                pass
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(
+        prog="midiscript serve",
+        description="Serve MidiScript compiles from a pool of warm worker processes",
+    )
+    arg_parser.add_argument(
+        "--listen",
+        default=DEFAULT_ADDRESS,
+        help="[host:]port on a loopback interface, or unix:<path> "
+        "(default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=0,
+        help="Worker processes (default: one per CPU)",
+    )
+    arg_parser.add_argument(
+        "--max-concurrent",
+        type=int,
+        default=0,
+        help="Compiles in progress at once (default: twice the workers)",
+    )
+    arg_parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        default=5.0,
+        help="Seconds a request waits for a free slot before a 503",
+    )
+    arg_parser.add_argument("--backend", choices=MIDIGenerator.BACKENDS, default="smf")
+    arg_parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Log every request"
+    )
+    args = arg_parser.parse_args(argv)
+
+    server = CompileServer(
+        args.listen,
+        args.workers,
+        args.max_concurrent,
+        args.queue_timeout,
+        args.backend,
+        args.verbose,
+    )
+    print(f"Serving on {server.url} with {server.workers} workers (Ctrl-C to stop)")
+    # shutdown() waits for serve_forever, so it must run on another thread
+    signal.signal(
+        signal.SIGTERM,
+        lambda *_: threading.Thread(target=server.shutdown, daemon=True).start(),
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats.summary(), indent=2))
@@ -0,0 +1,352 @@
+import io
+import struct
+from heapq import heappop, heappush
+from operator import itemgetter
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+META = 0xFF
+META_TEMPO = 0x51
+META_TIME_SIGNATURE = 0x58
+META_END_OF_TRACK = 0x2F
+
+MAX_VLQ = 0x0FFFFFFF
+
+# Whole tempos a tempo event can hold, as microseconds per quarter note in
+# three bytes
+MIN_TEMPO = 4
+MAX_TEMPO = 60_000_000
+# Time signature numerators, held in one byte
+MAX_NUMERATOR = 255
+
+# Ordering of events that share a tick: release notes before anything else
+# so a repeated pitch is turned off before it is struck again. A note of no
+# length is released after the notes struck on its tick, so its own note-off
+# always follows its note-on.
+PRIORITY_NOTE_OFF = 0
+PRIORITY_META = 1
+PRIORITY_NOTE_ON = 2
+PRIORITY_EMPTY_NOTE_OFF = 3
+
+END_OF_TRACK = bytes((0x00, META, META_END_OF_TRACK, 0x00))
+
+# (tick, duration, pitch, velocity, channel)
+NoteEvent = Tuple[int, int, int, int, int]
+# (tick, meta type, data)
+MetaEvent = Tuple[int, int, bytes]
+
+# Bytes of encoded track data gathered before a streaming encoder yields
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_event_key = itemgetter(0, 1)
+
+
+def encode_vlq(value: int) -> bytes:
+    if value < 0 or value > MAX_VLQ:
+        raise ValueError(f"Value {value} cannot be encoded as a MIDI delta time")
+    out = bytearray((value & 0x7F,))
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    out.reverse()
+    return bytes(out)
+
+
+def tempo_event(tick: int, bpm: float) -> MetaEvent:
+    microseconds = int(round(60_000_000 / bpm)) if bpm > 0 else 0
+    if not 0 < microseconds <= 0xFFFFFF:
+        raise ValueError(
+            f"Tempo must be between {MIN_TEMPO} and {MAX_TEMPO} bpm, got {bpm}"
+        )
+    return (tick, META_TEMPO, microseconds.to_bytes(3, "big"))
+
+
+def time_signature_event(
+    tick: int,
+    numerator: int,
+    denominator: int,
+    clocks_per_click: int = 24,
+    notated_32nds: int = 8,
+) -> MetaEvent:
+    if not 0 < numerator <= MAX_NUMERATOR:
+        raise ValueError(
+            f"Time signature numerator must be between 1 and {MAX_NUMERATOR}, "
+            f"got {numerator}"
+        )
+    if denominator <= 0 or denominator & (denominator - 1):
+        raise ValueError(
+            f"Time signature denominator must be a power of two, got {denominator}"
+        )
+    data = bytes(
+        (numerator, denominator.bit_length() - 1, clocks_per_click, notated_32nds)
+    )
+    return (tick, META_TIME_SIGNATURE, data)
+
+
+def track_events(
+    notes: List[NoteEvent], meta: List[MetaEvent]
+) -> List[Tuple[int, int, bytes]]:
+    events: List[Tuple[int, int, bytes]] = []
+    append = events.append
+    for tick, meta_type, data in meta:
+        payload = bytes((META, meta_type)) + encode_vlq(len(data)) + data
+        append((tick, PRIORITY_META, payload))
+    for tick, duration, pitch, velocity, channel in notes:
+        append((tick, PRIORITY_NOTE_ON, bytes((NOTE_ON | channel, pitch, velocity))))
+        append(
+            (
+                tick + duration,
+                PRIORITY_NOTE_OFF if duration else PRIORITY_EMPTY_NOTE_OFF,
+                bytes((NOTE_OFF | channel, pitch, velocity)),
+            )
+        )
+    # Stable sort keeps insertion order for events on the same tick.
+    events.sort(key=_event_key)
+    return events
+
+
+def encode_track_into(
+    buf: bytearray, notes: List[NoteEvent], meta: List[MetaEvent]
+) -> None:
+    start = len(buf)
+    buf += b"MTrk\x00\x00\x00\x00"
+    last = 0
+    for tick, _, payload in track_events(notes, meta):
+        delta = tick - last
+        last = tick
+        if delta < 0x80:
+            buf.append(delta)
+        else:
+            buf += encode_vlq(delta)
+        buf += payload
+    buf += END_OF_TRACK
+    struct.pack_into(">I", buf, start + 4, len(buf) - start - 8)
+
+
+def encode_track(notes: List[NoteEvent], meta: List[MetaEvent]) -> bytes:
+    buf = bytearray()
+    encode_track_into(buf, notes, meta)
+    return bytes(buf)
+
+
+def iter_note_messages(notes: Iterable[NoteEvent]) -> Iterator[Tuple[int, bytes]]:
+    """Yield (tick, channel message) pairs in play order from notes in start
+    order, holding note-offs in a heap until their tick comes up.
+    """
+    pending: List[Tuple[int, int, bytes]] = []  # (tick, order, message)
+    last = 0
+    order = 0
+    # Order of the first note struck on the current tick; notes from then
+    # on are not released before the others struck on it.
+    first = 0
+    for tick, duration, pitch, velocity, channel in notes:
+        if tick < last:
+            raise ValueError("Streamed notes must be in start order")
+        if not 0 <= pitch <= 127:
+            raise ValueError(f"MIDI note number {pitch} out of range")
+        if tick > last:
+            first = order
+        while pending and (
+            pending[0][0] < tick or (pending[0][0] == tick and pending[0][1] < first)
+        ):
+            off, _, message = heappop(pending)
+            yield off, message
+        yield tick, bytes((NOTE_ON | channel, pitch, velocity))
+        last = tick
+        heappush(
+            pending,
+            (tick + duration, order, bytes((NOTE_OFF | channel, pitch, velocity))),
+        )
+        order += 1
+    while pending:
+        off, _, message = heappop(pending)
+        yield off, message
+
+
+def iter_note_track(
+    notes: Iterable[NoteEvent], chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Encode the body of a note track in chunks, from notes in start order.
+
+    Memory depends on how many notes sound at once rather than on the length
+    of the track. The output matches ``encode_track`` without the 8-byte
+    chunk header.
+    """
+    buf = bytearray()
+    last = 0
+    for tick, message in iter_note_messages(notes):
+        delta = tick - last
+        if delta < 0x80:
+            buf.append(delta)
+        else:
+            buf += encode_vlq(delta)
+        buf += message
+        last = tick
+        if len(buf) >= chunk_size:
+            yield bytes(buf)
+            buf = bytearray()
+    buf += END_OF_TRACK
+    yield bytes(buf)
+
+
+def stream_smf(
+    conductor: "Track",
+    tracks: List[Callable[[], Iterable[NoteEvent]]],
+    ppq: int = 480,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    # A track's length must precede its data, so each note source is walked
+    # twice: once to measure the encoded track, once to emit it.
+    yield header_chunk(len(tracks) + 1, ppq) + encode_track(
+        conductor.notes, conductor.meta
+    )
+    for notes in tracks:
+        length = sum(len(chunk) for chunk in iter_note_track(notes(), chunk_size))
+        yield b"MTrk" + struct.pack(">I", length)
+        yield from iter_note_track(notes(), chunk_size)
+
+
+def write_smf_stream(
+    fileobj: BinaryIO,
+    conductor: "Track",
+    tracks: List[Callable[[], Iterable[NoteEvent]]],
+    ppq: int = 480,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> None:
+    try:
+        seekable = fileobj.seekable()
+    except (AttributeError, OSError):
+        seekable = False
+    if not seekable:
+        for chunk in stream_smf(conductor, tracks, ppq, chunk_size):
+            fileobj.write(chunk)
+        return
+
+    # Single pass: write placeholder lengths and patch them afterwards.
+    fileobj.write(
+        header_chunk(len(tracks) + 1, ppq)
+        + encode_track(conductor.notes, conductor.meta)
+    )
+    for notes in tracks:
+        position = fileobj.tell()
+        fileobj.write(b"MTrk\x00\x00\x00\x00")
+        length = 0
+        for chunk in iter_note_track(notes(), chunk_size):
+            fileobj.write(chunk)
+            length += len(chunk)
+        fileobj.seek(position + 4)
+        fileobj.write(struct.pack(">I", length))
+        fileobj.seek(0, io.SEEK_END)
+
+
+def header_chunk(num_tracks: int, ppq: int, file_format: int = 1) -> bytes:
+    return b"MThd" + struct.pack(">IHHH", 6, file_format, num_tracks, ppq)
+
+
+class Track:
+    def __init__(self):
+        self.notes: List[NoteEvent] = []
+        self.meta: List[MetaEvent] = []
+
+
+class SMFWriter:
+    """In-memory Type-1 Standard MIDI File encoder.
+
+    Track 0 is the conductor track holding tempo and time signature events;
+    note tracks are numbered from 0 in ``add_note`` like ``midiutil``.
+    """
+
+    def __init__(self, num_tracks: int = 1, ppq: int = 480):
+        self.ppq = ppq
+        self.conductor = Track()
+        self.tracks = [Track() for _ in range(num_tracks)]
+        # Tracks already encoded elsewhere, as MTrk chunks by track number
+        self.encoded: Dict[int, bytes] = {}
+
+    def add_tempo(self, tick: int, bpm: float) -> None:
+        self.conductor.meta.append(tempo_event(tick, bpm))
+
+    def add_time_signature(self, tick: int, numerator: int, denominator: int) -> None:
+        self.conductor.meta.append(time_signature_event(tick, numerator, denominator))
+
+    def add_note(
+        self,
+        track: int,
+        channel: int,
+        pitch: int,
+        tick: int,
+        duration: int,
+        velocity: int,
+    ) -> None:
+        if not 0 <= pitch <= 127:
+            raise ValueError(f"MIDI note number {pitch} out of range")
+        self.tracks[track].notes.append((tick, duration, pitch, velocity, channel))
+
+    def add_encoded_track(self, track: int, chunk: bytes) -> None:
+        self.encoded[track] = chunk
+
+    def track_chunk(self, track: int) -> bytes:
+        if track in self.encoded:
+            return self.encoded[track]
+        return encode_track(self.tracks[track].notes, self.tracks[track].meta)
+
+    def encode_into(self, buf: bytearray) -> None:
+        buf += header_chunk(len(self.tracks) + 1, self.ppq)
+        encode_track_into(buf, self.conductor.notes, self.conductor.meta)
+        for index, track in enumerate(self.tracks):
+            if index in self.encoded:
+                buf += self.encoded[index]
+            else:
+                encode_track_into(buf, track.notes, track.meta)
+
+    def to_bytes(self) -> bytes:
+        buf = bytearray()
+        self.encode_into(buf)
+        return bytes(buf)
+
+    def write(self, fileobj: BinaryIO) -> None:
+        buf = bytearray()
+        self.encode_into(buf)
+        fileobj.write(memoryview(buf))
+
+
+class MIDIUtilWriter:
+    """``SMFWriter``-compatible wrapper around ``midiutil.MIDIFile``."""
+
+    def __init__(self, num_tracks: int = 1, ppq: int = 480):
+        from midiutil import MIDIFile  # type: ignore
+
+        self.ppq = ppq
+        self.midi = MIDIFile(
+            num_tracks, ticks_per_quarternote=ppq, eventtime_is_ticks=True
+        )
+
+    def add_tempo(self, tick: int, bpm: float) -> None:
+        tempo_event(tick, bpm)  # raises for tempos a MIDI file cannot hold
+        self.midi.addTempo(0, tick, bpm)
+
+    def add_time_signature(self, tick: int, numerator: int, denominator: int) -> None:
+        # midiutil takes the denominator as a power of two
+        exponent = time_signature_event(tick, numerator, denominator)[2][1]
+        self.midi.addTimeSignature(0, tick, numerator, exponent, 24, 8)
+
+    def add_note(
+        self,
+        track: int,
+        channel: int,
+        pitch: int,
+        tick: int,
+        duration: int,
+        velocity: int,
+    ) -> None:
+        self.midi.addNote(track, channel, pitch, tick, duration, velocity)
+
+    def to_bytes(self) -> bytes:
+        buf = io.BytesIO()
+        self.midi.writeFile(buf)
+        return buf.getvalue()
+
+    def write(self, fileobj: BinaryIO) -> None:
+        self.midi.writeFile(fileobj)
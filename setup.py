@@ -1,18 +1,30 @@
+import re
+
 from setuptools import setup, find_packages
 
+# midiscript.__version__ is the one place the version is set; it is read as
+# text so that setup.py does not import the package.
+with open("midiscript/__init__.py") as f:
+    version = re.search(r'__version__ = "(.+)"', f.read()).group(1)
+
 setup(
     name="midiscript",
-    version="0.2.4",
+    version=version,
     author="arsnovo",
     description="A programming language for musicians",
     packages=find_packages(),
-    python_requires=">=3.6",
+    python_requires=">=3.8",
     install_requires=[
         "midiutil>=1.2.1",
     ],
+    extras_require={
+        "numpy": ["numpy>=1.17"],
+        "ports": ["mido>=1.2"],
+    },
     entry_points={
         "console_scripts": [
             "midiscript=midiscript.cli:main",
+            "midiscript-client=midiscript.client:main",
         ],
     },
     classifiers=[
@@ -22,8 +34,6 @@ setup(
         "Topic :: Multimedia :: Sound/Audio :: MIDI",
         "Topic :: Software Development :: Compilers",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
-        "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: 3.10",
@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import midiscript
+import midiscript.cache
+from midiscript.cache import CACHE_FORMAT, CompileCache, cache_key
+from midiscript.lexer import Lexer
+from midiscript.parser import Parser
+
+
+def test_cache_key_covers_source_and_options():
+    key = cache_key("sequence main { C4 1/4 }", {"backend": "smf"})
+    assert key == cache_key("sequence main { C4 1/4 }", {"backend": "smf"})
+    assert key != cache_key("sequence main { C4 1/8 }", {"backend": "smf"})
+    assert key != cache_key("sequence main { C4 1/4 }", {"backend": "midiutil"})
+    assert key != cache_key("sequence main { C4 1/4 }")
+
+
+def test_format_or_version_change_misses(tmp_path, monkeypatch):
+    source = "sequence main { C4 1/4 }"
+    cache = CompileCache(tmp_path)
+    cache.put_midi(cache_key(source), b"MThd old")
+    assert cache.get_midi(cache_key(source)) == b"MThd old"
+    monkeypatch.setattr(midiscript.cache, "CACHE_FORMAT", CACHE_FORMAT + 1)
+    assert cache.get_midi(cache_key(source)) is None
+    monkeypatch.undo()
+    monkeypatch.setattr(midiscript.cache, "__version__", "99.0")
+    assert cache.get_midi(cache_key(source)) is None
+
+
+def test_package_version_is_the_release_version():
+    # Cache keys use midiscript.__version__, so it must follow releases
+    root = Path(__file__).parent.parent
+    result = subprocess.run(
+        [sys.executable, "setup.py", "--version"],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split()[-1] == midiscript.__version__
+
+
+def test_midi_round_trip(tmp_path):
+    cache = CompileCache(tmp_path)
+    key = cache_key("source")
+    assert cache.get_midi(key) is None
+    cache.put_midi(key, b"MThd data")
+    assert cache.get_midi(key) == b"MThd data"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_program_round_trip(tmp_path):
+    program = Parser(Lexer("sequence main { C4 1/4 }").tokenize()).parse()
+    key = cache_key("sequence main { C4 1/4 }")
+    assert CompileCache(tmp_path).get_program(key) is None
+    CompileCache(tmp_path).put_program(key, program)
+    assert CompileCache(tmp_path).get_program(key) is None
+    cache = CompileCache(tmp_path, store_programs=True)
+    cache.put_program(key, program)
+    assert cache.get_program(key) == program
+
+
+def test_lru_eviction(tmp_path):
+    cache = CompileCache(tmp_path, max_bytes=250)
+    keys = [cache_key(str(index)) for index in range(3)]
+    for age, key in zip((30, 20), keys):
+        cache.put_midi(key, bytes(100))
+        path = cache.path(key, ".mid")
+        os.utime(path, (path.stat().st_atime - age, path.stat().st_mtime - age))
+    # Reading the oldest entry makes it the most recently used one.
+    assert cache.get_midi(keys[0]) is not None
+    cache.put_midi(keys[2], bytes(100))
+    assert cache.get_midi(keys[0]) is not None
+    assert cache.get_midi(keys[1]) is None
+    assert cache.get_midi(keys[2]) is not None
+    assert cache.stats()["bytes"] == 200
@@ -0,0 +1,72 @@
+from midiscript.check import check_source, reference_errors
+from midiscript.lexer import Lexer
+from midiscript.parser import Note, Parser, SequenceRef
+
+
+def test_valid_source_has_no_errors():
+    source = "sequence a { C4 1/4 repeat 2 { b } }\nsequence b { R 1/8 }\nplay a\n"
+    assert check_source(source) == []
+    assert check_source(source.encode()) == []
+
+
+def test_recovering_parser_keeps_going():
+    source = (
+        "sequence a { C4 1/4 D4 1/ E4 1/8 5 [F4 G4 1/4 b }\n"
+        "sequence b { R 1/4\n"
+        "sequence c { repeat { c } }\n"
+        "play zz\n"
+    )
+    lexer = Lexer(source, recover=True)
+    parser = Parser(lexer.token_stream(), recover=True)
+    program = parser.parse()
+    assert parser.errors == [
+        "Expected duration denominator. at line 1, column 27",
+        "Unexpected '5' in events at line 1, column 34",
+        "Expected note in chord at line 1, column 43",
+        "Expected '}' after sequence events. at line 3, column 1",
+        "Expected repeat count. at line 3, column 21",
+    ]
+    # Events that parsed cleanly are kept, so references still resolve
+    assert program.sequences["a"].events == [
+        Note("C4", "1/4"),
+        Note("E4", "1/8"),
+        SequenceRef("b"),
+    ]
+    assert list(program.sequences) == ["a", "b", "c"]
+    assert reference_errors(program) == [
+        "Sequence 'zz' not found",
+        "Circular reference detected in sequence 'c' (c -> c)",
+    ]
+
+
+def test_cycles_are_reported_once():
+    source = (
+        "sequence a { b }\nsequence b { c d }\nsequence c { a }\n"
+        "sequence d { d }\nplay a\n"
+    )
+    assert check_source(source) == [
+        "Circular reference detected in sequence 'a' (a -> b -> c -> a)",
+        "Circular reference detected in sequence 'd' (d -> d)",
+    ]
+
+
+def test_deep_reference_chain():
+    depth = 20_000
+    source = "".join(f"sequence s{i} {{ s{i + 1} }}\n" for i in range(depth))
+    source += f"sequence s{depth} {{ s{depth // 2} }}\nplay s0\n"
+    (error,) = check_source(source)
+    assert error.startswith(f"Circular reference detected in sequence 's{depth // 2}'")
+
+
+def test_lexer_reports_each_run_of_invalid_characters():
+    lexer = Lexer("C4 1/4 %% D4 1/4 ;\n", recover=True)
+    stream = lexer.token_stream()
+    assert lexer.errors == [
+        "Invalid character % at line 1, column 8",
+        "Invalid character ; at line 1, column 18",
+    ]
+    assert len(stream) == 10
+    # Non-ASCII text goes through the character-by-character engine
+    lexer = Lexer("C4 1/4 →→ D4 1/4\n", recover=True)
+    assert len(lexer.token_stream()) == 10
+    assert lexer.errors == ["Invalid character → at line 1, column 8"]
@@ -0,0 +1,315 @@
+import json
+import pstats
+import subprocess
+import sys
+
+import pytest
+from midiscript.cli import BACKENDS, DEFAULT_CACHE_MB, PROFILE_FORMATS, main
+from midiscript.cache import DEFAULT_MAX_BYTES
+from midiscript.midi_generator import MIDIGenerator
+from midiscript.profiling import PROFILE_FORMATS as PROFILER_FORMATS
+
+SONG = "tempo 120\nsequence main {\n  C4 1/4\n  [C4 E4 G4] 1/2\n}\nplay main\n"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / "cache"
+    monkeypatch.setenv("MIDISCRIPT_CACHE_DIR", str(path))
+    return path
+
+
+def test_single_file(tmp_path, capsys):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    main([str(song)])
+    assert (tmp_path / "song.mid").read_bytes().startswith(b"MThd")
+    assert "Successfully created MIDI file" in capsys.readouterr().out
+
+
+def test_single_file_missing(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exit:
+        main([str(tmp_path / "missing.ms")])
+    assert exit.value.code == 1
+    assert "Could not find file" in capsys.readouterr().out
+
+
+def test_batch_directory(tmp_path, capsys):
+    library = tmp_path / "library"
+    (library / "nested").mkdir(parents=True)
+    for name in ("a.ms", "b.ms", "nested/c.ms"):
+        (library / name).write_text(SONG)
+    out = tmp_path / "out"
+    with pytest.raises(SystemExit) as exit:
+        main([str(library), "-j", "2", "--out-dir", str(out)])
+    assert exit.value.code == 0
+    for name in ("a.mid", "b.mid", "nested/c.mid"):
+        assert (out / name).read_bytes().startswith(b"MThd")
+    assert "3 succeeded, 0 failed" in capsys.readouterr().out
+
+
+def test_batch_reports_failures(tmp_path, capsys):
+    (tmp_path / "good.ms").write_text(SONG)
+    (tmp_path / "bad.ms").write_text("sequence main { C4 1/4 % }")
+    with pytest.raises(SystemExit) as exit:
+        main([str(tmp_path / "*.ms")])
+    assert exit.value.code == 1
+    output = capsys.readouterr().out
+    assert "FAILED" in output and "bad.ms" in output
+    assert "1 succeeded, 1 failed" in output
+    assert (tmp_path / "good.mid").exists()
+
+
+def test_output_requires_single_input(tmp_path):
+    with pytest.raises(SystemExit) as exit:
+        main(["a.ms", "b.ms", "-o", str(tmp_path / "x.mid")])
+    assert exit.value.code == 2
+
+
+@pytest.mark.parametrize(
+    "option", [["--trace"], ["--profile"], ["--profile-output", "p.json"]]
+)
+def test_single_file_options_reject_batches(option, capsys):
+    with pytest.raises(SystemExit) as exit:
+        main(["a.ms", "b.ms", *option])
+    assert exit.value.code == 2
+    assert f"{option[0]} requires a single input file" in capsys.readouterr().err
+
+
+def test_cache_hit(tmp_path, capsys, cache_dir):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    main([str(song), "--cache-stats"])
+    first = (tmp_path / "song.mid").read_bytes()
+    assert "cache: 0 hits, 1 misses" in capsys.readouterr().out
+    (tmp_path / "song.mid").unlink()
+    main([str(song), "--cache-stats"])
+    assert (tmp_path / "song.mid").read_bytes() == first
+    assert "cache: 1 hits, 0 misses" in capsys.readouterr().out
+
+
+def test_no_cache(tmp_path, cache_dir):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    main([str(song), "--no-cache"])
+    assert (tmp_path / "song.mid").exists()
+    assert not cache_dir.exists()
+
+
+def test_parse_errors_fail_and_are_not_cached(tmp_path, capsys, cache_dir):
+    song = tmp_path / "song.ms"
+    song.write_text("sequence main { C4 }")
+    with pytest.raises(SystemExit) as exit:
+        main([str(song)])
+    assert exit.value.code == 1
+    assert "Error: Expected duration" in capsys.readouterr().out
+    assert not (tmp_path / "song.mid").exists()
+    assert not list(cache_dir.glob("*/*"))
+
+
+def test_batch_reports_parse_errors(tmp_path, capsys):
+    (tmp_path / "good.ms").write_text(SONG)
+    (tmp_path / "bad.ms").write_text("sequence main { C4 }")
+    with pytest.raises(SystemExit) as exit:
+        main([str(tmp_path / "*.ms")])
+    assert exit.value.code == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith(f"FAILED  {tmp_path / 'bad.ms'}: Expected duration")
+    assert lines[1].startswith("ok      ")
+    assert lines[2:] == ["1 succeeded, 1 failed"]
+    assert not (tmp_path / "bad.mid").exists()
+
+
+def test_batch_cache_stats(tmp_path, capsys):
+    (tmp_path / "a.ms").write_text(SONG)
+    (tmp_path / "b.ms").write_text(SONG.replace("C4 1/4", "D4 1/8"))
+    for _ in range(2):
+        with pytest.raises(SystemExit):
+            main([str(tmp_path / "*.ms"), "--cache-stats", "--cache-programs"])
+    output = capsys.readouterr().out
+    # two MIDI entries plus two cached programs
+    assert "cache: 0 hits, 2 misses, 4 entries" in output
+    assert "cache: 2 hits, 0 misses, 4 entries" in output
+    assert "cached  " in output
+
+
+def test_stream_to_stdout(tmp_path, capsysbinary):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    main([str(song), "--no-cache"])
+    expected = (tmp_path / "song.mid").read_bytes()
+    capsysbinary.readouterr()
+    main([str(song), "-o", "-"])
+    assert capsysbinary.readouterr().out == expected
+
+    main([str(song), "--stream", "-o", str(tmp_path / "streamed.mid")])
+    assert (tmp_path / "streamed.mid").read_bytes() == expected
+
+
+def test_profile_text(tmp_path, capsys):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    main([str(song), "--profile"])
+    report = capsys.readouterr().err
+    for stage in ("tokenize", "parse", "generate", "write", "total"):
+        assert stage in report
+    assert "notes 4" in report
+
+
+def test_profile_json(tmp_path):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    report = tmp_path / "profile.json"
+    main([str(song), "--profile", "json", "--profile-output", str(report)])
+    stages = json.loads(report.read_text())["stages"]
+    assert [stage["name"] for stage in stages] == [
+        "tokenize",
+        "parse",
+        "generate",
+        "write",
+    ]
+    assert stages[0]["counts"]["tokens"] == 27
+    assert all(stage["wall"] >= 0 and stage["peak_bytes"] > 0 for stage in stages)
+
+
+def test_profile_cprofile(tmp_path, capsys):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    main([str(song), "--profile=cprofile"])
+    stats = pstats.Stats(str(tmp_path / "song.pstats"))
+    assert any(name == "parse" for _, _, name in stats.stats)
+    assert "cProfile stats written to" in capsys.readouterr().err
+
+
+# Import budgets for midiscript.cli, measured by python -X importtime rather
+# than by wall clock. It takes about 20 ms and pulls in under ten modules
+# beyond a bare interpreter, where an eager import of the compiler adds some
+# thirty modules and 40 ms, and NumPy a hundred modules and 100 ms.
+IMPORT_BUDGET_US = 150_000
+IMPORT_MODULE_BUDGET = 25
+
+# Loaded only when a compile stage runs
+HEAVY_MODULES = (
+    "midiscript.lexer",
+    "midiscript.parser",
+    "midiscript.midi_generator",
+    "midiscript.smf",
+    "midiscript.cache",
+    "midiutil",
+    "numpy",
+    "concurrent.futures",
+    "logging",
+)
+
+
+def loaded_modules(statement):
+    # Heavy modules present in sys.modules of a fresh interpreter after statement
+    check = "\n".join(
+        [
+            "import sys",
+            statement,
+            f"loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]",
+            "print(*loaded, file=sys.stderr)",
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True, check=True
+    )
+    return result.stderr.split()
+
+
+def import_times(statement):
+    # Cumulative microseconds per module from python -X importtime
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_import_budget():
+    # Best of three, so a busy machine does not fail it
+    runs = [import_times("import midiscript.cli") for _ in range(3)]
+    assert min(times["midiscript.cli"] for times in runs) < IMPORT_BUDGET_US
+    added = set(runs[0]) - set(import_times("pass"))
+    assert len(added) <= IMPORT_MODULE_BUDGET, sorted(added)
+
+
+def test_cli_import_is_lazy():
+    assert loaded_modules("import midiscript.cli") == []
+
+
+def test_cli_help_is_lazy():
+    statement = (
+        "from midiscript.cli import main\n"
+        "try:\n    main(['--help'])\nexcept SystemExit:\n    pass"
+    )
+    assert loaded_modules(statement) == []
+
+
+def test_cli_option_tables_match_modules():
+    assert BACKENDS == MIDIGenerator.BACKENDS
+    assert PROFILE_FORMATS == PROFILER_FORMATS
+    assert DEFAULT_CACHE_MB * 1024 * 1024 == DEFAULT_MAX_BYTES
+
+
+def test_check_reports_every_error(tmp_path, capsys):
+    (tmp_path / "good.ms").write_text(SONG)
+    (tmp_path / "bad.ms").write_text(
+        "sequence main { C4 1/ D4 1/4 % missing }\nplay main channel 30\n"
+    )
+    with pytest.raises(SystemExit) as exit:
+        main(["--check", str(tmp_path), "-j", "2"])
+    assert exit.value.code == 1
+    lines = capsys.readouterr().out.splitlines()
+    bad = str(tmp_path / "bad.ms")
+    assert lines == [
+        f"{bad}: Invalid character % at line 1, column 30",
+        f"{bad}: Expected duration denominator. at line 1, column 23",
+        f"{bad}: Channel must be between 1 and 16 at line 2, column 19",
+        f"{bad}: Referenced sequence 'missing' not found "
+        "(referenced from sequence 'main')",
+        "Checked 2 file(s): 4 error(s) in 1 file(s)",
+    ]
+    assert not list(tmp_path.glob("*.mid"))
+
+
+def test_check_does_not_load_the_generator(tmp_path):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "from midiscript.cli import main\n"
+            "try:\n"
+            f"    main(['--check', {str(song)!r}])\n"
+            "except SystemExit as e:\n"
+            "    assert e.code == 0\n"
+            "print(sorted(set(sys.modules) & {'midiscript.midi_generator', "
+            "'midiscript.smf', 'midiutil', 'numpy'}))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
+def test_lazy_compile_matches_full_compile(tmp_path, capsys):
+    song = tmp_path / "song.ms"
+    song.write_text("sequence unused { C4 1/ }\n" + SONG)
+    main([str(song), "--lazy", "-o", str(tmp_path / "lazy.mid")])
+    assert "Skipped 1 unreachable sequence(s): unused" in capsys.readouterr().out
+    (tmp_path / "plain.ms").write_text(SONG)
+    main([str(tmp_path / "plain.ms"), "-o", str(tmp_path / "plain.mid")])
+    assert (tmp_path / "lazy.mid").read_bytes() == (tmp_path / "plain.mid").read_bytes()
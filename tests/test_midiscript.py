@@ -1,7 +1,21 @@
+import logging
+import random
+import re
+import types
+
 import pytest
-from midiscript.lexer import Lexer, TokenType
-from midiscript.parser import Parser, Note
+from midiscript.lexer import Lexer, TokenStream, TokenType, map_source
+from midiscript.parser import (
+    LoggingListener,
+    Note,
+    Parser,
+    PlayTarget,
+    Program,
+    Repeat,
+    SequenceRef,
+)
 from midiscript.midi_generator import MIDIGenerator
+from midiscript.incremental import IncrementalCompiler
 
 
 def test_time_signature_lexer():
@@ -29,6 +43,197 @@ def test_lexer():
     assert tokens[8].type == TokenType.EOF
 
 
+def test_iter_tokens_is_lazy():
+    tokens = Lexer("sequence main { C4 1/4 }").iter_tokens()
+    assert isinstance(tokens, types.GeneratorType)
+    assert next(tokens).type == TokenType.SEQUENCE
+
+
+def test_token_positions():
+    tokens = Lexer("tempo 120\n  play main").tokenize()
+    positions = [(t.type, t.line, t.column) for t in tokens]
+    assert positions == [
+        (TokenType.TEMPO, 1, 1),
+        (TokenType.NUMBER, 1, 7),
+        (TokenType.NEWLINE, 1, 10),
+        (TokenType.PLAY, 2, 3),
+        (TokenType.IDENTIFIER, 2, 8),
+        (TokenType.EOF, 2, 12),
+    ]
+
+
+def test_invalid_character():
+    with pytest.raises(Exception, match="Invalid character : at line 2, column 3"):
+        Lexer("C4\nC4:").tokenize()
+
+
+def test_regex_engine_matches_char_engine():
+    rng = random.Random(0)
+    alphabet = "ABCDEFGRabz#_-0123456789/{}[] \t\r\x0c\n"
+
+    def run(tokenize):
+        try:
+            return tokenize()
+        except Exception as e:
+            return str(e)
+
+    for _ in range(500):
+        source = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        if rng.random() < 0.1:
+            source += rng.choice(":\u00e9\u00b2")
+        expected = run(lambda: list(Lexer(source).iter_tokens_by_char()))
+        assert run(Lexer(source).tokenize) == expected
+
+
+def test_token_stream_matches_tokenize():
+    source = (
+        "tempo 96\nsequence main {\n  C4 1/4 [C4 E4] 1/2\n  R 1/8 verse\n}\nplay main"
+    )
+    stream = Lexer(source).token_stream()
+    tokens = Lexer(source).tokenize()
+    assert list(stream) == tokens
+    assert stream.type(2) == TokenType.NEWLINE
+    assert stream.lexeme(3) == "sequence"
+    assert TokenStream.from_tokens(tokens)[5] == tokens[5]
+
+
+def test_note_and_number_values(tmp_path):
+    source = "C-1 G9 C4 Cb4 B#3 Bb-1 C10 Bass2 b2 96"
+    tokens = Lexer(source).tokenize()
+    assert [(token.type, token.value) for token in tokens] == [
+        (TokenType.NOTE, 0),
+        (TokenType.NOTE, 127),
+        (TokenType.NOTE, 60),
+        (TokenType.NOTE, 59),
+        (TokenType.NOTE, 60),
+        (TokenType.NOTE, 10),
+        (TokenType.NOTE, -1),
+        (TokenType.IDENTIFIER, None),
+        (TokenType.IDENTIFIER, None),
+        (TokenType.NUMBER, 96),
+        (TokenType.EOF, None),
+    ]
+    path = tmp_path / "song.ms"
+    path.write_text(source)
+    stream = Lexer(map_source(str(path))).token_stream()
+    assert list(stream) == tokens
+    assert list(TokenStream.from_tokens(Lexer(source).iter_tokens_by_char())) == tokens
+    with pytest.raises(Exception, match="Number 4294967296 is too large"):
+        Lexer("tempo 4294967296").token_stream()
+
+
+def test_parser_decodes_pitches_and_durations():
+    program = parse("sequence main { C-1 1/4 [Cb4 B#3] 01/8 R 2/8 G9 1/4 }")
+    note, chord, rest, top = program.sequences["main"].events
+    assert (note.pitch, note.fraction, top.pitch) == (0, (1, 4), 127)
+    assert (chord.pitches, chord.duration, chord.fraction) == ((59, 60), "1/8", (1, 8))
+    assert rest.fraction == (2, 8)
+    assert Note("Cb4", "1/8") == Note("Cb4", "1/8", None, 59, (1, 8))
+    with pytest.raises(ValueError, match="Invalid note 'H4'"):
+        Note("H4", "1/4")
+
+    for source, message in [
+        ("C10 1/4", "Note 'C10' is outside the MIDI range 0-127 at line 1, column 17"),
+        ("[C4 G#9] 1/4", "Note 'G#9' is outside the MIDI range 0-127"),
+        ("C4 1/0", "Duration denominator must not be zero at line 1, column 22"),
+    ]:
+        with pytest.raises(SyntaxError, match=re.escape(message)):
+            parser = Parser(Lexer(f"sequence main {{ {source} }}").token_stream())
+            parser.statement(Program())
+
+
+@pytest.mark.parametrize(
+    "source, message",
+    [
+        ("tempo 0", "Tempo must be between 4 and 60000000 at line 1, column 7"),
+        ("\ntempo 3", "Tempo must be between 4 and 60000000 at line 2, column 7"),
+        (
+            "time 256/4",
+            "Time signature numerator must be between 1 and 255 at line 1, column 6",
+        ),
+        ("time 0/4", "Time signature numerator must be between 1 and 255"),
+        (
+            "time 3/6",
+            "Time signature denominator must be a power of two at line 1, column 8",
+        ),
+        ("time 3/0", "Time signature denominator must be a power of two"),
+    ],
+)
+def test_tempo_and_time_signature_ranges(source, message):
+    parser = Parser(Lexer(source + "\nsequence main { C4 1/4 }").token_stream())
+    parser.parse()
+    assert len(parser.errors) == 1 and parser.errors[0].startswith(message)
+
+
+def test_token_stream_is_compact():
+    stream = Lexer("sequence main { C4 1/4 }").token_stream()
+    columns = (stream.types, stream.starts, stream.ends, stream.values)
+    assert sum(column.itemsize for column in columns) <= 13
+    assert not hasattr(stream, "lines") and not hasattr(stream, "columns")
+    # Positions are worked out from the offsets
+    source = "tempo 96\n\n  sequence main {\n C4 1/4 }"
+    positions = [(3, 3), (3, 12), (3, 17), (3, 18), (4, 2)]
+    stream = Lexer(source).token_stream()
+    assert [(token.line, token.column) for token in stream][4:9] == positions
+    stream = Lexer(source.replace("\n", "\r\n").encode()).token_stream()
+    assert [(token.line, token.column) for token in stream][4:9] == positions
+
+
+def test_buffer_lexing_matches_text(tmp_path):
+    source = (
+        "tempo 96\nsequence main {\n  C4 1/4 [C4 E4] 1/2\n  R 1/8 verse\n}\nplay main"
+    )
+    path = tmp_path / "song.ms"
+    path.write_bytes(source.replace("\n", "\r\n").encode())
+    stream = Lexer(map_source(str(path))).token_stream()
+    expected = Lexer(source).tokenize()
+    assert [(t.type, t.line, t.column) for t in stream] == [
+        (t.type, t.line, t.column) for t in expected
+    ]
+    assert [t.lexeme for t in stream if t.type != TokenType.NEWLINE] == [
+        t.lexeme for t in expected if t.type != TokenType.NEWLINE
+    ]
+    assert Parser(stream).parse() == Parser(expected).parse()
+
+
+def test_buffer_lexing_falls_back_for_non_ascii(tmp_path):
+    source = "sequence mélodie { C4 1/4 }\nplay mélodie\n"
+    assert list(Lexer(source.encode()).token_stream()) == Lexer(source).tokenize()
+    path = tmp_path / "crlf.ms"
+    path.write_bytes(b"sequence m\xc3\xa9lodie {\r\n C4 1/4\r\r R 1/8 }\r\nplay x:\r\n")
+    with open(path) as f:
+        text = f.read()
+    for recover in (False, True):
+        text_lexer = Lexer(text, recover)
+        buffer_lexer = Lexer(map_source(str(path)), recover)
+        try:
+            expected = list(text_lexer.token_stream())
+        except Exception as e:
+            with pytest.raises(Exception, match=re.escape(str(e))):
+                buffer_lexer.token_stream()
+            continue
+        assert list(buffer_lexer.token_stream()) == expected
+        assert (
+            buffer_lexer.errors
+            == text_lexer.errors
+            == ["Invalid character : at line 5, column 7"]
+        )
+    with pytest.raises(Exception, match="Invalid character \\$ at line 1, column 4"):
+        Lexer(b"C4 $").token_stream()
+    empty = tmp_path / "empty.ms"
+    empty.write_bytes(b"")
+    assert [t.type for t in Lexer(map_source(str(empty))).tokenize()] == [TokenType.EOF]
+
+
+def test_parser_accepts_token_stream():
+    source = "tempo 96\nsequence main {\n  C4 1/4 [C4 E4] 1/2\n  R 1/8\n}\nplay main"
+    from_stream = Parser(Lexer(source).token_stream()).parse()
+    from_list = Parser(Lexer(source).tokenize()).parse()
+    assert from_stream == from_list
+    assert from_stream.tempo is not None and from_stream.tempo.value == 96
+    assert len(from_stream.sequences["main"].events) == 3
+
+
 def test_parser():
     lexer = Lexer("sequence main { C4 1/4 }")
     tokens = lexer.tokenize()
@@ -42,6 +247,38 @@ def test_parser():
     assert first_event.duration == "1/4"
 
 
+def test_parser_is_silent(capsys):
+    Parser(
+        Lexer("tempo 90\nsequence main { C4 1/4 R 1/4 }\nplay main").tokenize()
+    ).parse()
+    assert capsys.readouterr().out == ""
+
+
+def test_parser_listener():
+    events = []
+    source = "tempo 90\nsequence main { C4 1/4 [C4 E4] 1/2 }\nplay main"
+    Parser(
+        Lexer(source).tokenize(),
+        listener=lambda event, token, detail: events.append((event, token.lexeme)),
+    ).parse()
+    assert events == [
+        ("statement", "tempo"),
+        ("tempo", "tempo"),
+        ("statement", "sequence"),
+        ("event", "C4"),
+        ("event", "["),
+        ("sequence", "main"),
+        ("statement", "play"),
+        ("play", "play"),
+    ]
+
+
+def test_logging_listener(caplog):
+    with caplog.at_level(logging.DEBUG, logger="midiscript.parser"):
+        Parser(Lexer("sequence main { C4 1/4 }").tokenize(), LoggingListener()).parse()
+    assert "event: NOTE 'C4' at line 1, column 17" in caplog.text
+
+
 def test_midi_generator():
     lexer = Lexer("sequence main { C4 1/4 }")
     tokens = lexer.tokenize()
@@ -52,5 +289,280 @@ def test_midi_generator():
     assert len(midi_data) > 0
 
 
+def parse(source: str):
+    return Parser(Lexer(source).token_stream()).parse()
+
+
+def test_repeated_sequence_compiled_once():
+    verse = "C4 1/4 [E4 G4] 1/8 R 1/8 "
+    referenced = parse(
+        "sequence verse { " + verse + "}\nsequence main { " + "verse " * 64 + "}"
+        "\nplay main"
+    )
+    inline = parse("sequence main { " + verse * 64 + "}")
+    generator = MIDIGenerator()
+    assert generator.generate(referenced) == MIDIGenerator().generate(inline)
+    assert generator.cache_misses == 2
+    # Compiling main needs only the length of verse, not its block; the
+    # block is looked up once for main and once per call as notes are emitted
+    assert generator.cache_hits == 1 + 64
+
+
+def test_sequence_cache_is_bounded():
+    source = (
+        "sequence a { C4 1/4 }\nsequence b { a D4 1/8 a }\n"
+        "sequence c { b a b }\nsequence main { c b c }\nplay main"
+    )
+    program = parse(source)
+    bounded = MIDIGenerator(cache_size=1)
+    assert bounded.generate(program) == MIDIGenerator().generate(program)
+    assert len(bounded.compiled) == 1
+
+
+def test_circular_reference():
+    program = parse("sequence a { C4 1/4 b }\nsequence b { a }\nplay a")
+    with pytest.raises(ValueError, match="Circular reference"):
+        MIDIGenerator().generate(program)
+
+
+def test_deep_nesting_is_not_limited_by_recursion():
+    depth = 20_000
+    source = (
+        "".join(f"sequence s{i} {{ C4 1/16 s{i + 1} }}\n" for i in range(depth))
+        + f"sequence s{depth} {{ D4 1/4 }}\nplay s0\n"
+    )
+    program = parse(source)
+    generator = MIDIGenerator()
+    generator.render(program)
+    assert generator.note_count == depth + 1
+    assert generator.lengths["s0"] == depth * 30 + 120
+    notes = list(generator.iter_notes(PlayTarget("s0")))
+    assert notes[-1][:3] == (depth * 30, 120, 62)
+
+    program.sequences[f"s{depth}"].events.append(SequenceRef(f"s{depth // 2}"))
+    with pytest.raises(ValueError, match=f"Circular reference.*'s{depth // 2}'"):
+        MIDIGenerator().generate(program)
+
+
+def test_repeat_matches_written_out_events():
+    repeated = parse(
+        "sequence verse { C4 1/4 [E4 G4] 1/8 }\n"
+        "sequence main {\n  D4 1/2\n  repeat 3 {\n    verse R 1/16\n"
+        "    repeat 2 { F4 1/8 }\n  }\n  repeat 0 { A4 1/4 }\n}\nplay main"
+    )
+    assert repeated.sequences["main"].events[1] == Repeat(
+        3,
+        [SequenceRef("verse"), repeated.sequences["main"].events[1].events[1]]
+        + [Repeat(2, [Note("F4", "1/8")])],
+    )
+    written = parse(
+        "sequence verse { C4 1/4 [E4 G4] 1/8 }\n"
+        "sequence main { D4 1/2 " + "verse R 1/16 F4 1/8 F4 1/8 " * 3 + "}\nplay main"
+    )
+    assert MIDIGenerator().generate(repeated) == MIDIGenerator().generate(written)
+    generator = MIDIGenerator()
+    generator.begin(repeated)
+    target = generator.play_targets(repeated)[0]
+    expected = MIDIGenerator()
+    expected.begin(written)
+    assert list(generator.iter_notes(target)) == list(expected.iter_notes(target))
+
+
+def test_repeat_is_not_materialized():
+    program = parse(
+        "sequence verse { C4 1/4 [E4 G4] 1/8 }\n"
+        "sequence main { repeat 1000000 { verse } }\nplay main"
+    )
+    generator = MIDIGenerator()
+    generator.begin(program)
+    main = generator.block("main")
+    verse = generator.block("verse")
+    ((offset, body, count),) = main.calls
+    assert (offset, count) == (0, 1_000_000)
+    assert body.calls == [(0, "verse", 1)] and not body.notes
+    assert main.length == 1_000_000 * verse.length
+    notes = generator.iter_notes(generator.play_targets(program)[0])
+    assert [next(notes)[0] for _ in range(6)] == [0, 120, 120, 180, 300, 300]
+
+
+def test_silent_repeats_cost_nothing():
+    program = parse(
+        "sequence rests { R 1/4 repeat 1000 { } }\n"
+        "sequence main { repeat 100000000 { } repeat 1000000 { rests R 1/8 }"
+        " C4 1/4 }\nplay main"
+    )
+    generator = MIDIGenerator()
+    generator.begin(program)
+    main = generator.block("main")
+    assert main.calls == [] and main.note_total == 1
+    assert generator.block("rests").note_total == 0
+    start = 1_000_000 * 180
+    assert main.notes == [(start, 120, 60, 0)] and main.length == start + 120
+    notes = list(generator.iter_notes(generator.play_targets(program)[0]))
+    assert notes == [(start, 120, 60, 100, 0)]
+    for backend in MIDIGenerator.BACKENDS:
+        assert MIDIGenerator(backend).generate(program)
+
+
+def test_identical_events_share_one_node():
+    program = parse(
+        "sequence a { C4 1/4 [E4 G4] 1/8 R 1/4 b }\n"
+        "sequence b { C4 1/4 [E4 G4] 1/8 R 1/4 C4 1/8 }\nplay a"
+    )
+    a, b = program.sequences["a"].events, program.sequences["b"].events
+    assert all(x is y for x, y in zip(a[:3], b[:3]))
+    assert b[3] == Note("C4", "1/8") and b[3] != a[0]
+    assert b[3].name is a[0].name and b[1].duration is b[3].duration
+    assert not hasattr(a[0], "__dict__")
+    assert repr(a[2]) == "Rest(duration='1/4', fraction=(1, 4))"
+
+
+def test_lazy_parse_only_reachable_sequences():
+    source = (
+        "sequence junk { C4 1/ ]] }\n"
+        "sequence verse { C4 1/4 repeat 2 { bridge [E4 G4] 1/8 } }\n"
+        "sequence bridge {\n  R 1/4 D4 1/8\n}\n"
+        "sequence main { verse verse }\n"
+        "sequence other { main }\n"
+        "play main\n"
+    )
+    parser = Parser(Lexer(source).token_stream(), lazy=True)
+    program = parser.parse()
+    # The broken body of 'junk' is skipped without being parsed
+    assert parser.errors == []
+    assert parser.unreachable == ["junk", "other"]
+    assert list(program.sequences) == ["verse", "bridge", "main"]
+    full = parse(source.replace("C4 1/ ]]", "C4 1/4"))
+    for name in program.sequences:
+        assert program.sequences[name] == full.sequences[name]
+    assert MIDIGenerator().generate(program) == MIDIGenerator().generate(full)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "sequence a { C4 1/4\nsequence b { R 1/4 }\nplay b",
+        "sequence a { repeat 2 { C4 1/4 }\n",
+        "sequence a { C4 1/4 7 }\nplay a",
+    ],
+)
+def test_lazy_parse_reports_errors_like_full_parse(source):
+    lazy = Parser(Lexer(source).token_stream(), lazy=True)
+    lazy.parse()
+    full = Parser(Lexer(source).token_stream())
+    full.parse()
+    assert lazy.errors == full.errors and lazy.errors
+
+
+def test_repeat_syntax_errors():
+    parser = Parser(Lexer("sequence main { repeat { C4 1/4 } }").token_stream())
+    parser.parse()
+    assert parser.errors == ["Expected repeat count. at line 1, column 24"]
+
+
+LIBRARY = (
+    "tempo 100\n"
+    "sequence riff { C4 1/8 E4 1/8 }\n"
+    "sequence verse { riff [C4 E4 G4] 1/2 riff }\n"
+    "sequence bridge { R 1/4 D4 1/4 }\n"
+    "sequence main { verse bridge verse }\n"
+    "play main\n"
+)
+
+
+def test_incremental_edits_match_full_compile():
+    rng = random.Random(1)
+    compiler = IncrementalCompiler()
+    source = LIBRARY
+    compiler.update(source)
+    snippets = ["F4 1/4 ", "R 1/8 ", "riff ", "[D4 A4] 1/4 ", "\n"]
+    for _ in range(50):
+        # Insert or delete inside a sequence body
+        braces = [i for i, c in enumerate(source) if c == "{"]
+        position = rng.choice(braces) + 2
+        if rng.random() < 0.6:
+            snippet = rng.choice(snippets)
+            if snippet == "riff " and source.rfind("riff", 0, position) > (
+                source.rfind("}", 0, position)
+            ):
+                continue  # riff referencing itself would be circular
+            source = source[:position] + snippet + source[position:]
+        else:
+            end = source.index("}", position)
+            cut = source[position:end].find(" 1/")
+            if cut > 0:
+                source = source[:position] + source[position + cut + 5 :]
+        program = compiler.update(source)
+        assert program == parse(source)
+        assert compiler.generate() == MIDIGenerator().generate(parse(source))
+
+
+def test_incremental_edits_at_any_offset_match_rebuild():
+    snippets = [
+        "x",
+        "5",
+        " ",
+        "\n",
+        "{",
+        "}",
+        "1/4 ",
+        "C4 ",
+        "riff",
+        "tempo ",
+        "sequence ",
+        "play ",
+        "tempo 90\n",
+        "sequence s { C4 1/8 }\n",
+    ]
+    rng = random.Random(2)
+    for step in range(1000):
+        if step % 100 == 0:
+            # Start over before the source decays into noise
+            source = LIBRARY.replace(
+                "play main", "tempo 96sequence t { R 1/4 }play main"
+            )
+            compiler = IncrementalCompiler()
+            compiler.update(source)
+        # Half the edits land at or next to a statement boundary
+        if rng.random() < 0.5:
+            position = rng.choice(compiler.chunks).start + rng.randint(-2, 1)
+            position = max(0, min(position, len(source)))
+        else:
+            position = rng.randint(0, len(source))
+        if rng.random() < 0.6:
+            source = source[:position] + rng.choice(snippets) + source[position:]
+        else:
+            source = source[:position] + source[position + rng.randint(1, 4) :]
+        program = compiler.update(source)
+        fresh = IncrementalCompiler()
+        assert program == fresh.update(source)
+        assert compiler.errors == fresh.errors
+        if not compiler.errors:
+            assert program == parse(source)
+
+
+def test_incremental_reparses_only_edited_sequence():
+    compiler = IncrementalCompiler()
+    compiler.update(LIBRARY)
+    compiler.generate()
+    edited = LIBRARY.replace("R 1/4 D4", "R 1/4 F4")
+    compiler.update(edited)
+    assert compiler.reparsed == ["bridge"]
+    assert compiler.invalidated == {"bridge", "main"}
+    assert compiler.relexed_bytes < len(edited) // 3
+    assert compiler.generate() == MIDIGenerator().generate(parse(edited))
+
+
+def test_incremental_recovers_from_unbalanced_braces():
+    compiler = IncrementalCompiler()
+    compiler.update(LIBRARY)
+    broken = LIBRARY.replace("sequence bridge {", "sequence bridge")
+    compiler.update(broken)
+    assert compiler.errors
+    program = compiler.update(LIBRARY)
+    assert not compiler.errors
+    assert program == parse(LIBRARY)
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
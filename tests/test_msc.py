@@ -0,0 +1,122 @@
+import struct
+
+import pytest
+from midiscript.cli import MSC_SUFFIX, main
+from midiscript.lexer import Lexer
+from midiscript.midi_generator import MIDIGenerator
+from midiscript.msc import (
+    MSC_SUFFIX as FORMAT_SUFFIX,
+    CompiledProgram,
+    PackedNotes,
+    load_msc,
+    load_program,
+    write_msc,
+)
+from midiscript.parser import Parser
+
+SOURCE = """tempo 96
+time 3/4
+sequence riff { C4 1/4 [E4 G4 B4] 1/8 R 1/8 D#5 1/16 }
+sequence verse { riff F3 1/2 riff }
+sequence unused { missing }
+play verse channel 2 velocity 70
+play riff
+"""
+
+
+def parse(source):
+    return Parser(Lexer(source).token_stream()).parse()
+
+
+def write(tmp_path, source=SOURCE):
+    source_path = tmp_path / "song.ms"
+    source_path.write_text(source)
+    path = tmp_path / "song.msc"
+    with open(path, "wb") as f:
+        write_msc(parse(source), f, str(source_path))
+    return str(path)
+
+
+@pytest.mark.parametrize("backend", MIDIGenerator.BACKENDS)
+def test_round_trip_renders_identical_midi(tmp_path, backend):
+    program = load_msc(write(tmp_path))
+    assert isinstance(program, CompiledProgram)
+    assert isinstance(program.sequences["riff"].notes, PackedNotes)
+    expected = MIDIGenerator(backend=backend).generate(parse(SOURCE))
+    assert MIDIGenerator(backend=backend).generate(program) == expected
+
+
+def test_header_fields(tmp_path):
+    program = load_msc(write(tmp_path))
+    assert program.tempo is not None and program.tempo.value == 96
+    assert program.time_signature is not None
+    assert (program.time_signature.numerator, program.time_signature.denominator) == (
+        3,
+        4,
+    )
+    assert [(t.sequence, t.channel, t.velocity) for t in program.tracks] == [
+        ("verse", 2, 70),
+        ("riff", 1, None),
+    ]
+    assert program.main_sequence == "riff"
+    # Sequences that cannot compile and are never played are left out
+    assert list(program.sequences) == ["riff", "verse"]
+    riff = program.sequences["riff"].notes
+    assert len(riff) == 5
+    assert [block.note_total for block in program.sequences.values()] == [5, 11]
+    assert riff[1] == (120, 60, 64, 0)
+    assert riff[-1] == tuple(list(riff)[-1])
+
+
+def test_played_sequence_errors_are_raised(tmp_path):
+    with pytest.raises(ValueError, match="Referenced sequence 'missing'"):
+        write(tmp_path, "sequence main { missing }\nplay main\n")
+
+
+def test_version_mismatch_falls_back_to_source(tmp_path):
+    path = write(tmp_path)
+    with open(path, "r+b") as f:
+        f.seek(4)
+        f.write(struct.pack("<H", 99))
+    program = load_program(path)
+    assert not isinstance(program, CompiledProgram)
+    assert MIDIGenerator().generate(program) == MIDIGenerator().generate(parse(SOURCE))
+    (tmp_path / "song.ms").unlink()
+    with pytest.raises(ValueError, match="format version 99"):
+        load_program(path)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "song.msc"
+    for data in (b"", b"MThd\x00\x00\x00\x06"):
+        path.write_bytes(data)
+        with pytest.raises(ValueError, match="not a compiled MidiScript program"):
+            load_msc(str(path))
+
+
+def test_cli_emit_and_compile(tmp_path, capsys):
+    assert MSC_SUFFIX == FORMAT_SUFFIX
+    song = tmp_path / "song.ms"
+    song.write_text(SOURCE)
+    main(["compile", str(song), "--emit=msc"])
+    assert "compiled program" in capsys.readouterr().out
+    main([str(tmp_path / "song.msc"), "-o", str(tmp_path / "from_msc.mid")])
+    main([str(song), "--no-cache", "-o", str(tmp_path / "from_text.mid")])
+    assert (tmp_path / "from_msc.mid").read_bytes() == (
+        tmp_path / "from_text.mid"
+    ).read_bytes()
+
+
+def test_repeat_bodies_round_trip(tmp_path):
+    source = (
+        "sequence riff { C4 1/4 [E4 G4] 1/8 }\n"
+        "sequence main { repeat 3 { riff repeat 2 { D4 1/16 } } riff }\nplay main\n"
+    )
+    program = load_msc(write(tmp_path, source))
+    assert list(program.sequences) == ["riff", "main"]
+    (_, body, count), _ = program.sequences["main"].calls
+    assert (
+        count == 3 and body.name == "" and body.calls[0][1] is program.sequences["riff"]
+    )
+    expected = MIDIGenerator().generate(parse(source))
+    assert MIDIGenerator().generate(program) == expected
@@ -0,0 +1,82 @@
+import asyncio
+import io
+
+import pytest
+from midiscript.cli import main
+from midiscript.lexer import Lexer
+from midiscript.parser import Parser
+from midiscript.playback import (
+    FileSink,
+    JitterStats,
+    MemorySink,
+    Scheduler,
+    open_sink,
+    percentile,
+    play,
+)
+
+SONG = (
+    "tempo 240\nsequence riff { C4 1/4 [E4 G4] 1/8 R 1/8 }\n"
+    "sequence main { riff riff D4 1/4 }\nplay main"
+)
+
+
+def parse(source: str):
+    return Parser(Lexer(source).token_stream()).parse()
+
+
+def test_play_sends_messages_in_order():
+    sink = MemorySink()
+    stats = play(parse(SONG), sink, speed=20)
+    messages = [message for _, message in sink.messages]
+    assert messages[:4] == [
+        bytes((0x90, 60, 100)),
+        bytes((0x80, 60, 100)),
+        bytes((0x90, 64, 100)),
+        bytes((0x90, 67, 100)),
+    ]
+    assert len(messages) == 14
+    times = [elapsed for elapsed, _ in sink.messages]
+    assert times == sorted(times)
+    assert stats.summary()["events"] == 14
+
+
+def test_deadlines_do_not_drift():
+    # 200 events a millisecond apart: chained sleeps would accumulate each
+    # wake-up delay, absolute deadlines keep the total on schedule.
+    events = [(tick, bytes((0x90, 60, 100))) for tick in range(200)]
+    scheduler = Scheduler(tempo=60, ppq=1000)
+    stats = asyncio.run(scheduler.play(events, MemorySink()))
+    assert 0.199 <= stats.duration < 0.25
+    assert min(stats.latencies) >= 0
+
+
+def test_file_sink():
+    log = io.StringIO()
+    asyncio.run(Scheduler(speed=100).play([(0, b"\x90\x3c\x64")], FileSink(log)))
+    assert log.getvalue().endswith(" 90 3c 64\n")
+
+
+def test_percentiles():
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 2.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.99) == 4.0
+    stats = JitterStats()
+    for latency in (0.001, 0.002, 0.003):
+        stats.record(latency)
+    summary = stats.summary()
+    assert summary["p50"] == pytest.approx(2.0)
+    assert summary["max"] == pytest.approx(3.0)
+
+
+def test_unknown_sink():
+    with pytest.raises(ValueError, match="Unknown playback sink"):
+        open_sink("speaker")
+
+
+def test_play_from_cli(tmp_path, capsys):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    log = tmp_path / "play.log"
+    main([str(song), "--play", f"file:{log}", "--speed", "20"])
+    assert "played 14 events" in capsys.readouterr().out
+    assert len(log.read_text().splitlines()) == 14
@@ -0,0 +1,90 @@
+import json
+import threading
+
+import pytest
+from midiscript import client
+from midiscript.lexer import Lexer
+from midiscript.midi_generator import MIDIGenerator
+from midiscript.parser import Parser
+from midiscript.server import CompileServer, parse_address
+
+SONG = "tempo 90\nsequence main { C4 1/4 [E4 G4] 1/2 }\nplay main\n"
+
+
+@pytest.fixture(scope="module", params=["unix", "tcp"])
+def server(request, tmp_path_factory):
+    address = f"unix:{tmp_path_factory.mktemp('server') / 'midiscript.sock'}"
+    if request.param == "tcp":
+        address = "127.0.0.1:0"
+    server = CompileServer(address, workers=1, max_concurrent=1, queue_timeout=0.1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def expected(source: str) -> bytes:
+    return MIDIGenerator().generate(Parser(Lexer(source).token_stream()).parse())
+
+
+def test_compile_source_and_path(server, tmp_path):
+    before = client.stats(server.url)
+    assert client.compile(server.url, source=SONG) == expected(SONG)
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    assert client.compile(server.url, path=str(song)) == expected(SONG)
+
+    stats = client.stats(server.url)
+    assert stats["requests"] - before["requests"] == 2
+    assert stats["errors"] == before["errors"]
+    assert stats["latency_ms"]["p50"] > 0
+
+
+def test_compile_errors(server, tmp_path):
+    errors = client.stats(server.url)["errors"]
+    with pytest.raises(client.ServerError, match="Expected '}'") as error:
+        client.compile(server.url, source="sequence main { C4 1/4")
+    assert error.value.status == 422
+    with pytest.raises(client.ServerError, match="Could not find file"):
+        client.compile(server.url, path=str(tmp_path / "missing.ms"))
+    assert client.stats(server.url)["errors"] == errors + 2
+
+
+def test_malformed_requests(server):
+    for body in (b"[]", b'"x"', b"1", b"{"):
+        connection = client.connect(server.url, timeout=10)
+        try:
+            connection.request("POST", "/compile", body=body)
+            response = connection.getresponse()
+            assert response.status == 400
+            assert "Malformed request" in json.loads(response.read())["error"]
+        finally:
+            connection.close()
+
+
+def test_concurrency_limit(server):
+    rejected = client.stats(server.url)["rejected"]
+    server.slots.acquire()  # occupy the only slot
+    try:
+        with pytest.raises(client.ServerError) as error:
+            client.compile(server.url, source=SONG)
+        assert error.value.status == 503
+    finally:
+        server.slots.release()
+    assert client.stats(server.url)["rejected"] == rejected + 1
+
+
+def test_client_main(server, tmp_path, capsys):
+    song = tmp_path / "song.ms"
+    song.write_text(SONG)
+    with pytest.raises(SystemExit) as exit:
+        client.main([str(song), "--server", server.url])
+    assert exit.value.code == 0
+    assert (tmp_path / "song.mid").read_bytes() == expected(SONG)
+
+
+def test_listens_on_loopback_only():
+    assert parse_address("9000") == ("127.0.0.1", 9000)
+    with pytest.raises(ValueError, match="non-local"):
+        parse_address("0.0.0.0:9000")
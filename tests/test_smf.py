@@ -0,0 +1,399 @@
+import io
+import struct
+from typing import List, Tuple
+
+import pytest
+from midiscript import parser, smf
+from midiscript.lexer import Lexer
+from midiscript.parser import Parser
+from midiscript.midi_generator import MIDIGenerator
+from midiscript.numpy_backend import available as numpy_available
+from midiscript.smf import MIDIUtilWriter, SMFWriter, encode_vlq
+
+
+def read_vlq(data: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def note_events(data: bytes, in_order: bool = False) -> List[Tuple[int, int, int, int]]:
+    """Decode (tick, status, pitch, velocity) for every channel event, sorted
+    or in file order."""
+    assert data[:4] == b"MThd"
+    _, _, num_tracks, _ = struct.unpack(">IHHH", data[4:14])
+    pos = 14
+    events = []
+    for _ in range(num_tracks):
+        assert data[pos : pos + 4] == b"MTrk"
+        (length,) = struct.unpack(">I", data[pos + 4 : pos + 8])
+        pos += 8
+        end = pos + length
+        tick = 0
+        while pos < end:
+            delta, pos = read_vlq(data, pos)
+            tick += delta
+            status = data[pos]
+            if status == 0xFF:
+                size, pos = read_vlq(data, pos + 2)
+                pos += size
+            else:
+                events.append((tick, status & 0xF0, data[pos + 1], data[pos + 2]))
+                pos += 3
+    return events if in_order else sorted(events)
+
+
+def compile_source(source: str, backend: str = "smf") -> bytes:
+    program = Parser(Lexer(source).tokenize()).parse()
+    return MIDIGenerator(backend=backend).generate(program)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (0, b"\x00"),
+        (0x40, b"\x40"),
+        (0x7F, b"\x7f"),
+        (0x80, b"\x81\x00"),
+        (0x2000, b"\xc0\x00"),
+        (0x3FFF, b"\xff\x7f"),
+        (0x0FFFFFFF, b"\xff\xff\xff\x7f"),
+    ],
+)
+def test_encode_vlq(value, expected):
+    assert encode_vlq(value) == expected
+    assert read_vlq(expected, 0) == (value, len(expected))
+
+
+def test_encode_vlq_out_of_range():
+    with pytest.raises(ValueError):
+        encode_vlq(0x10000000)
+    with pytest.raises(ValueError):
+        encode_vlq(-1)
+
+
+def test_writer_layout():
+    writer = SMFWriter(1, ppq=480)
+    writer.add_tempo(0, 120)
+    writer.add_time_signature(0, 3, 4)
+    writer.add_note(0, 0, 60, 0, 480, 100)
+    data = writer.to_bytes()
+    assert data[:14] == b"MThd" + struct.pack(">IHHH", 6, 1, 2, 480)
+    # tempo: 500000 microseconds per quarter note
+    assert b"\xff\x51\x03\x07\xa1\x20" in data
+    # time signature 3/4 with the denominator stored as a power of two
+    assert b"\xff\x58\x04\x03\x02\x18\x08" in data
+    assert note_events(data) == [(0, 0x90, 60, 100), (480, 0x80, 60, 100)]
+
+
+def test_time_signature_requires_power_of_two():
+    with pytest.raises(ValueError):
+        SMFWriter().add_time_signature(0, 4, 3)
+
+
+@pytest.mark.parametrize(
+    "add, message",
+    [
+        (lambda w: w.add_tempo(0, 0), "Tempo must be between 4 and 60000000 bpm"),
+        (lambda w: w.add_tempo(0, 3), "Tempo must be between 4 and 60000000 bpm"),
+        (
+            lambda w: w.add_time_signature(0, 256, 4),
+            "Time signature numerator must be between 1 and 255",
+        ),
+    ],
+)
+def test_meta_events_out_of_range(add, message):
+    for writer in (SMFWriter(), MIDIUtilWriter()):
+        with pytest.raises(ValueError, match=message):
+            add(writer)
+
+
+def test_parser_limits_match_encoder():
+    assert (parser.MIN_TEMPO, parser.MAX_TEMPO, parser.MAX_NUMERATOR) == (
+        smf.MIN_TEMPO,
+        smf.MAX_TEMPO,
+        smf.MAX_NUMERATOR,
+    )
+
+
+def test_generate_does_not_touch_disk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = compile_source("sequence main { C4 1/4 }")
+    assert data.startswith(b"MThd")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_to_file_object():
+    program = Parser(Lexer("sequence main { C4 1/4 [C4 E4] 1/2 }").tokenize()).parse()
+    generator = MIDIGenerator()
+    buf = io.BytesIO()
+    generator.write(program, buf)
+    assert buf.getvalue() == generator.generate(program)
+
+
+def test_matches_midiutil_backend():
+    source = "sequence main { C4 1/4 C4 1/8 [C4 E4 G4] 1/2 R 1/4 D4 3/8 }"
+    assert note_events(compile_source(source)) == note_events(
+        compile_source(source, backend="midiutil")
+    )
+
+
+def test_numpy_backend_matches_smf():
+    pytest.importorskip("numpy")
+    source = (
+        "sequence riff { C4 1/4 [C4 E4 G4] 1/8 R 64/1 Bb3 3/8 }\n"
+        "sequence main { riff D#5 1/16 riff R 1/3 riff }\nplay main"
+    )
+    assert compile_source(source, backend="numpy") == compile_source(source)
+
+
+def test_numpy_backend_matches_smf_on_repeats():
+    pytest.importorskip("numpy")
+    # Overlapping and zero-length notes from different blocks share ticks,
+    # so the order notes were emitted in decides ties
+    source = (
+        "sequence a { C4 1/8 [E4 G4] 0/1 C4 1/16 }\n"
+        "sequence b { D4 1/4 repeat 3 { a R 1/8 C4 1/8 } a }\n"
+        "sequence main { repeat 50 { a } b E4 1/2 repeat 4 { repeat 2 { b } a } }\n"
+        "play main channel 2 velocity 80\nplay b"
+    )
+    assert compile_source(source, backend="numpy") == compile_source(source)
+    parser = Parser(Lexer(source).token_stream())
+    generator = MIDIGenerator(backend="numpy")
+    generator.generate(parser.parse())
+    assert not parser.errors
+    assert generator.note_count == 50 * 4 + 20 + 1 + 4 * (2 * 20 + 4) + 20
+
+
+def test_numpy_writer_add_note():
+    pytest.importorskip("numpy")
+    from midiscript.numpy_backend import NumpyWriter
+
+    notes = [(0, 480, 60, 100), (480, 20000, 64, 90), (480, 3, 67, 80)]
+    writers = [SMFWriter(1), NumpyWriter(1)]
+    for writer in writers:
+        writer.add_tempo(0, 90)
+        for tick, duration, pitch, velocity in notes:
+            writer.add_note(0, 3, pitch, tick, duration, velocity)
+    assert writers[0].to_bytes() == writers[1].to_bytes()
+
+
+def test_numpy_backend_falls_back_without_numpy(monkeypatch):
+    from midiscript import numpy_backend
+
+    monkeypatch.setattr(numpy_backend, "np", None)
+    with pytest.warns(UserWarning):
+        generator = MIDIGenerator(backend="numpy")
+    assert generator.backend == "smf"
+    assert generator.generate(
+        Parser(Lexer("sequence main { C4 1/4 }").tokenize()).parse()
+    ).startswith(b"MThd")
+
+
+@pytest.mark.parametrize("backend", ["smf", "numpy"])
+def test_hour_long_render_is_tick_exact(backend):
+    if backend == "numpy":
+        pytest.importorskip("numpy")
+    # 1/10 and 1/3 durations are inexact in binary floating point; at 120 bpm
+    # 7200 beats is one hour, reached through nested references.
+    source = (
+        "tempo 120\n"
+        "sequence bar { C4 1/10 E4 1/10 G4 1/10 C5 1/10 E5 1/10 "
+        "[C4 G4] 1/10 D4 1/10 F4 1/10 A4 1/10 B4 1/10 C4 1/3 D4 1/3 E4 1/3 }\n"
+        "sequence phrase { " + "bar " * 30 + "}\n"
+        "sequence main { " + "phrase " * 120 + "}\nplay main"
+    )
+    program = Parser(Lexer(source).token_stream()).parse()
+    generator = MIDIGenerator(backend=backend)
+    data = generator.generate(program)
+    assert generator.time == 7200 * 480
+    assert generator.duration_ticks == {(1, 10): 48, (1, 3): 160}
+
+    onsets = sorted(
+        {tick for tick, status, _, _ in note_events(data) if status == 0x90}
+    )
+    bar = [0, 48, 96, 144, 192, 240, 288, 336, 384, 432, 480, 640, 800]
+    assert onsets == [b * 960 + tick for b in range(3600) for tick in bar]
+    assert max(tick for tick, _, _, _ in note_events(data)) == 7200 * 480
+
+
+@pytest.mark.parametrize("backend", ["smf", "numpy"])
+def test_short_durations_do_not_drift(backend):
+    if backend == "numpy":
+        pytest.importorskip("numpy")
+    # 1/64 and 1/7 of a beat are not whole ticks at 480 ppq; rounding each
+    # note would put the following note at 64/15 and 161/16 beats.
+    for events, beats in [
+        ("C4 1/64 " * 256, 4),
+        ("repeat 256 { C4 1/64 }", 4),
+        ("C4 1/7 " * 70, 10),
+        ("repeat 10 { C4 1/7 C4 1/7 C4 1/7 C4 1/7 C4 1/7 C4 1/7 C4 1/7 }", 10),
+    ]:
+        source = f"sequence main {{ {events} D4 1/4 }}\nplay main"
+        program = Parser(Lexer(source).token_stream()).parse()
+        generator = MIDIGenerator(backend=backend)
+        data = generator.generate(program)
+        (ppq,) = struct.unpack(">H", data[12:14])
+        assert ppq == generator.ppq and ppq % 480 == 0
+        onsets = [
+            tick
+            for tick, status, pitch, _ in note_events(data)
+            if status == 0x90 and pitch == 62
+        ]
+        assert onsets == [beats * ppq]
+        assert b"".join(MIDIGenerator().stream(program)) == data
+
+
+class Pipe(io.RawIOBase):
+    """Write-only, non-seekable sink, like standard output into a pipe."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+STREAMED = (
+    "tempo 96\ntime 3/4\n"
+    "sequence riff { C4 1/4 [C4 E4 G4] 1/8 R 64/1 Bb3 3/8 }\n"
+    "sequence verse { riff D#5 1/16 riff }\n"
+    "sequence main { verse R 1/3 [C4 C4] 1/2 verse riff }\nplay main"
+)
+
+
+def test_stream_matches_generate():
+    program = Parser(Lexer(STREAMED).token_stream()).parse()
+    expected = MIDIGenerator().generate(program)
+    assert b"".join(MIDIGenerator().stream(program, chunk_size=16)) == expected
+
+    seekable = io.BytesIO()
+    MIDIGenerator().write_stream(program, seekable, chunk_size=16)
+    assert seekable.getvalue() == expected
+
+    pipe = Pipe()
+    MIDIGenerator().write_stream(program, pipe)
+    assert bytes(pipe.data) == expected
+
+
+def test_zero_length_notes_are_released_after_they_start():
+    source = (
+        "sequence main { C4 1/4 C4 0/4 [E4 G4] 0/8 E4 1/4 R 1/4 D4 0/1 }\nplay main"
+    )
+    program = Parser(Lexer(source).token_stream()).parse()
+    expected = MIDIGenerator().generate(program)
+    assert note_events(expected, in_order=True) == [
+        (0, 0x90, 60, 100),
+        (120, 0x80, 60, 100),
+        (120, 0x90, 60, 100),
+        (120, 0x90, 64, 100),
+        (120, 0x90, 67, 100),
+        (120, 0x90, 64, 100),
+        (120, 0x80, 60, 100),
+        (120, 0x80, 64, 100),
+        (120, 0x80, 67, 100),
+        (240, 0x80, 64, 100),
+        (360, 0x90, 62, 100),
+        (360, 0x80, 62, 100),
+    ]
+    assert b"".join(MIDIGenerator().stream(program)) == expected
+    if numpy_available():
+        assert MIDIGenerator(backend="numpy").generate(program) == expected
+
+
+def test_stream_yields_bounded_chunks():
+    source = (
+        "sequence bar { C4 1/8 E4 1/8 }\n"
+        "sequence main { " + "bar " * 5000 + "}\nplay main"
+    )
+    program = Parser(Lexer(source).token_stream()).parse()
+    chunks = list(MIDIGenerator().stream(program, chunk_size=1024))
+    assert len(chunks) > 10
+    assert max(len(chunk) for chunk in chunks[2:]) < 1024 + 16
+
+
+def test_stream_rejects_unordered_notes():
+    from midiscript.smf import iter_note_track
+
+    with pytest.raises(ValueError, match="start order"):
+        list(iter_note_track([(480, 10, 60, 100, 0), (0, 10, 62, 100, 0)]))
+
+
+ENSEMBLE = (
+    "tempo 100\nsequence riff { C4 1/4 [E4 G4] 1/8 R 1/8 }\n"
+    "sequence bass { C2 1/2 riff G2 1/2 }\n"
+    "sequence lead { riff riff D5 1/4 }\n"
+    "play lead velocity 90\nplay bass channel 2\nplay riff channel 10 velocity 40\n"
+)
+
+
+def track_notes(data: bytes) -> List[List[Tuple[int, int, int, int]]]:
+    """Decode (tick, status, pitch, velocity) per track, keeping the channel."""
+    _, _, num_tracks, _ = struct.unpack(">IHHH", data[4:14])
+    pos = 14
+    tracks = []
+    for _ in range(num_tracks):
+        (length,) = struct.unpack(">I", data[pos + 4 : pos + 8])
+        pos += 8
+        end = pos + length
+        tick = 0
+        events = []
+        while pos < end:
+            delta, pos = read_vlq(data, pos)
+            tick += delta
+            if data[pos] == 0xFF:
+                size, pos = read_vlq(data, pos + 2)
+                pos += size
+            else:
+                events.append((tick, data[pos], data[pos + 1], data[pos + 2]))
+                pos += 3
+        tracks.append(events)
+    return tracks
+
+
+def test_multiple_play_targets_become_tracks():
+    data = compile_source(ENSEMBLE)
+    conductor, lead, bass, riff = track_notes(data)
+    assert conductor == []
+    assert {(status, velocity) for _, status, _, velocity in lead} == {
+        (0x90, 90),
+        (0x80, 90),
+    }
+    assert {status for _, status, _, _ in bass} == {0x91, 0x81}
+    assert {(status, velocity) for _, status, _, velocity in riff} == {
+        (0x99, 40),
+        (0x89, 40),
+    }
+    # Every track starts at the beginning of the song
+    assert lead[0][0] == bass[0][0] == riff[0][0] == 0
+
+
+@pytest.mark.parametrize("backend", ["smf", "numpy"])
+def test_parallel_tracks_match_serial(backend):
+    if backend == "numpy":
+        pytest.importorskip("numpy")
+    program = Parser(Lexer(ENSEMBLE).token_stream()).parse()
+    serial = MIDIGenerator(backend=backend).generate(program)
+    assert MIDIGenerator(backend=backend, workers=2).generate(program) == serial
+    assert serial == compile_source(ENSEMBLE)
+    assert b"".join(MIDIGenerator().stream(program)) == serial
+
+
+def test_multiple_tracks_match_midiutil_backend():
+    assert track_notes(compile_source(ENSEMBLE)) == track_notes(
+        compile_source(ENSEMBLE, backend="midiutil")
+    )
+
+
+def test_play_option_range():
+    parser = Parser(Lexer("sequence a { C4 1/4 }\nplay a channel 17").tokenize())
+    parser.parse()
+    assert parser.errors == ["Channel must be between 1 and 16 at line 2, column 16"]